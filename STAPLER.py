@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 
 import datetime
+import json
+import math
 import multiprocessing
 import logging
 import os
+import pipes
+import shlex
 import sys
 import shutil
 import string
+import subprocess
 import time
 
 
@@ -17,6 +22,14 @@ try:
     from modules.directory import Directory
     from modules import STAPLERerror
     from modules import AvailableCommands
+    from modules import launcher
+    from modules import output_compression
+    from modules import read_groups
+    from modules import reference
+    from modules import report
+    from modules import resources
+    from modules import scatter
+    from modules import submission
     from modules import utils
 except SyntaxError:
     if sys.version_info[0:2] < (2,7):
@@ -93,6 +106,25 @@ Create necessary files for parallel TORQUE multiple job run. Staplerfile path
 is required. NOTICE! This is an experimental feature, please report any
 feedback to jaakko.tyrmi@gmail.com
 
+--submit
+Submit the generated workload files to the resource manager (sbatch, qsub or
+bsub) in order. The jobs of each workflow part are set to wait until the jobs
+of the previous part have finished, so the whole workflow is submitted with a
+single command. Failed IDs are skipped by the following parts (see
+--keep_going), so the parts wait for the previous part to finish in any
+state and continue with the rest of the IDs. With --keep_going nothing is
+skipped and the parts wait for the previous part to finish successfully.
+After a failure the jobs waiting for it are cancelled with SLURM
+(--kill-on-invalid-dep=yes) and left pending with LSF and TORQUE, while SGE
+starts them once the previous part has finished in any state. The job IDs
+are recorded to STAPLER_submitted_jobs.json in the output directory (see
+--status). May be used with --lsf, --sge, --slurm and --torque.
+
+--submit_backend <lsf|sge|slurm|torque|stub>
+Backend used for the submission with --submit. By default the backend of the
+selected resource manager is used. The stub backend does not submit anything
+and can be used for testing.
+
 PARALLELIZATION PARAMETERS:
 
 --max_job_count
@@ -101,6 +133,97 @@ two or more jobs are merged to reduce job count. By default the job count is
 not limited and it equals the number of input data files. Staplerfile path is
 required.
 
+--bundle_size <job_count>
+Number of jobs to run one after another in each array task. Bundling
+reduces the scheduling overhead of workflows consisting of a large number of
+short jobs. Remember to request enough run time for the bundled jobs (or use
+--right_size). May be used with --lsf, --sge, --slurm and --torque.
+
+--bundle_time <[D-]HH:MM:SS>
+Target run time of each array task. Jobs are bundled into array tasks until
+the run time predicted by the resource model (see --learn_resources) would
+exceed the target. Jobs of workflow parts containing tools that the model has
+not yet learned are not bundled. Can not be used with --bundle_size.
+
+--max_array_size <task_count>
+Maximum number of tasks in a single array job (default 1000). Workflow parts
+with more tasks are split into several array jobs of roughly equal size,
+each with a submission file of its own. The value should not exceed the
+array size limit of the resource manager (e.g. MaxArraySize of SLURM).
+
+--max_concurrent <task_count>
+Maximum number of tasks of each array job running at the same time. Use this
+to limit the load on shared file systems without reducing the number of jobs.
+The limit applies to each array job separately, including the array jobs of
+split workflow parts (see --max_array_size). With --pack the value limits the
+number of tasks the dispatcher runs at the same time. May be used with --lsf,
+--sge, --slurm and --torque.
+
+--pack <cores_per_node>
+Pack the jobs of each workflow part into a single job allocating a whole node
+with the given number of cores instead of submitting an array job. The jobs
+are run inside the allocation by a task dispatcher, which keeps the cores of
+the node busy. The resource requests for cores and nodes in the staplefile are
+replaced. The jobs are run in waves of as many jobs as fit on the node, so the
+run time request of the staplefile is multiplied by the number of waves. May be
+used with --lsf, --sge, --slurm and --torque.
+
+--pack_threads <thread_count>
+Number of cores reserved for each job of a packed workflow part (default 1).
+The node runs --pack / --pack_threads jobs at a time. The value is available
+to the jobs in the STAPLER_TASK_THREADS environment variable, which is used by
+the multi-threaded output compressors.
+
+--resumable
+Make the subshell files resumable, so that a job that is requeued after
+preemption or node failure skips the commands it has already finished. A
+completion marker is written for each finished command into the
+STAPLER_markers directory of the output directory, and a command is skipped
+if its marker and predicted output files exist. Output files are written
+under temporary names (prefix .stapler_tmp.) and renamed when the command
+succeeds, so partially written outputs are never mistaken for finished ones.
+A failed command is not marked as finished, and the following commands of
+its IDs are skipped (see --keep_going). The jobs are submitted as requeueable
+(e.g. #SBATCH --requeue).
+
+--keep_going
+Keep running the following commands of a subshell when a command fails. By
+default each command line is run with pipefail, and a failure of any of its
+statements or pipes, or of decompressing an input file, marks the command as
+failed. The rest of the command and the following commands processing the
+same IDs are skipped, while the commands of other IDs in the same subshell
+(see --bundle_size, --bundle_time and --max_job_count) are still run. The IDs
+of the failed command are recorded into the STAPLER_failed directory of the
+output directory as <id>__WORKLOAD_<n>.failed files, and commands of the
+following workloads processing these IDs are skipped, so that a bad input
+does not keep the rest of the pipeline running on missing or truncated
+files. The IDs of a running command are recorded as <id>__WORKLOAD_<n>.running
+files, which are removed when the command ends, so the IDs of a job killed by
+the resource manager (e.g. for exceeding its memory or time limit) are
+skipped as well. The subshell exits with the code of the first failed
+command, or with code 125 if commands were only skipped. The following
+workflow parts submitted with --submit are started once the previous part has
+finished, and continue with the IDs that did not fail. The failed and
+interrupted IDs are listed by --status.
+A successful rerun of the failed command (e.g. --fix_run or --retry)
+removes its records.
+
+--watchdog
+Kill commands that hang. Each command line is run through the launcher (see
+--telemetry), which kills the command if neither the .out and .err files of
+the job nor the output files of the command have grown during the stall
+timeout of the tool (60 minutes for most tools). Output written into pipes
+(e.g. by srun with --job_steps) is relayed and counted by the launcher. A
+killed command exits with code 124 and is handled as a failed command, and
+the reason is written to the .err file and to a stall log of the workload
+(STAPLER_WORKLOAD_<n>_stalls.jsonl) in the output directory. Tasks killed
+this way are retried by --retry. Python must be available when the workflow
+is run.
+
+--stall_timeout <minutes>
+Stall timeout of all commands for --watchdog, overriding the default stall
+timeouts of the tools.
+
 --priority
 Parallelization priority. Staplerfile path is required. This parameter has no
 effect on manually defined split points of staplerfile. Available values are:
@@ -129,14 +252,127 @@ change resource manager parameters (run time, max RAM, etc.). Staplerfile
 path is required.
 
 --compress
-Compresses finished run results (except .bam/.bai files). Staplerfile path is
-required. May be used in combination with --slurm <core_count>. NOTICE,
-experimental feature.
+Compresses finished run results (except already compressed and .bam/.bai/.cram
+files). Staplerfile path is required. May be used in combination with --slurm
+<core_count>. The files are distributed to jobs so that each job handles
+roughly the same amount of data. The recommended run time is estimated by
+compressing a sample of the largest file with the selected compressor.
+NOTICE, experimental feature.
 
 --decompress
 Decompresses finished run results. Staplerfile path is required. May be used in
 combination with --slurm <core_count>. NOTICE, experimental feature.
 
+--compressor <gzip|pigz|bgzip|zstd>
+Compression program to use with --compress and --decompress (default gzip).
+Files compressed with bgzip can be indexed with tabix and remain readable with
+gzip, so bgzip is recommended for .fastq and .vcf files. Files compressed with
+zstd get .zst file extension.
+
+--compress_threads <thread_count>
+Number of threads each (de)compression command uses (default 1). Can not be
+used with gzip. Remember to reserve the same number of cores for each job in
+the resource manager parameters of the staplefile.
+
+--telemetry
+Record runtime telemetry for each command of the workflow. Each command line
+is run through a small launcher (modules/launcher.py), which records wall
+time, user and system CPU time, maximum resident set size, I/O bytes and exit
+code of the command. The results are written as one JSON line per command to
+a telemetry file of each workload (STAPLER_WORKLOAD_<n>_telemetry.jsonl) in
+the output directory. Python must be available when the workflow is run.
+
+--job_steps
+Run each command line of the workflow as a SLURM job step of its own with
+srun. The steps are named <tool>:<ids>, so that run time, CPU and memory use
+of each command are shown separately by sacct and can be read with
+--learn_resources. Each step is run with the cores allocated to the task (see
+--pack_threads). When used with --pack, request memory per core
+(--mem-per-cpu) in the staplefile, as otherwise each job step reserves all
+memory of the job. May be used with --slurm only.
+
+--report
+Reports where the run time of a finished run was spent. Timing of each command
+is read from the telemetry files (see --telemetry) or, if the run was made
+without telemetry, from the .out files of the run. Per tool throughput, per
+task makespan, imbalance between the tasks of each workload and the critical
+path through the workflow are printed. In addition a Chrome trace-event file
+(STAPLER_report_trace.json, open with chrome://tracing or Perfetto) and a
+Prometheus textfile (STAPLER_report.prom) are written to the output directory.
+Staplerfile path is required.
+
+--status
+Prints the states of the jobs submitted with --submit. The states are queried
+from the resource manager (sacct, qstat or bjobs) and cached for a minute.
+Failed queries are retried with increasing delays. Staplerfile path is
+required.
+
+--retry
+Resubmits the tasks of the jobs submitted with --submit that have failed
+because of running out of memory, exceeding the time limit, a node failure or
+a hung command killed by --watchdog. The failed tasks of a job are retried
+once all of its tasks have finished. The memory request is doubled for tasks
+that ran out of memory and the time request for tasks that ran out of time.
+Jobs of the following workflow parts are set to wait for the resubmitted
+tasks. Run --retry again (e.g. hourly) to retry tasks that fail later.
+Supported with SLURM only. Staplerfile path is required.
+
+--max_retries <count>
+Maximum number of times each task is retried with --retry (default 2).
+
+--learn_resources
+Updates the resource model with the resource usage of a finished run. Usage is
+read from the telemetry files of the run (see --telemetry) and from resource
+manager accounting files listed with --accounting. For each tool, run time and
+memory use are modeled as a function of the size of the input data (i.e. the
+total size of the starting point directory files of each ID). Staplerfile
+path is required.
+
+--accounting <path1,path2,...>
+Comma separated list of accounting files to read with --learn_resources. The
+files should contain output of either
+sacct -P --format=JobID,Elapsed,MaxRSS,State -j <job ids>
+(add the JobName column to read the usage of each command of a workflow
+generated with --job_steps)
+or
+qacct -j <job id>
+
+--right_size <margin>
+Replaces the run time and memory requests of the staplefile with requests
+predicted by the resource model for each workflow part. The value is the
+safety margin added to the predicted values, e.g. 0.2 for 20 %. The user
+defined values are used for workflow parts containing tools that the model
+has not yet learned. May be used with --lsf, --sge, --slurm and --torque.
+
+--resource_model <path>
+Path to the resource model file to use with --learn_resources and
+--right_size. By default the file resource_model.json in the STAPLER
+installation directory is used.
+
+--reference_cache <path>
+Directory of the reference index cache (by default reference_cache in the
+STAPLER installation directory). When the reference of an aligner or a
+variant caller (e.g. bwa --!reference_path, bowtie2 -x, soap2 -D, GATK -R,
+freebayes -f) is missing its index files (.bwt, .bt2, .fai, .dict, etc.), the
+missing indexes are built in parallel in a workflow part run before the rest
+of the workflow. The indexes are built into the cache directory by the
+checksum of the reference, so each genome is indexed only once for all
+projects using the same cache, and linked next to the reference file. The
+index commands are configured in config.txt as stapler_bwa_index,
+stapler_bowtie2_build, stapler_samtools_faidx,
+stapler_gatk_CreateSequenceDictionary and stapler_soap2_builder.
+
+--output_compressor <bgzip|pigz|zstd|gzip>
+Compressor used for the output files of the tools that pipe their output to
+a compressor (freebayes --!compress_output, vcftools --!compressed_output and
+the -z parameter of the FASTX-Toolkit tools), by default bgzip. The
+compressor uses all the cores allocated to the job by the resource manager
+(e.g. SLURM --cpus-per-task). Output files compressed with zstd get .zst file
+extension. Compressed .vcf files are always written with bgzip, so that they
+can be indexed with tabix. Use the same compressor with --fix_run as when
+the workflow was created. The compressors are configured in config.txt as
+stapler_bgzip, stapler_pigz, stapler_zstd and stapler_gzip.
+
 --remove
 Removes all output directories and all of their contents of a specific workflow.
 Starting point direcory or any of its contents are not removed. Staplerfile
@@ -151,6 +387,62 @@ Tests the validity of config.txt file by checking each command if:
 
 WORKFLOW_CONTROL_KEYWORDS = set(['SPLIT'])
 
+# Tool names of the compression programs available for --compress/--decompress
+COMPRESSORS = {'gzip': 'stapler_gzip',
+               'pigz': 'stapler_pigz',
+               'bgzip': 'stapler_bgzip_in_place',
+               'zstd': 'stapler_zstd'}
+
+# Conservative (de)compression speeds (bytes per second per thread) used to
+# estimate run times if the speed can not be measured
+DEFAULT_COMPRESSION_SPEEDS = {'compress': {'gzip': 20000000,
+                                           'pigz': 20000000,
+                                           'bgzip': 20000000,
+                                           'zstd': 100000000},
+                              'decompress': {'gzip': 60000000,
+                                             'pigz': 60000000,
+                                             'bgzip': 60000000,
+                                             'zstd': 300000000}}
+
+# Maximum number of tasks in a single array job (MaxArraySize of SLURM is 1001
+# by default)
+DEFAULT_MAX_ARRAY_SIZE = 1000
+
+# Shell commands that change the state of the running subshell. These are
+# never run through the runtime command launcher.
+SHELL_STATE_COMMANDS = set(['cd', 'export', 'source', '.', 'set', 'unset',
+                            'alias', 'ulimit', 'umask', 'pushd', 'popd'])
+
+# Number of cores of each SLURM job step (see --job_steps), evaluated by the
+# shell when the command is run
+JOB_STEP_THREADS = '${STAPLER_TASK_THREADS:-${SLURM_CPUS_PER_TASK:-1}}'
+
+# Completion markers of resumable subshells (see --resumable) are written to
+# this subdirectory of the output directory
+MARKER_DIR_NAME = 'STAPLER_markers'
+
+# Prefix of the temporary names of output files of resumable subshells
+TEMP_OUTPUT_PREFIX = '.stapler_tmp.'
+
+# IDs of failed commands are recorded into this subdirectory of the output
+# directory (see --keep_going)
+FAILURE_DIR_NAME = 'STAPLER_failed'
+
+# The IDs of running commands are recorded into the failure directory with
+# this extension, so that the IDs of commands killed by the resource manager
+# are skipped like the IDs of failed commands
+RUNNING_RECORD_EXTENSION = '.running'
+
+# Exit code of subshells skipping commands because an upstream command failed
+# for the same IDs
+UPSTREAM_FAILURE_EXIT_CODE = 125
+
+# Resource manager parameters allowing the jobs to be requeued
+REQUEUE_PARAMETERS = {'lsf': '#BSUB -r',
+                      'sge': '#$ -r y',
+                      'slurm': '#SBATCH --requeue',
+                      'torque': '#PBS -r y'}
+
 def main(args):
     # Parse args for any help function options and exit
     args = args[1:]
@@ -165,8 +457,29 @@ def main(args):
 
     # Parse command line and input file parameters
     command_line_parameters = parse_command_line(args)
+    output_compression.set_output_compressor(command_line_parameters.output_compressor)
     input_file_parameters = parse_input_file(command_line_parameters)
 
+    # Report the run time statistics of a finished run if requested and exit
+    if command_line_parameters.report_run:
+        write_run_report(input_file_parameters)
+        return 0
+
+    # Print the states of the submitted jobs and exit
+    if command_line_parameters.status_run:
+        print_submission_status(input_file_parameters)
+        return 0
+
+    # Resubmit the failed tasks of the submitted jobs and exit
+    if command_line_parameters.retry_run:
+        retry_failed_tasks(input_file_parameters, command_line_parameters)
+        return 0
+
+    # Update the resource model with the usage of a finished run and exit
+    if command_line_parameters.learn_resources:
+        learn_resources(input_file_parameters, command_line_parameters)
+        return 0
+
     # Remove workflow if requested and exit
     if command_line_parameters.rm_workflow:
         dir_stack = infer_dir_stack(input_file_parameters, create_dirs=False)
@@ -223,6 +536,23 @@ def main(args):
                                                              dir_stack,
                                                              command_line_parameters.auto_split_workflows)
 
+    # Missing reference indexes are built before the rest of the workflow
+    if command_line_parameters.compress_run is None:
+        index_commands = reference.index_commands(workloads,
+                                                  command_line_parameters.reference_cache)
+        if index_commands:
+            workloads.insert(0, [index_commands])
+            print('Building {0} missing reference index(es) before the '
+                  'workflow.'.format(len(index_commands)))
+
+    # Read groups assigned by the aligners would be rewritten by a later
+    # AddOrReplaceReadGroups step at the cost of an extra pass over every BAM
+    for aligner in read_groups.find_redundant_read_group_steps(workloads):
+        logging.warning('{0} assigns the read groups already, the following '
+                        'stapler_Picard_AddOrReplaceReadGroups step is '
+                        'redundant and can be removed from the '
+                        'staplefile.'.format(aligner))
+
     # Add dir stacks contents to log file
     log_dir_stacks_contents(dir_stack)
 
@@ -237,6 +567,11 @@ def main(args):
         if command_line_parameters.compress_run is None:
             workloads = determine_job_workloads(workloads,
                                                 command_line_parameters)
+        if command_line_parameters.bundle_size is not None or \
+                command_line_parameters.bundle_time is not None:
+            workloads = bundle_job_workloads(workloads,
+                                             input_file_parameters,
+                                             command_line_parameters)
         # Write output files into an appropriate format
         if command_line_parameters.resource_manager == 'lsf':
             workload_files = write_lsf(workloads, input_file_parameters, command_line_parameters)
@@ -257,6 +592,12 @@ def main(args):
             print '\n\nCreated {0} workflows, which will spawn the following' \
                   ' numbers of respective parallel jobs:\n{1}'.format(len(workloads),
                                                                       ', '.join(map(str, (map(len, workloads)))))
+        if command_line_parameters.resource_manager != 'unix' and \
+                len(workload_files) > len(workloads):
+            print '\nWorkflows with more than {0} jobs have been split into ' \
+                  'several array jobs. The files of the same workflow (e.g. ' \
+                  'WORKLOAD_1_array_1 and WORKLOAD_1_array_2) can be ' \
+                  'submitted at the same time.'.format(command_line_parameters.max_array_size)
 
     # Print out relevant paths and instructions
     print '\nPath to your project directory, which contains all output and ' \
@@ -267,6 +608,12 @@ def main(args):
     print input_file_parameters.output_dir
     print '\n'
 
+    # Submit the workload files if requested
+    if command_line_parameters.submit:
+        submit_workloads(workload_files, input_file_parameters,
+                         command_line_parameters)
+        return 0
+
     if command_line_parameters.resource_manager is None:
         print 'Execute the job now using the following command line:'
     elif command_line_parameters.resource_manager == 'unix':
@@ -311,6 +658,108 @@ def main(args):
     print '\n'
 
 
+def submit_workloads(workload_files, input_file_parameters,
+                     command_line_parameters):
+    """Submits the workload files to the resource manager and prints the job
+    IDs.
+
+    Parameters:
+    workload_files: Paths to the workload files in submission order.
+    input_file_parameters: Run parameters defined in the staplefile.
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Raises:
+    STAPLERerror: Submission failed.
+    """
+    backend = submission.get_backend(command_line_parameters.submit_backend)
+    # Without --keep_going the subshells skip the IDs that have failed in the
+    # previous parts, so the rest of the IDs can continue after a failure
+    if command_line_parameters.keep_going:
+        dependency_type = 'afterok'
+    else:
+        dependency_type = 'afterany'
+    jobs = submission.submit_workloads(workload_files,
+                                       input_file_parameters.output_dir,
+                                       backend,
+                                       dependency_type)
+    print 'Submitted the following jobs:'
+    for job in jobs:
+        if job['dependencies']:
+            print '{0}\t{1} (after {2})'.format(job['job_id'],
+                                                job['workload_file'],
+                                                ', '.join(job['dependencies']))
+        else:
+            print '{0}\t{1}'.format(job['job_id'], job['workload_file'])
+    print '\nCheck the state of the jobs with --status.\n'
+
+
+def print_submission_status(input_file_parameters):
+    """Prints the states of the jobs submitted with --submit.
+
+    Parameters:
+    input_file_parameters: Run parameters defined in the staplefile.
+
+    Raises:
+    STAPLERerror: Nothing has been submitted or the query fails.
+    """
+    latest, cache_age = submission.submission_status(input_file_parameters.output_dir)
+    print 'Jobs submitted at {0}:'.format(latest['submitted'])
+    for job in latest['jobs']:
+        states = ', '.join('{0} {1}'.format(count, state) for state, count
+                           in sorted(job['states'].iteritems()))
+        print '{0}\t{1}\t{2}'.format(job['job_id'], job['workload_file'], states)
+    if cache_age is not None:
+        print '\nStates were queried {0} s ago.'.format(cache_age)
+
+    failure_dir = os.path.join(input_file_parameters.output_dir, FAILURE_DIR_NAME)
+    if not os.path.isdir(failure_dir):
+        return
+    for extension, title in (('.failed', 'Failed IDs (ID, workload, tool, exit '
+                                         'code, time)'),
+                             (RUNNING_RECORD_EXTENSION,
+                              'IDs of unfinished commands, interrupted if their '
+                              'job has ended (ID, workload, tool, start time)')):
+        records = sorted(f for f in os.listdir(failure_dir)
+                         if f.endswith(extension))
+        if records:
+            print '\n{0}:'.format(title)
+        for record_name in records:
+            command_id, workload = record_name[:-len(extension)].rsplit('__WORKLOAD_', 1)
+            try:
+                handle = open(os.path.join(failure_dir, record_name))
+                record = handle.read().strip()
+                handle.close()
+            except IOError:
+                record = ''
+            print '{0}\t{1}\t{2}'.format(command_id, workload, record)
+
+
+def retry_failed_tasks(input_file_parameters, command_line_parameters):
+    """Resubmits the tasks of the submitted jobs that failed because of
+    resource limits or node failures and prints the new job IDs.
+
+    Parameters:
+    input_file_parameters: Run parameters defined in the staplefile.
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Raises:
+    STAPLERerror: Nothing has been submitted or the retry fails.
+    """
+    retries = submission.retry_failed_jobs(input_file_parameters.output_dir,
+                                           command_line_parameters.max_retries)
+    if not retries:
+        print 'No tasks to retry.'
+        return
+    print 'Resubmitted the following tasks:'
+    for job in retries:
+        print '{0}\t{1}\ttasks {2} of job {3}'.format(job['job_id'],
+                                                     job['workload_file'],
+                                                     ','.join(job['tasks']),
+                                                     job['retry_of'])
+
+
 def parse_help_command(args):
     """Parses help function related command line arguments
 
@@ -354,6 +803,12 @@ def print_specific_help(tool_name):
 
     print 'Usage of {0}:'.format(cmd.name)
     print '\nAccepted input types:\n{0}'.format(str(list(cmd.input_types)))
+    if getattr(cmd, 'compressed_input_types', None):
+        print '\nAccepted compressed input types:\n{0}'.format(
+            str(sorted(cmd.accepted_input_types() - set(cmd.input_types))))
+        print '\nCompressed input read natively by the tool (other ' \
+              'compressed input is decompressed on the fly):\n{0}'.format(
+                  str(sorted(cmd.native_compressions)))
     print '\nOutput types:\n{0}'.format(str(cmd.output_types))
     print '\nMandatory arguments:\n{0}'.format(str(cmd.user_mandatory_args))
     print '\nOptional arguments:\n{0}'.format(str(cmd.user_optional_args))
@@ -373,12 +828,16 @@ def validate_config_file(args):
         print 'Error! --validate_config does not take any arguments.'
         return
 
+    # Both user and internal commands are configured in config.txt
+    configurable_commands = dict(AvailableCommands.commands)
+    configurable_commands.update(AvailableCommands.internal_commands)
+
     # Check if the config.txt exists
     if not os.path.exists(utils.CONFIG_FILE_PATH):
         print 'Config file does not seem to exist. Do you wish STAPLER to ' \
               'create it now?'
         if raw_input('(y/n): ') == 'y':
-            update_config_file(AvailableCommands.commands.keys(), [])
+            update_config_file(configurable_commands.keys(), [])
         else:
             'Create the config file manually or get it from ' \
             'https://github.com/tyrmi/STAPLER\n'
@@ -417,7 +876,7 @@ def validate_config_file(args):
             return 0
 
         # Check if the defined command is supported by STAPLER
-        if line[0] not in AvailableCommands.commands:
+        if line[0] not in configurable_commands:
             commands_to_remove.append(line[0])
         else:
             # Add the current command to list
@@ -431,7 +890,7 @@ def validate_config_file(args):
         print '\n'
 
     # Check and report if some commands are missing from the config.txt
-    commands_to_add = set(AvailableCommands.commands.keys()) - \
+    commands_to_add = set(configurable_commands.keys()) - \
                       utils.CONFIG_FILE_OMITTED_COMMANDS - \
                       set(config_file_defined_commands)
     if commands_to_add:
@@ -460,7 +919,7 @@ def validate_config_file(args):
     for cmd in config_file_defined_commands:
         i += 1
         if cmd in ('CUSTOM', 'CUSTOM_NO_OUTPUT'): continue
-        check_result = AvailableCommands.commands[cmd].validate_tool_config()
+        check_result = configurable_commands[cmd].validate_tool_config()
         check_result = [string.ljust(cmd, max_width)] + check_result
         results.append('\t'.join(check_result))
         #print int(float(i)/len(config_file_defined_commands)*100)
@@ -559,11 +1018,36 @@ def parse_command_line(args):
                                           'staplerfile_path',
                                           'resource_manager',
                                           'max_job_count',
+                                          'bundle_size',
+                                          'bundle_time',
+                                          'max_array_size',
+                                          'max_concurrent',
+                                          'pack_cores',
+                                          'pack_threads',
                                           'auto_split_workflows',
                                           'compress_run',
+                                          'compressor',
+                                          'compress_threads',
                                           'validate_run',
                                           'fix_run',
-                                          'rm_workflow'])
+                                          'rm_workflow',
+                                          'telemetry',
+                                          'job_steps',
+                                          'resumable',
+                                          'stall_timeout',
+                                          'keep_going',
+                                          'report_run',
+                                          'status_run',
+                                          'retry_run',
+                                          'max_retries',
+                                          'submit',
+                                          'submit_backend',
+                                          'learn_resources',
+                                          'accounting_files',
+                                          'right_size',
+                                          'resource_model_path',
+                                          'reference_cache',
+                                          'output_compressor'])
 
     # Parse user command line and check sanity of values
 
@@ -620,6 +1104,104 @@ def parse_command_line(args):
         else:
             max_job_count = None
 
+    # Parse array job bundling parameters
+    bundle_size = None
+    if '--bundle_size' in args:
+        if resource_manager == 'unix':
+            raise STAPLERerror.STAPLERerror('--bundle_size parameter requires a '
+                                            'resource manager (e.g. --slurm)!')
+        try:
+            bundle_size = int(args[args.index('--bundle_size')+1])
+        except (ValueError, IndexError):
+            bundle_size = 0
+        if bundle_size < 1:
+            raise STAPLERerror.STAPLERerror('--bundle_size requires a positive '
+                                            'integer value, e.g. --bundle_size 50')
+        args.pop(args.index('--bundle_size')+1)
+        args.remove('--bundle_size')
+    bundle_time = None
+    if '--bundle_time' in args:
+        if resource_manager == 'unix':
+            raise STAPLERerror.STAPLERerror('--bundle_time parameter requires a '
+                                            'resource manager (e.g. --slurm)!')
+        if bundle_size is not None:
+            raise STAPLERerror.STAPLERerror('--bundle_size and --bundle_time '
+                                            'parameters can not be used '
+                                            'simultaneously!')
+        try:
+            bundle_time = resources.parse_duration(args[args.index('--bundle_time')+1])
+        except (ValueError, IndexError):
+            bundle_time = 0
+        if bundle_time <= 0:
+            raise STAPLERerror.STAPLERerror('--bundle_time requires a positive '
+                                            'duration value, e.g. --bundle_time '
+                                            '1:00:00')
+        args.pop(args.index('--bundle_time')+1)
+        args.remove('--bundle_time')
+    max_array_size = DEFAULT_MAX_ARRAY_SIZE
+    if '--max_array_size' in args:
+        if resource_manager == 'unix':
+            raise STAPLERerror.STAPLERerror('--max_array_size parameter requires '
+                                            'a resource manager (e.g. --slurm)!')
+        try:
+            max_array_size = int(args[args.index('--max_array_size')+1])
+        except (ValueError, IndexError):
+            max_array_size = 0
+        if max_array_size < 1:
+            raise STAPLERerror.STAPLERerror('--max_array_size requires a '
+                                            'positive integer value, e.g. '
+                                            '--max_array_size 1000')
+        args.pop(args.index('--max_array_size')+1)
+        args.remove('--max_array_size')
+    max_concurrent = None
+    if '--max_concurrent' in args:
+        if resource_manager == 'unix':
+            raise STAPLERerror.STAPLERerror('--max_concurrent parameter requires '
+                                            'a resource manager (e.g. --slurm)!')
+        try:
+            max_concurrent = int(args[args.index('--max_concurrent')+1])
+        except (ValueError, IndexError):
+            max_concurrent = 0
+        if max_concurrent < 1:
+            raise STAPLERerror.STAPLERerror('--max_concurrent requires a '
+                                            'positive integer value, e.g. '
+                                            '--max_concurrent 50')
+        args.pop(args.index('--max_concurrent')+1)
+        args.remove('--max_concurrent')
+
+    # Parse whole node job packing parameters
+    pack_cores = None
+    if '--pack' in args:
+        if resource_manager == 'unix':
+            raise STAPLERerror.STAPLERerror('--pack parameter requires a '
+                                            'resource manager (e.g. --slurm)!')
+        try:
+            pack_cores = int(args[args.index('--pack')+1])
+        except (ValueError, IndexError):
+            pack_cores = 0
+        if pack_cores < 1:
+            raise STAPLERerror.STAPLERerror('--pack requires the number of '
+                                            'cores of the node as a positive '
+                                            'integer value, e.g. --pack 40')
+        args.pop(args.index('--pack')+1)
+        args.remove('--pack')
+    pack_threads = 1
+    if '--pack_threads' in args:
+        if pack_cores is None:
+            raise STAPLERerror.STAPLERerror('--pack_threads parameter can be '
+                                            'used only with --pack!')
+        try:
+            pack_threads = int(args[args.index('--pack_threads')+1])
+        except (ValueError, IndexError):
+            pack_threads = 0
+        if pack_threads < 1 or pack_threads > pack_cores:
+            raise STAPLERerror.STAPLERerror('--pack_threads requires a positive '
+                                            'integer value not exceeding the '
+                                            'core count given with --pack, e.g. '
+                                            '--pack_threads 4')
+        args.pop(args.index('--pack_threads')+1)
+        args.remove('--pack_threads')
+
     # Parse workflow control parameters
     if '--priority' in args:
         if resource_manager is None:
@@ -659,6 +1241,42 @@ def parse_command_line(args):
                                             'not be used simultaneously!')
         compress_run = 'decompress'
         args.remove('--decompress')
+    compressor = 'gzip'
+    if '--compressor' in args:
+        if compress_run is None:
+            raise STAPLERerror.STAPLERerror('--compressor parameter can only be '
+                                            'used with --compress or '
+                                            '--decompress!')
+        try:
+            compressor = args[args.index('--compressor')+1]
+        except IndexError:
+            compressor = None
+        if compressor not in COMPRESSORS:
+            raise STAPLERerror.STAPLERerror('--compressor requires one of the '
+                                            'following values: {0}'.format(
+                                            ', '.join(sorted(COMPRESSORS))))
+        args.pop(args.index('--compressor')+1)
+        args.remove('--compressor')
+    compress_threads = None
+    if '--compress_threads' in args:
+        if compress_run is None:
+            raise STAPLERerror.STAPLERerror('--compress_threads parameter can '
+                                            'only be used with --compress or '
+                                            '--decompress!')
+        try:
+            compress_threads = int(args[args.index('--compress_threads')+1])
+        except (ValueError, IndexError):
+            compress_threads = 0
+        if compress_threads < 1:
+            raise STAPLERerror.STAPLERerror('--compress_threads requires a '
+                                            'positive integer value, e.g. '
+                                            '--compress_threads 4')
+        if compressor == 'gzip' and compress_threads > 1:
+            raise STAPLERerror.STAPLERerror('gzip does not support multiple '
+                                            'threads, use e.g. --compressor '
+                                            'pigz instead!')
+        args.pop(args.index('--compress_threads')+1)
+        args.remove('--compress_threads')
 
     # Parse workflow validation/fixing/removing parameters
     if '--validate_run' in args:
@@ -677,6 +1295,190 @@ def parse_command_line(args):
     else:
         rm_workflow = False
 
+    if '--report' in args:
+        report_run = True
+        args.remove('--report')
+    else:
+        report_run = False
+
+    if '--status' in args:
+        status_run = True
+        args.remove('--status')
+    else:
+        status_run = False
+
+    if '--retry' in args:
+        retry_run = True
+        args.remove('--retry')
+    else:
+        retry_run = False
+    max_retries = submission.DEFAULT_MAX_RETRIES
+    if '--max_retries' in args:
+        if not retry_run:
+            raise STAPLERerror.STAPLERerror('--max_retries parameter can be '
+                                            'used only with --retry!')
+        try:
+            max_retries = int(args[args.index('--max_retries')+1])
+        except (ValueError, IndexError):
+            max_retries = -1
+        if max_retries < 0:
+            raise STAPLERerror.STAPLERerror('--max_retries requires a '
+                                            'non-negative integer value, e.g. '
+                                            '--max_retries 2')
+        args.pop(args.index('--max_retries')+1)
+        args.remove('--max_retries')
+
+    # Parse job submission parameters
+    if '--submit' in args:
+        if resource_manager == 'unix':
+            raise STAPLERerror.STAPLERerror('--submit parameter requires a '
+                                            'resource manager (e.g. --slurm)!')
+        submit = True
+        args.remove('--submit')
+    else:
+        submit = False
+    submit_backend = resource_manager
+    if '--submit_backend' in args:
+        if not submit:
+            raise STAPLERerror.STAPLERerror('--submit_backend parameter can be '
+                                            'used only with --submit!')
+        try:
+            submit_backend = args[args.index('--submit_backend')+1]
+        except IndexError:
+            submit_backend = None
+        if submit_backend not in submission.BACKENDS:
+            raise STAPLERerror.STAPLERerror('--submit_backend requires one of '
+                                            'the following values: {0}'.format(
+                                            ', '.join(sorted(submission.BACKENDS))))
+        args.pop(args.index('--submit_backend')+1)
+        args.remove('--submit_backend')
+
+    # Parse resource model parameters
+    if '--learn_resources' in args:
+        learn_resources = True
+        args.remove('--learn_resources')
+    else:
+        learn_resources = False
+    accounting_files = []
+    if '--accounting' in args:
+        if not learn_resources:
+            raise STAPLERerror.STAPLERerror('--accounting parameter can only be '
+                                            'used with --learn_resources!')
+        try:
+            accounting_files = args[args.index('--accounting')+1].split(',')
+        except IndexError:
+            raise STAPLERerror.STAPLERerror('--accounting requires a comma '
+                                            'separated list of file paths, e.g.'
+                                            ' --accounting sacct_1.txt,sacct_2.txt')
+        for path in accounting_files:
+            if not os.path.isfile(path):
+                raise STAPLERerror.STAPLERerror('The following accounting file '
+                                                'does not exist:\n{0}'.format(path))
+        args.pop(args.index('--accounting')+1)
+        args.remove('--accounting')
+    right_size = None
+    if '--right_size' in args:
+        if resource_manager == 'unix':
+            raise STAPLERerror.STAPLERerror('--right_size parameter requires a '
+                                            'resource manager (e.g. --slurm)!')
+        try:
+            right_size = float(args[args.index('--right_size')+1])
+        except (ValueError, IndexError):
+            raise STAPLERerror.STAPLERerror('--right_size requires a non-negative '
+                                            'safety margin value, e.g. '
+                                            '--right_size 0.2')
+        if right_size < 0:
+            raise STAPLERerror.STAPLERerror('--right_size requires a non-negative '
+                                            'safety margin value, e.g. '
+                                            '--right_size 0.2')
+        args.pop(args.index('--right_size')+1)
+        args.remove('--right_size')
+    resource_model_path = resources.DEFAULT_MODEL_PATH
+    if '--resource_model' in args:
+        try:
+            resource_model_path = args[args.index('--resource_model')+1]
+        except IndexError:
+            raise STAPLERerror.STAPLERerror('--resource_model requires a file '
+                                            'path value!')
+        args.pop(args.index('--resource_model')+1)
+        args.remove('--resource_model')
+
+    reference_cache = reference.DEFAULT_CACHE_DIR
+    if '--reference_cache' in args:
+        try:
+            reference_cache = os.path.abspath(args[args.index('--reference_cache')+1])
+        except IndexError:
+            raise STAPLERerror.STAPLERerror('--reference_cache requires a '
+                                            'directory path value!')
+        args.pop(args.index('--reference_cache')+1)
+        args.remove('--reference_cache')
+
+    output_compressor = output_compression.DEFAULT_OUTPUT_COMPRESSOR
+    if '--output_compressor' in args:
+        try:
+            output_compressor = args[args.index('--output_compressor')+1]
+        except IndexError:
+            output_compressor = None
+        if output_compressor not in output_compression.OUTPUT_COMPRESSORS:
+            raise STAPLERerror.STAPLERerror('--output_compressor requires one '
+                                            'of the following values: {0}'.format(
+                                            ', '.join(sorted(output_compression.OUTPUT_COMPRESSORS))))
+        args.pop(args.index('--output_compressor')+1)
+        args.remove('--output_compressor')
+
+    # Parse runtime telemetry parameter
+    if '--telemetry' in args:
+        telemetry = True
+        args.remove('--telemetry')
+    else:
+        telemetry = False
+
+    # Parse SLURM job step parameter
+    if '--job_steps' in args:
+        if resource_manager != 'slurm':
+            raise STAPLERerror.STAPLERerror('--job_steps parameter can be used '
+                                            'only with --slurm!')
+        job_steps = True
+        args.remove('--job_steps')
+    else:
+        job_steps = False
+
+    # Parse resumable subshell parameter
+    if '--resumable' in args:
+        resumable = True
+        args.remove('--resumable')
+    else:
+        resumable = False
+
+    # Parse fail-fast parameter
+    if '--keep_going' in args:
+        keep_going = True
+        args.remove('--keep_going')
+    else:
+        keep_going = False
+
+    # Parse stall watchdog parameters. The stall timeout of each command is
+    # defined by its tool, unless given with --stall_timeout.
+    stall_timeout = None
+    if '--watchdog' in args:
+        stall_timeout = 0
+        args.remove('--watchdog')
+    if '--stall_timeout' in args:
+        if stall_timeout is None:
+            raise STAPLERerror.STAPLERerror('--stall_timeout parameter can be '
+                                            'used only with --watchdog!')
+        try:
+            stall_timeout = int(args[args.index('--stall_timeout')+1])
+        except (ValueError, IndexError):
+            stall_timeout = 0
+        if stall_timeout < 1:
+            raise STAPLERerror.STAPLERerror('--stall_timeout requires the '
+                                            'number of minutes as a positive '
+                                            'integer value, e.g. '
+                                            '--stall_timeout 120')
+        args.pop(args.index('--stall_timeout')+1)
+        args.remove('--stall_timeout')
+
     # Parse path to staplefile. All other valid parameters are now read & removed
     # from args.
     if len(args) == 1:
@@ -719,21 +1521,91 @@ def parse_command_line(args):
             raise STAPLERerror.STAPLERerror('--validate_run, --remove_WORKFLOW or --fix_run '
                                             'parameters cannot be used in the same command '
                                             'with --COMRESS_RUN!')
-    if validate_run or rm_workflow:
-        if resource_manager is not 'unix':
-            raise STAPLERerror.STAPLERerror('Resource managers cannot be used when '
-                                            'removing workflows!')
+    if learn_resources:
+        if validate_run or rm_workflow or fix_run or report_run or \
+                compress_run is not None:
+            raise STAPLERerror.STAPLERerror('--learn_resources parameter cannot '
+                                            'be used in the same command with '
+                                            '--validate_run, --remove, '
+                                            '--fix_run, --report, --compress '
+                                            'or --decompress!')
+    if report_run:
+        if validate_run or rm_workflow or fix_run or compress_run is not None:
+            raise STAPLERerror.STAPLERerror('--report parameter cannot be used '
+                                            'in the same command with '
+                                            '--validate_run, --remove, '
+                                            '--fix_run, --compress or '
+                                            '--decompress!')
+    if status_run or retry_run:
+        if validate_run or rm_workflow or fix_run or report_run or \
+                learn_resources or compress_run is not None or \
+                (status_run and retry_run):
+            raise STAPLERerror.STAPLERerror('--status and --retry parameters '
+                                            'cannot be used in the same command '
+                                            'with each other or with '
+                                            '--validate_run, --remove, '
+                                            '--fix_run, --report, '
+                                            '--learn_resources, --compress or '
+                                            '--decompress!')
+    if submit and (validate_run or rm_workflow):
+        raise STAPLERerror.STAPLERerror('--submit parameter cannot be used in '
+                                        'the same command with --validate_run '
+                                        'or --remove!')
+    # These modes read the files of an existing run instead of writing jobs
+    # for a resource manager
+    run_modes = [(validate_run, '--validate_run', 'the existing run is validated'),
+                 (rm_workflow, '--remove', 'the workflow files are removed'),
+                 (report_run, '--report', 'the report is read from the '
+                                          'existing run'),
+                 (learn_resources, '--learn_resources', 'the resource usage is '
+                                                        'read from the existing '
+                                                        'run'),
+                 (status_run, '--status', 'the resource manager of the '
+                                          'submission is queried'),
+                 (retry_run, '--retry', 'the resource manager of the '
+                                        'submission is used')]
+    for run_mode, mode_parameter, reason in run_modes:
+        if run_mode and resource_manager != 'unix':
+            raise STAPLERerror.STAPLERerror('{0} parameter cannot be used with '
+                                            'resource manager parameters (e.g. '
+                                            '--slurm), as {1}!'.format(
+                                                mode_parameter, reason))
 
     command_line_parameters = Command_line_parameters(
         all_parameters=all_parameters,
         staplerfile_path=staplerfile_path,
         resource_manager=resource_manager,
         max_job_count=max_job_count,
+        bundle_size=bundle_size,
+        bundle_time=bundle_time,
+        max_array_size=max_array_size,
+        max_concurrent=max_concurrent,
+        pack_cores=pack_cores,
+        pack_threads=pack_threads,
         auto_split_workflows=auto_split_workflows,
         compress_run=compress_run,
+        compressor=compressor,
+        compress_threads=compress_threads,
         validate_run=validate_run,
         fix_run=fix_run,
-        rm_workflow=rm_workflow)
+        rm_workflow=rm_workflow,
+        telemetry=telemetry,
+        job_steps=job_steps,
+        resumable=resumable,
+        stall_timeout=stall_timeout,
+        keep_going=keep_going,
+        report_run=report_run,
+        status_run=status_run,
+        retry_run=retry_run,
+        max_retries=max_retries,
+        submit=submit,
+        submit_backend=submit_backend,
+        learn_resources=learn_resources,
+        accounting_files=accounting_files,
+        right_size=right_size,
+        resource_model_path=resource_model_path,
+        reference_cache=reference_cache,
+        output_compressor=output_compressor)
 
     return command_line_parameters
 
@@ -953,6 +1825,10 @@ def remove_workflow(input_file_parameters, dir_stack):
 def generate_compression_command_line_objects(dir_stack, command_line_parameters):
     """Generates command line objects to compress/decompress a workflow.
 
+    The files are distributed to threads with the longest processing time
+    first rule: the largest files are assigned first, each to the thread with
+    the least amount of data to handle.
+
     Parameters:
     dir_stack: A list containing the directories related to current workflow
     command_line_parameters: Named tuple containing parameters defined by
@@ -962,9 +1838,18 @@ def generate_compression_command_line_objects(dir_stack, command_line_parameters
     workflows: A list of command instances to execute current workflow.
     """
 
+    tool_name = COMPRESSORS[command_line_parameters.compressor]
+    in_cmd = []
+    if command_line_parameters.compress_run == 'decompress':
+        in_cmd.append('-d')
+    if command_line_parameters.compress_threads is not None and \
+            AvailableCommands.commands[tool_name].thread_arg is not None:
+        in_cmd.append('{0} {1}'.format(AvailableCommands.commands[tool_name].thread_arg,
+                                       command_line_parameters.compress_threads))
+    in_cmd = ' '.join(in_cmd)
+
     # Generate command lines
-    threads = []
-    thread_sizes = []
+    commands = []
     first_d = True
     for d in dir_stack:
         if first_d:
@@ -978,53 +1863,136 @@ def generate_compression_command_line_objects(dir_stack, command_line_parameters
                 # The command instance is generated without exceptions if the
                 #  command execution has failed (i.e. expected output
                 # file does not exist). Otherwise NewFileError is raised.
-                if command_line_parameters.compress_run == 'compress':
-                    command_line = AvailableCommands.commands['gzip']('', d, d)
-                elif command_line_parameters.compress_run == 'decompress':
-                    command_line = AvailableCommands.commands['gzip']('-d', d, d)
+                command_line = AvailableCommands.commands[tool_name](in_cmd, d, d)
             except STAPLERerror.NewFileExists:
-                pass
+                continue
             except STAPLERerror.VirtualIOError:
                 break
+            except STAPLERerror.NotConfiguredError:
+                raise STAPLERerror.STAPLERerror('Trying to create command '
+                                                'lines for {0}, '
+                                                'but config.txt is missing '
+                                                'configuration for this '
+                                                'command. Edit config.txt '
+                                                'appropriately or select '
+                                                'another compressor.'.format(tool_name))
 
             abs_file_path = os.path.join(d.path, command_line.out_cmd['-!i'])
-
-            # Create new thread for current command if new threads can be created
-            if len(threads) < command_line_parameters.max_job_count or command_line_parameters.max_job_count is None:
-                threads.append([command_line])
-                thread_sizes.append(os.stat(abs_file_path).st_size)
-            # If max number of threads have been created, add command to the thread
-            # with the least amount of data to handle
-            else:
-                threads[thread_sizes.index(min(
-                    thread_sizes))].append(command_line)
-                thread_sizes[thread_sizes.index(min(thread_sizes))] += \
-                    os.stat(abs_file_path).st_size
+            commands.append((os.stat(abs_file_path).st_size, abs_file_path,
+                             command_line))
 
     # Report if no proper input files have been found
-    if not threads and command_line_parameters.compress_run == 'compress':
-        raise STAPLERerror('Workflow does not contain any files that can be compressed.')
-    if not threads and command_line_parameters.compress_run == 'decompress':
-        raise STAPLERerror('Workflow does not contain any files that can be decompressed.')
+    if not commands and command_line_parameters.compress_run == 'compress':
+        raise STAPLERerror.STAPLERerror('Workflow does not contain any files that can be compressed.')
+    if not commands and command_line_parameters.compress_run == 'decompress':
+        raise STAPLERerror.STAPLERerror('Workflow does not contain any files that can be decompressed.')
+
+    # Assign the largest files first, each to the thread with the least
+    # amount of data to handle
+    commands.sort(key=lambda c: c[0], reverse=True)
+    if command_line_parameters.max_job_count is None:
+        thread_count = len(commands)
+    else:
+        thread_count = min(command_line_parameters.max_job_count, len(commands))
+    threads = [[] for _ in xrange(thread_count)]
+    thread_sizes = [0] * thread_count
+    for size, _, command_line in commands:
+        i = thread_sizes.index(min(thread_sizes))
+        threads[i].append(command_line)
+        thread_sizes[i] += size
 
     # Calculate & report estimated run time for the current job
-    if command_line_parameters.compress_run == 'compress':
-        # Assume that gzip compression speed is 20Mb per second (should
-        # give plenty of time for modern processors)
-        est_run_time = 'Estimated recommended run time for this job is (hh:mm:ss):\n' \
-                       '{0}'.format(datetime.timedelta(seconds=(max(thread_sizes) / 20000000) + 60))
-    else:
-        # Assume that gzip decompression speed is 60Mb per second (should
-        # give plenty of time for modern processors)
-        est_run_time = 'Estimated recommended run time for this job is (hh:mm:ss):\n' \
-                       '{0}'.format(datetime.timedelta(seconds=(max(thread_sizes) / 60000000) + 60))
+    speed = measure_compression_speed(commands[0][1], command_line_parameters)
+    est_run_time = 'Estimated recommended run time for this job is (hh:mm:ss):\n' \
+                   '{0}'.format(datetime.timedelta(seconds=int(max(thread_sizes) / speed) + 60))
     print est_run_time
     logging.info(est_run_time)
+    if (command_line_parameters.compress_threads or 1) > 1:
+        print 'Remember to reserve {0} cores for each job!'.format(
+            command_line_parameters.compress_threads)
 
     workloads = [threads]
     return workloads
 
 
+def measure_compression_speed(path, command_line_parameters):
+    """Measures the (de)compression speed of the selected compressor.
+
+    A sample from the beginning of the given file is (de)compressed with the
+    compressor defined in config.txt. Half of the measured speed is returned
+    to leave plenty of time for slower compute nodes. If the measurement
+    fails, a conservative default speed is used instead.
+
+    Parameters:
+    path: Path to the file to sample.
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Returns:
+    speed: Estimated (de)compression speed in bytes per second.
+
+    Raises:
+    STAPLERerror: The compressor is not configured in config.txt.
+    """
+    compressor = command_line_parameters.compressor
+    threads = command_line_parameters.compress_threads or 1
+    tool = AvailableCommands.commands[COMPRESSORS[compressor]]
+    default_speed = DEFAULT_COMPRESSION_SPEEDS[command_line_parameters.compress_run][compressor]
+    if tool.thread_arg is not None and \
+            command_line_parameters.compress_run == 'compress':
+        default_speed *= threads
+
+    try:
+        run_command = shlex.split(utils.parse_config(tool.name, 'cmd_name', 'execute'))
+    except STAPLERerror.NotConfiguredError:
+        raise STAPLERerror.STAPLERerror('Trying to measure the (de)compression '
+                                        'speed of {0}, but config.txt is '
+                                        'missing configuration for this '
+                                        'command. Edit config.txt '
+                                        'appropriately or select another '
+                                        'compressor.'.format(tool.name))
+    except STAPLERerror.STAPLERerror:
+        return default_speed
+    try:
+        sample_fl = open(path, 'rb')
+        sample = sample_fl.read(64 * 1024 * 1024)
+        sample_fl.close()
+    except IOError:
+        return default_speed
+    if len(sample) < 1000000:
+        # Too small sample for a reliable measurement
+        return default_speed
+    run_command.append('-c')
+    if command_line_parameters.compress_run == 'decompress':
+        run_command.append('-d')
+    if tool.thread_arg is not None:
+        run_command += [tool.thread_arg, str(threads)]
+
+    devnull = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        process = subprocess.Popen(run_command, stdin=subprocess.PIPE,
+                                   stdout=devnull, stderr=devnull)
+        # The sample of a compressed file is truncated, so the exit code of
+        # decompression is not checked
+        process.communicate(sample)
+        duration = time.time() - start
+    except OSError:
+        logging.warning('Unable to run {0} to measure (de)compression speed, '
+                        'using the default speed of {1} MB/s.'.format(
+                        ' '.join(run_command), default_speed / 1000000))
+        return default_speed
+    finally:
+        devnull.close()
+
+    if duration <= 0:
+        return default_speed
+    speed = len(sample) / duration / 2
+    logging.info('Measured (de)compression speed with {0}: {1:.1f} MB/s'
+                 .format(' '.join(run_command), speed * 2 / 1000000))
+    return speed
+
+
 def init_logging(input_file_parameters, dir_stacks):
     """Initiates the logging.
 
@@ -1223,7 +2191,18 @@ STAPLERerror: Command type is not supported.
                                                             in_dir.path,
                                                             '\n'.join(command_type.input_types),
                                                             ', '.join(in_dir.file_names.keys())))
-        if first_command:
+        # Scattered commands are run in a workflow part of their own and the
+        # gather commands start the next workflow part
+        shard_commands, gather_commands = scatter.scatter_step(current_step_commands)
+        if shard_commands is not None:
+            workflows.append([shard_commands])
+            # Without gather commands the next step starts a new workflow part
+            if gather_commands:
+                workflows.append([gather_commands])
+                first_command = False
+            else:
+                first_command = True
+        elif first_command:
             workflows.append([current_step_commands])
             first_command = False
         else:
@@ -1343,7 +2322,16 @@ STAPLERerror: Command type is not supported.
                                                         ', '.join(in_dir.file_names.keys())))
         print '{0} command (step number {1}) was regenerated {2} ' \
               'times'.format(command_type.name, dir_stack_index+1, len(current_step_commands))
-        if current_step_commands:
+        shard_commands, gather_commands = scatter.scatter_step(current_step_commands)
+        if shard_commands is not None:
+            workflows.append([shard_commands])
+            # Without gather commands the next step starts a new workflow part
+            if gather_commands:
+                workflows.append([gather_commands])
+                first_command = False
+            else:
+                first_command = True
+        elif current_step_commands:
             if first_command:
                 workflows.append([current_step_commands])
                 first_command = False
@@ -1526,6 +2514,112 @@ prints: Numbers of commands that have failed during runtime.
 
 
 
+def write_run_report(input_file_parameters):
+    """Reports the run time statistics of a finished run.
+
+    Parameters:
+    input_file_parameters: Run parameters defined in the staplefile.
+
+    Raises:
+    STAPLERerror: No timing information is available for the run.
+
+    Side-effects:
+    prints: Run time statistics of the run.
+    Writes Chrome trace-event and Prometheus textfile files to the output
+    directory.
+    """
+    records = report.read_telemetry(input_file_parameters.output_dir)
+    if records:
+        print 'Reading run time information from telemetry files...'
+    else:
+        print 'No telemetry files found, reading run time information from ' \
+              '.out files...'
+        records = report.read_subshell_logs(input_file_parameters.output_dir)
+    if not records:
+        raise STAPLERerror.STAPLERerror('No finished commands were found from '
+                                        'the output directory:\n{0}\nHas this '
+                                        'workflow been run yet?'.format(
+            input_file_parameters.output_dir))
+
+    statistics = report.analyze(records)
+    report.print_report(statistics)
+
+    trace_path = os.path.join(input_file_parameters.output_dir,
+                              '{0}_report_trace.json'.format(NAME))
+    report.write_chrome_trace(records, trace_path)
+    prometheus_path = os.path.join(input_file_parameters.output_dir,
+                                   '{0}_report.prom'.format(NAME))
+    report.write_prometheus_textfile(statistics,
+                                     input_file_parameters.job_name,
+                                     prometheus_path)
+    print '\nChrome trace-event file written to:\n{0}'.format(trace_path)
+    print 'Prometheus textfile written to:\n{0}'.format(prometheus_path)
+
+
+def learn_resources(input_file_parameters, command_line_parameters):
+    """Updates the resource model with the resource usage of a finished run.
+
+    Each telemetry and accounting file is added to the model only once.
+
+    Parameters:
+    input_file_parameters: Run parameters defined in the staplefile.
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Raises:
+    STAPLERerror: No usage information is available.
+    """
+    model = resources.load_model(command_line_parameters.resource_model_path)
+    output_dir = input_file_parameters.output_dir
+    sizes = resources.id_sizes(input_file_parameters.starting_point_directory)
+
+    # The paths are resolved as below, so that telemetry files are told from
+    # accounting files also when the output directory is behind a symlink.
+    telemetry_paths = [os.path.realpath(os.path.join(output_dir, f))
+                       for f in sorted(os.listdir(output_dir))
+                       if '_telemetry' in f and f.endswith('.jsonl')]
+    if not telemetry_paths and not command_line_parameters.accounting_files:
+        raise STAPLERerror.STAPLERerror('No telemetry files were found from '
+                                        'the output directory:\n{0}\nUse '
+                                        '--telemetry when generating the '
+                                        'workflow or provide resource manager '
+                                        'accounting files with '
+                                        '--accounting.'.format(output_dir))
+
+    used_commands = 0
+    used_tasks = 0
+    skipped_files = 0
+    for path in telemetry_paths + command_line_parameters.accounting_files:
+        path = os.path.realpath(path)
+        source = '{0}:{1}:{2}'.format(path,
+                                      os.path.getsize(path),
+                                      os.path.getmtime(path))
+        if source in model['sources']:
+            skipped_files += 1
+            continue
+        if path in telemetry_paths:
+            records = report.read_telemetry_file(path)
+            used_commands += resources.learn_from_telemetry(model, records)
+        else:
+            accounting_tasks = resources.parse_accounting_file(path)
+            used_tasks += resources.learn_from_accounting(model,
+                                                          accounting_tasks,
+                                                          output_dir)
+            job_steps = resources.parse_accounting_job_steps(path)
+            used_commands += resources.learn_from_job_steps(model,
+                                                            job_steps,
+                                                            sizes)
+        model['sources'].append(source)
+
+    resources.save_model(model, command_line_parameters.resource_model_path)
+    if skipped_files:
+        print '{0} files were skipped as they have been added to the model ' \
+              'already.'.format(skipped_files)
+    print 'Added {0} command and {1} task observations to the resource ' \
+          'model:\n{2}'.format(used_commands, used_tasks,
+                               command_line_parameters.resource_model_path)
+
+
 def log_dir_stacks_contents(dir_stacks):
     """Write data to log file on predicted directory contents.
 
@@ -1573,9 +2667,7 @@ def write_default(workflows, output_dir):
                 out_lines.append('echo Executing command {0}/{1}:'
                                  .format(i, number_of_commands))
                 for c in cmd_list:
-                    c = c.replace('>', '\\>')
-                    c = c.replace('|', '\\|')
-                    out_lines.append('echo ' + c)
+                    out_lines.append('echo ' + pipes.quote(c))
                 out_lines.append('date')
 
                 #Load modules
@@ -1622,6 +2714,17 @@ def determine_job_workloads(workloads, command_line_parameters):
     i = 0
     for workflow in workloads:
         i += 1
+        # Each shard of a scattered workflow step is run in a thread of its own
+        if len(workflow) == 1 and hasattr(workflow[0][0], 'scatter_index'):
+            thread_count = len(workflow[0])
+            if command_line_parameters.max_job_count is not None:
+                thread_count = min(thread_count,
+                                   command_line_parameters.max_job_count)
+            current_workflow_threads = [[] for _ in xrange(thread_count)]
+            for k, output_cmd in enumerate(workflow[0]):
+                current_workflow_threads[k % thread_count].append(output_cmd)
+            parallelized_workloads.append(current_workflow_threads)
+            continue
         # Workflow is split by user with SPLIT command or automatically split
         #  at brach/join events
         thread_allocation_indexes = infer_id_groups(workflow,
@@ -1639,6 +2742,188 @@ def determine_job_workloads(workloads, command_line_parameters):
     return parallelized_workloads
 
 
+def bundle_job_workloads(workloads, input_file_parameters,
+                         command_line_parameters):
+    """Combines consecutive threads of each workload into array tasks.
+
+    With --bundle_size each task runs the given number of threads. With
+    --bundle_time threads are added to each task until the run time predicted
+    by the resource model would exceed the target duration.
+
+    Parameters:
+    workloads: Output commands grouped by execution threads.
+    input_file_parameters: Run parameters defined in the staplefile.
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Returns:
+    bundled_workloads: Output commands grouped by array tasks.
+    """
+    if command_line_parameters.bundle_time is not None:
+        model = resources.load_model(command_line_parameters.resource_model_path)
+        sizes = resources.id_sizes(input_file_parameters.starting_point_directory)
+
+    bundled_workloads = []
+    for workload in workloads:
+        if command_line_parameters.bundle_size is not None:
+            thread_times = [1] * len(workload)
+            target_time = command_line_parameters.bundle_size
+        else:
+            thread_times = []
+            for thread in workload:
+                prediction = resources.predict_task(
+                    model,
+                    [cmd.name for cmd in thread],
+                    [resources.command_input_size(cmd, sizes) for cmd in thread])
+                if prediction is None:
+                    break
+                thread_times.append(prediction[0])
+            if len(thread_times) < len(workload):
+                logging.warning('Resource model does not contain all tools '
+                                'of a workflow part, the jobs of the part are '
+                                'not bundled.')
+                bundled_workloads.append(workload)
+                continue
+            target_time = command_line_parameters.bundle_time
+
+        bundles = []
+        task_time = 0
+        for thread, thread_time in zip(workload, thread_times):
+            if not bundles or task_time + thread_time > target_time:
+                bundles.append([])
+                task_time = 0
+            bundles[-1] += thread
+            task_time += thread_time
+        logging.info('Bundled {0} jobs into {1} array tasks.'.format(
+            len(workload), len(bundles)))
+        bundled_workloads.append(bundles)
+    return bundled_workloads
+
+
+def workload_arrays(workloads, command_line_parameters):
+    """Splits the workloads into array jobs of at most --max_array_size
+    tasks.
+
+    Parameters:
+    workloads: Output commands grouped by array tasks.
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Returns:
+    List of (workload index string, array suffix, tasks) tuples, one for
+    each array job. The array suffix is added to the names of the files of
+    the array job and is empty unless the workload is split. Packed workloads
+    (see --pack) are never split, as they are not run as array jobs.
+    """
+    arrays = []
+    workload_zfill_amount = len(str(len(workloads)))
+    max_array_size = command_line_parameters.max_array_size
+    for workload_index, workload in enumerate(workloads):
+        workload_index_string = str(workload_index+1).zfill(workload_zfill_amount)
+        if len(workload) <= max_array_size or \
+                command_line_parameters.pack_cores is not None:
+            arrays.append((workload_index_string, '', workload))
+            continue
+        # Split into arrays of roughly equal size
+        array_count = int(math.ceil(float(len(workload)) / max_array_size))
+        array_size = int(math.ceil(float(len(workload)) / array_count))
+        for i in xrange(array_count):
+            arrays.append((workload_index_string,
+                           '_array_{0}'.format(i+1),
+                           workload[i*array_size:(i+1)*array_size]))
+    return arrays
+
+
+def array_throttle(command_line_parameters):
+    """Returns the concurrent task limit appended to the array range
+    (e.g. %50) by SLURM, LSF and TORQUE.
+
+    Parameters:
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Returns:
+    Limit string, empty if --max_concurrent is not used.
+    """
+    if command_line_parameters.max_concurrent is None:
+        return ''
+    return '%{0}'.format(command_line_parameters.max_concurrent)
+
+
+def pack_slots(command_line_parameters):
+    """Returns the number of tasks run at the same time in a packed job.
+
+    Parameters:
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Returns:
+    Number of task slots.
+    """
+    slots = max(1, command_line_parameters.pack_cores //
+                command_line_parameters.pack_threads)
+    if command_line_parameters.max_concurrent is not None:
+        slots = min(slots, command_line_parameters.max_concurrent)
+    return slots
+
+
+def packed_job_command(workload_index_string, thread_index_strings, appendix,
+                       output_template, error_template, input_file_parameters,
+                       command_line_parameters):
+    """Writes the task list of a packed workload and returns the command
+    running it with the task dispatcher.
+
+    Parameters:
+    workload_index_string: Index of the current workload as used in file names.
+    thread_index_strings: Thread indexes as used in subshell file names.
+    appendix: Appendix of the output file names (depends on run mode).
+    output_template: Path template of the output stream files of the tasks.
+    The {job} and {task} fields are replaced with the job ID and task index.
+    error_template: Path template of the error stream files of the tasks.
+    input_file_parameters: Run parameters defined in the staplefile.
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Returns:
+    Command line string.
+
+    Raises:
+    STAPLERerror: Unable to open output file.
+    """
+    task_lines = []
+    for thread_index_string in thread_index_strings:
+        subshell_file_path = os.path.join(
+            input_file_parameters.output_dir,
+            '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
+                                                      workload_index_string,
+                                                      thread_index_string,
+                                                      appendix))
+        task_lines.append('{0}\t{1}'.format(thread_index_string,
+                                            subshell_file_path))
+    out_fl_path = os.path.join(input_file_parameters.output_dir,
+                               '{0}_WORKLOAD_{1}_tasks{2}'.format(
+                                   NAME,
+                                   workload_index_string,
+                                   appendix.replace('.sh', '.txt')))
+    try:
+        out_fl = open(out_fl_path, 'w')
+    except IOError as emsg:
+        raise STAPLERerror.STAPLERerror('Unable to create output file:'
+                                        '\n{0}\n with error message:\n{1}'
+                                        .format(out_fl_path, str(emsg)))
+    out_fl.write('\n'.join(task_lines))
+    out_fl.write('\n')
+    out_fl.close()
+
+    return 'python {0} --tasks {1} --slots {2} --threads {3} --output {4} ' \
+           '--error {5}'.format(pipes.quote(utils.DISPATCHER_PATH),
+                                pipes.quote(out_fl_path),
+                                pack_slots(command_line_parameters),
+                                command_line_parameters.pack_threads,
+                                pipes.quote(output_template),
+                                pipes.quote(error_template))
+
+
 def infer_id_groups(workflow, command_line_parameters):
     """Infer which ids should be run in the same thread.
 
@@ -1786,25 +3071,21 @@ def write_lsf(workloads, input_file_parameters, command_line_parameters):
     Raises:
     STAPLERerror: Unable to open output file.
     """
-    workload_index = 0
-    workload_zfill_amount = len(str(len(workloads)))
     workload_file_paths = []
-    for workload in workloads:
+    for workload_index_string, array_suffix, workload in \
+            workload_arrays(workloads, command_line_parameters):
         # Each workflow part will have separate file to submit to TORQUE with
         # sbatch command. Each file has one or more associated subshell files
         # containing contents for each thread.
 
-        # Generate strings describing current workload and thread indexes for
-        # output file names
-        workload_index += 1
-        workload_index_string = str(workload_index).zfill(workload_zfill_amount)
+        # Generate strings describing current workload for output file names
         file_main_name = '{0}_LSF_WORKLOAD_{1}'.format(NAME,
                                                           workload_index_string)
 
         # When --fix_run mode is used the output and log files files already
         # exist. To prevent overwriting these files with new ones specific
         # prefix or appendix strings are added to the new output file names.
-        appendix = '.sh'
+        appendix = array_suffix + '.sh'
         i = 0
         if command_line_parameters.fix_run:
             mode = 'FIX'
@@ -1817,32 +3098,24 @@ def write_lsf(workloads, input_file_parameters, command_line_parameters):
         while mode is not None and os.path.exists(os.path.join(input_file_parameters.output_dir,
                                                                file_main_name + appendix)):
             i += 1
-            appendix = '_{0}_{1}.sh'.format(mode, i)
+            appendix = '{0}_{1}_{2}.sh'.format(array_suffix, mode, i)
 
         # Generate subshell files
         thread_index = 0
+        thread_index_strings = []
         for thread_contents in workload:
             # Iterate over output commands of each thread and write necessary
             # subshell files for each
-            out_lines = []
-            cmds_in_thread = len(thread_contents)
-            for i in xrange(cmds_in_thread):
-                # Check if any modules need loading or are they loaded by previous command
-                skip_module_loading = False
-                if i > 0:
-                    if thread_contents[i].load_module == thread_contents[i-1].load_module:
-                        skip_module_loading = True
-                # Check if any modules need unloading or will they be used by following command
-                skip_module_unloading = False
-                if i < cmds_in_thread-1:
-                    if thread_contents[i].load_module == thread_contents[i+1].load_module:
-                        skip_module_unloading = True
-                out_lines += generate_subshell_file_contents(thread_contents[i],
-                                                             skip_module_loading,
-                                                             skip_module_unloading)
+            thread_index_string = str(thread_index)
+            thread_index_strings.append(thread_index_string)
+            out_lines = generate_thread_file_contents(thread_contents,
+                                                      workload_index_string,
+                                                      thread_index_string,
+                                                      appendix,
+                                                      input_file_parameters,
+                                                      command_line_parameters)
 
             # Write subshell file
-            thread_index_string = str(thread_index)
             fl_name = '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
                                                                 workload_index_string,
                                                                 thread_index_string,
@@ -1860,22 +3133,53 @@ def write_lsf(workloads, input_file_parameters, command_line_parameters):
             out_fl.close()
             thread_index += 1
 
+        write_workload_manifest(workload,
+                                thread_index_strings,
+                                workload_index_string,
+                                appendix,
+                                input_file_parameters)
+
         # Generate parameter file for the bsub run
         resmng_config = []
-        resmng_config.append('#BSUB-J "{0}[1-{1}]"'.format(
-            input_file_parameters.job_name,
-            len(workload)))
-        resmng_config.append('#BSUB-i {0}_WORKLOAD_{1}_subshell_{2}{3}'.format(
-            NAME,
-            workload_index_string,
-            '%I',
-            appendix))
-        resmng_config.append('#BSUB-o {0}_WORKLOAD_{1}_subshell_{2}{3}.out'.format(
-            NAME,
-            workload_index_string,
-            '%I',
-            appendix))
-        resmng_config += input_file_parameters.resource_manager_params
+        if command_line_parameters.pack_cores is not None:
+            resmng_config.append('#BSUB-J "{0}"'.format(
+                input_file_parameters.job_name))
+            resmng_config.append('#BSUB-o {0}_WORKLOAD_{1}_dispatcher{2}.out'.format(
+                NAME,
+                workload_index_string,
+                appendix))
+        else:
+            resmng_config.append('#BSUB-J "{0}[1-{1}]{2}"'.format(
+                input_file_parameters.job_name,
+                len(workload),
+                array_throttle(command_line_parameters)))
+            resmng_config.append('#BSUB-i {0}_WORKLOAD_{1}_subshell_{2}{3}'.format(
+                NAME,
+                workload_index_string,
+                '%I',
+                appendix))
+            resmng_config.append('#BSUB-o {0}_WORKLOAD_{1}_subshell_{2}{3}.out'.format(
+                NAME,
+                workload_index_string,
+                '%I',
+                appendix))
+        resmng_config += workload_resource_manager_params(workload,
+                                                          input_file_parameters,
+                                                          command_line_parameters)
+        if command_line_parameters.pack_cores is not None:
+            task_file_basename = os.path.join(
+                input_file_parameters.output_dir,
+                '{0}_WORKLOAD_{1}_subshell_{{task}}{2}'.format(NAME,
+                                                               workload_index_string,
+                                                               appendix))
+            resmng_config.append('\n\n')
+            resmng_config.append(packed_job_command(workload_index_string,
+                                                    thread_index_strings,
+                                                    appendix,
+                                                    task_file_basename + '.out',
+                                                    task_file_basename + '.err',
+                                                    input_file_parameters,
+                                                    command_line_parameters))
 
         out_fl_path = os.path.join(input_file_parameters.output_dir, file_main_name + appendix)
         workload_file_paths.append(out_fl_path)
@@ -1915,18 +3219,14 @@ def write_sge(workloads, input_file_parameters, command_line_parameters):
         input_file_parameters.resource_manager_params,
         ['# -o', '# -e', '# -t'])
 
-    workload_index = 0
-    workload_zfill_amount = len(str(len(workloads)))
     workload_file_paths = []
-    for workload in workloads:
+    for workload_index_string, array_suffix, workload in \
+            workload_arrays(workloads, command_line_parameters):
         # Each workflow part will have separate file to submit to TORQUE with
         # sbatch command. Each file has one or more associated subshell files
         # containing contents for each thread.
 
-        # Generate strings describing current workload and thread indexes for
-        # output file names
-        workload_index += 1
-        workload_index_string = str(workload_index).zfill(workload_zfill_amount)
+        # Generate strings describing current workload for output file names
         file_main_name = '{0}_SGE_WORKLOAD_{1}'.format(NAME,
                                                        workload_index_string)
 
@@ -1934,7 +3234,7 @@ def write_sge(workloads, input_file_parameters, command_line_parameters):
         # exist. To prevent overwriting these files with new ones specific
         # prefix or appendix strings are added to the new output file names.
         prefix = ''
-        appendix = '.sh'
+        appendix = array_suffix + '.sh'
         i = 0
         if command_line_parameters.fix_run:
             mode = 'FIX'
@@ -1948,33 +3248,24 @@ def write_sge(workloads, input_file_parameters, command_line_parameters):
                                                                file_main_name + appendix)):
             i += 1
             prefix = '{0}_{1}_'.format(mode, i)
-            appendix = '_{0}_{1}.sh'.format(mode, i)
+            appendix = '{0}_{1}_{2}.sh'.format(array_suffix, mode, i)
 
         # Generate subshell files
         thread_index = 1
+        thread_index_strings = []
         for thread_contents in workload:
             # Iterate over output commands of each thread and write necessary
             # subshell files for each
-            out_lines = []
-            cmds_in_thread = len(thread_contents)
-            for i in xrange(cmds_in_thread):
-                # Check if any modules need loading or are they loaded by previous command
-                skip_module_loading = False
-                if i > 0:
-                    if thread_contents[i].load_module == thread_contents[i-1].load_module:
-                        skip_module_loading = True
-                # Check if any modules need unloading or will they be used by following command
-                skip_module_unloading = False
-                if i < cmds_in_thread-1:
-                    if thread_contents[i].load_module == thread_contents[i+1].load_module:
-                        skip_module_unloading = True
-                out_lines += generate_subshell_file_contents(thread_contents[i],
-                                                             skip_module_loading,
-                                                             skip_module_unloading)
-
+            thread_index_string = str(thread_index)
+            thread_index_strings.append(thread_index_string)
+            out_lines = generate_thread_file_contents(thread_contents,
+                                                      workload_index_string,
+                                                      thread_index_string,
+                                                      appendix,
+                                                      input_file_parameters,
+                                                      command_line_parameters)
 
             # Write subshell file
-            thread_index_string = str(thread_index)
             fl_name = '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
                                                                 workload_index_string,
                                                                 thread_index_string,
@@ -1992,6 +3283,12 @@ def write_sge(workloads, input_file_parameters, command_line_parameters):
             out_fl.close()
             thread_index += 1
 
+        write_workload_manifest(workload,
+                                thread_index_strings,
+                                workload_index_string,
+                                appendix,
+                                input_file_parameters)
+
         # Create lines for SGE input file by generating job-name, output,
         # error and array parameters based on user input
 
@@ -2001,19 +3298,38 @@ def write_sge(workloads, input_file_parameters, command_line_parameters):
 
         # IF YOU ADD NEW AUTOMATICALLY INFERRED PARAMETERS, REMEMBER TO VALIDATE
         # THEM AT THE BEGINNING OF THIS FUNCTION
-        resmng_config = list(input_file_parameters.resource_manager_params)
-        resmng_config.append('#$ -o {0}.out'.format(status_file_basename))
-        resmng_config.append('#$ -e {0}.err'.format(status_file_basename))
-        resmng_config.append('#$ -t {0}-{1}'.format(1, len(workload)))
-
-        resmng_config.append('\n\n')
-        subshell_file_path = '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
-                                                                       workload_index_string,
-                                                                       '"$SGE_TASK_ID"',
-                                                                       appendix)
-        subshell_file_path = os.path.join(input_file_parameters.output_dir,
-                                          subshell_file_path)
-        resmng_config.append('source {0}'.format(subshell_file_path))
+        resmng_config = workload_resource_manager_params(workload,
+                                                         input_file_parameters,
+                                                         command_line_parameters)
+        if command_line_parameters.pack_cores is not None:
+            job_file_basename = os.path.join(input_file_parameters.output_dir,
+                                             prefix +
+                                             input_file_parameters.job_name)
+            resmng_config.append('#$ -o {0}_dispatcher.out'.format(job_file_basename))
+            resmng_config.append('#$ -e {0}_dispatcher.err'.format(job_file_basename))
+            resmng_config.append('\n\n')
+            resmng_config.append(packed_job_command(workload_index_string,
+                                                    thread_index_strings,
+                                                    appendix,
+                                                    job_file_basename + '_{task}.out',
+                                                    job_file_basename + '_{task}.err',
+                                                    input_file_parameters,
+                                                    command_line_parameters))
+        else:
+            resmng_config.append('#$ -o {0}.out'.format(status_file_basename))
+            resmng_config.append('#$ -e {0}.err'.format(status_file_basename))
+            resmng_config.append('#$ -t {0}-{1}'.format(1, len(workload)))
+            if command_line_parameters.max_concurrent is not None:
+                resmng_config.append('#$ -tc {0}'.format(command_line_parameters.max_concurrent))
+
+            resmng_config.append('\n\n')
+            subshell_file_path = '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
+                                                                           workload_index_string,
+                                                                           '"$SGE_TASK_ID"',
+                                                                           appendix)
+            subshell_file_path = os.path.join(input_file_parameters.output_dir,
+                                              subshell_file_path)
+            resmng_config.append('source {0}'.format(subshell_file_path))
 
         out_fl_path = os.path.join(input_file_parameters.output_dir,
                                    file_main_name + appendix)
@@ -2050,25 +3366,21 @@ def write_slurm(workloads, input_file_parameters, command_line_parameters):
     Raises:
     STAPLERerror: Unable to open output file.
     """
-    workload_index = 0
-    workload_zfill_amount = len(str(len(workloads)))
     workload_file_paths = []
-    for workload in workloads:
+    for workload_index_string, array_suffix, workload in \
+            workload_arrays(workloads, command_line_parameters):
         # Each workflow part will have separate file to submit to SLURM with
         # sbatch command. Each file has one or more associated subshell files
         # containing contents for each thread.
 
-        # Generate strings describing current workload and thread indexes for
-        # output file names
-        workload_index += 1
-        workload_index_string = str(workload_index).zfill(workload_zfill_amount)
+        # Generate strings describing current workload for output file names
         file_main_name = '{0}_SBATCH_WORKLOAD_{1}'.format(NAME,
                                                               workload_index_string)
 
         # When --fix_run mode is used the output and log files files already
         # exist. To prevent overwriting these files with new ones specific
         # prefix or appendix strings are added to the new output file names.
-        appendix = '.sh'
+        appendix = array_suffix + '.sh'
         prefix = ''
         i = 0
         if command_line_parameters.fix_run:
@@ -2084,34 +3396,25 @@ def write_slurm(workloads, input_file_parameters, command_line_parameters):
                                                                file_main_name + appendix)):
             i += 1
             prefix = '{0}_{1}_'.format(mode, i)
-            appendix = '_{0}_{1}.sh'.format(mode, i)
+            appendix = '{0}_{1}_{2}.sh'.format(array_suffix, mode, i)
 
         # Generate subshell files
         thread_index = 0
+        thread_index_strings = []
         for thread_contents in workload:
             # Iterate over output commands of each thread and write necessary
             # subshell files for each
-            out_lines = []
-            cmds_in_thread = len(thread_contents)
-            for i in xrange(cmds_in_thread):
-                # Check if any modules need loading or are they loaded by previous command
-                skip_module_loading = False
-                if i > 0:
-                    if thread_contents[i].load_module == thread_contents[i-1].load_module:
-                        skip_module_loading = True
-                # Check if any modules need unloading or will they be used by following command
-                skip_module_unloading = False
-                if i < cmds_in_thread-1:
-                    if thread_contents[i].load_module == thread_contents[i+1].load_module:
-                        skip_module_unloading = True
-                out_lines += generate_subshell_file_contents(thread_contents[i],
-                                                             skip_module_loading,
-                                                             skip_module_unloading)
-
-
-            # Write subshell file
             thread_index += 1
             thread_index_string = str(thread_index)
+            thread_index_strings.append(thread_index_string)
+            out_lines = generate_thread_file_contents(thread_contents,
+                                                      workload_index_string,
+                                                      thread_index_string,
+                                                      appendix,
+                                                      input_file_parameters,
+                                                      command_line_parameters)
+
+            # Write subshell file
             fl_name = '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
                                                                 workload_index_string,
                                                                 thread_index_string,
@@ -2128,24 +3431,47 @@ def write_slurm(workloads, input_file_parameters, command_line_parameters):
             out_fl.write('\n')
             out_fl.close()
 
+        write_workload_manifest(workload,
+                                thread_index_strings,
+                                workload_index_string,
+                                appendix,
+                                input_file_parameters)
+
         # Create lines for SLURM input file by generating job-name, output,
         # error and array parameters based on user input
         status_file_basename = os.path.join(input_file_parameters.output_dir,
                                             prefix + input_file_parameters.job_name)
-        resmng_config = list(input_file_parameters.resource_manager_params)
+        resmng_config = workload_resource_manager_params(workload,
+                                                         input_file_parameters,
+                                                         command_line_parameters)
         resmng_config.append('#SBATCH --job-name={0}'.format(input_file_parameters.job_name))
-        resmng_config.append('#SBATCH --output={0}_%A_%a.out'.format(status_file_basename))
-        resmng_config.append('#SBATCH --error={0}_%A_%a.err'.format(status_file_basename))
-        resmng_config.append('#SBATCH --array={0}-{1}'.format(1, len(workload)))
-
-        resmng_config.append('\n\n')
-        subshell_file_path = '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
-                                                                       workload_index_string,
-                                                                       '"$SLURM_ARRAY_TASK_ID"',
-                                                                       appendix)
-        subshell_file_path = os.path.join(input_file_parameters.output_dir,
-                                          subshell_file_path)
-        resmng_config.append('source {0}'.format(subshell_file_path))
+        if command_line_parameters.pack_cores is not None:
+            resmng_config.append('#SBATCH --output={0}_%j_dispatcher.out'.format(status_file_basename))
+            resmng_config.append('#SBATCH --error={0}_%j_dispatcher.err'.format(status_file_basename))
+            resmng_config.append('\n\n')
+            resmng_config.append(packed_job_command(workload_index_string,
+                                                    thread_index_strings,
+                                                    appendix,
+                                                    status_file_basename + '_{job}_{task}.out',
+                                                    status_file_basename + '_{job}_{task}.err',
+                                                    input_file_parameters,
+                                                    command_line_parameters))
+        else:
+            resmng_config.append('#SBATCH --output={0}_%A_%a.out'.format(status_file_basename))
+            resmng_config.append('#SBATCH --error={0}_%A_%a.err'.format(status_file_basename))
+            resmng_config.append('#SBATCH --array={0}-{1}{2}'.format(
+                1,
+                len(workload),
+                array_throttle(command_line_parameters)))
+
+            resmng_config.append('\n\n')
+            subshell_file_path = '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
+                                                                           workload_index_string,
+                                                                           '"$SLURM_ARRAY_TASK_ID"',
+                                                                           appendix)
+            subshell_file_path = os.path.join(input_file_parameters.output_dir,
+                                              subshell_file_path)
+            resmng_config.append('source {0}'.format(subshell_file_path))
 
         out_fl_path = os.path.join(input_file_parameters.output_dir,file_main_name + appendix)
         workload_file_paths.append(out_fl_path)
@@ -2185,25 +3511,21 @@ def write_torque(workloads, input_file_parameters, command_line_parameters):
         input_file_parameters.resource_manager_params,
         ['#PBS -k', '#PBS -N', '#PBS -d', '#PBS -e', '#PBS -t'])
 
-    workload_index = 0
-    workload_zfill_amount = len(str(len(workloads)))
     workload_file_paths = []
-    for workload in workloads:
+    for workload_index_string, array_suffix, workload in \
+            workload_arrays(workloads, command_line_parameters):
         # Each workflow part will have separate file to submit to TORQUE with
         # sbatch command. Each file has one or more associated subshell files
         # containing contents for each thread.
 
-        # Generate strings describing current workload and thread indexes for
-        # output file names
-        workload_index += 1
-        workload_index_string = str(workload_index).zfill(workload_zfill_amount)
+        # Generate strings describing current workload for output file names
         file_main_name = '{0}_TORQUE_WORKLOAD_{1}'.format(NAME,
                                                           workload_index_string)
 
         # When --fix_run mode is used the output and log files files already
         # exist. To prevent overwriting these files with new ones specific
         # prefix or appendix strings are added to the new output file names.
-        appendix = '.sh'
+        appendix = array_suffix + '.sh'
         i = 0
         if command_line_parameters.fix_run:
             mode = 'FIX'
@@ -2216,33 +3538,24 @@ def write_torque(workloads, input_file_parameters, command_line_parameters):
         while mode is not None and os.path.exists(os.path.join(input_file_parameters.output_dir,
                                                                file_main_name + appendix)):
             i += 1
-            appendix = '_{0}_{1}.sh'.format(mode, i)
+            appendix = '{0}_{1}_{2}.sh'.format(array_suffix, mode, i)
 
         # Generate subshell files
         thread_index = 0
+        thread_index_strings = []
         for thread_contents in workload:
             # Iterate over output commands of each thread and write necessary
             # subshell files for each
-            out_lines = []
-            cmds_in_thread = len(thread_contents)
-            for i in xrange(cmds_in_thread):
-                # Check if any modules need loading or are they loaded by previous command
-                skip_module_loading = False
-                if i > 0:
-                    if thread_contents[i].load_module == thread_contents[i-1].load_module:
-                        skip_module_loading = True
-                # Check if any modules need unloading or will they be used by following command
-                skip_module_unloading = False
-                if i < cmds_in_thread-1:
-                    if thread_contents[i].load_module == thread_contents[i+1].load_module:
-                        skip_module_unloading = True
-                out_lines += generate_subshell_file_contents(thread_contents[i],
-                                                             skip_module_loading,
-                                                             skip_module_unloading)
-
+            thread_index_string = str(thread_index)
+            thread_index_strings.append(thread_index_string)
+            out_lines = generate_thread_file_contents(thread_contents,
+                                                      workload_index_string,
+                                                      thread_index_string,
+                                                      appendix,
+                                                      input_file_parameters,
+                                                      command_line_parameters)
 
             # Write subshell file
-            thread_index_string = str(thread_index)
             fl_name = '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
                                                                 workload_index_string,
                                                                 thread_index_string,
@@ -2260,26 +3573,49 @@ def write_torque(workloads, input_file_parameters, command_line_parameters):
             out_fl.close()
             thread_index += 1
 
+        write_workload_manifest(workload,
+                                thread_index_strings,
+                                workload_index_string,
+                                appendix,
+                                input_file_parameters)
+
         # Create lines for TORQUE input file by generating job-name, output,
         # error and array parameters based on user input
 
         # IF YOU ADD NEW AUTOMATICALLY INFERRED PARAMETERS, REMEMBER TO VALIDATE
         # THEM AT THE BEGINNING OF THIS FUNCTION
-        resmng_config = list(input_file_parameters.resource_manager_params)
+        resmng_config = workload_resource_manager_params(workload,
+                                                         input_file_parameters,
+                                                         command_line_parameters)
         resmng_config.append('#PBS -k eo')
         resmng_config.append('#PBS -N {0}'.format(input_file_parameters.job_name))
         resmng_config.append('#PBS -d {0}'.format(input_file_parameters.output_dir))
         resmng_config.append('#PBS -e {0}'.format(input_file_parameters.output_dir))
-        resmng_config.append('#PBS -t {0}-{1}'.format(0, len(workload)-1))
-
-        resmng_config.append('\n\n')
-        subshell_file_path = '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
-                                                                       workload_index_string,
-                                                                       '"${PBS_ARRAYID}"',
-                                                                       appendix)
-        subshell_file_path = os.path.join(input_file_parameters.output_dir,
-                                          subshell_file_path)
-        resmng_config.append('source {0}'.format(subshell_file_path))
+        if command_line_parameters.pack_cores is not None:
+            job_file_basename = os.path.join(input_file_parameters.output_dir,
+                                             input_file_parameters.job_name)
+            resmng_config.append('\n\n')
+            resmng_config.append(packed_job_command(workload_index_string,
+                                                    thread_index_strings,
+                                                    appendix,
+                                                    job_file_basename + '.o{job}-{task}',
+                                                    job_file_basename + '.e{job}-{task}',
+                                                    input_file_parameters,
+                                                    command_line_parameters))
+        else:
+            resmng_config.append('#PBS -t {0}-{1}{2}'.format(
+                0,
+                len(workload)-1,
+                array_throttle(command_line_parameters)))
+
+            resmng_config.append('\n\n')
+            subshell_file_path = '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
+                                                                           workload_index_string,
+                                                                           '"${PBS_ARRAYID}"',
+                                                                           appendix)
+            subshell_file_path = os.path.join(input_file_parameters.output_dir,
+                                              subshell_file_path)
+            resmng_config.append('source {0}'.format(subshell_file_path))
 
         out_fl_path = os.path.join(input_file_parameters.output_dir,file_main_name + appendix)
         workload_file_paths.append(out_fl_path)
@@ -2362,30 +3698,21 @@ def write_unix(workloads, input_file_parameters, command_line_parameters):
 
         # Generate subshell files
         thread_index = 0
+        thread_index_strings = []
         thread_zfill_amount = len(str(len(workload)))
         for thread_contents in workload:
             # Iterate over output commands of each thread and write necessary
             # subshell files for each
-            out_lines = []
-            cmds_in_thread = len(thread_contents)
-            for i in xrange(cmds_in_thread):
-                # Check if any modules need loading or are they loaded by previous command
-                skip_module_loading = False
-                if i > 0:
-                    if thread_contents[i].load_module == thread_contents[i-1].load_module:
-                        skip_module_loading = True
-                # Check if any modules need unloading or will they be used by following command
-                skip_module_unloading = False
-                if i < cmds_in_thread-1:
-                    if thread_contents[i].load_module == thread_contents[i+1].load_module:
-                        skip_module_unloading = True
-                out_lines += generate_subshell_file_contents(thread_contents[i],
-                                                             skip_module_loading,
-                                                             skip_module_unloading)
-
+            thread_index_string = str(thread_index).zfill(thread_zfill_amount)
+            thread_index_strings.append(thread_index_string)
+            out_lines = generate_thread_file_contents(thread_contents,
+                                                      workload_index_string,
+                                                      thread_index_string,
+                                                      appendix,
+                                                      input_file_parameters,
+                                                      command_line_parameters)
 
             # Write subshell file
-            thread_index_string = str(thread_index).zfill(thread_zfill_amount)
             fl_name = '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
                                                                 workload_index_string,
                                                                 thread_index_string,
@@ -2407,6 +3734,11 @@ def write_unix(workloads, input_file_parameters, command_line_parameters):
                 os.path.join(input_file_parameters.output_dir,
                              fl_name)))
             thread_index += 1
+        write_workload_manifest(workload,
+                                thread_index_strings,
+                                workload_index_string,
+                                appendix,
+                                input_file_parameters)
 
         # Workflow steps are written to a single output file (instead of
         # separate files). "wait" command is inserted in between workflow parts
@@ -2433,6 +3765,308 @@ def write_unix(workloads, input_file_parameters, command_line_parameters):
     return [out_fl_path]
 
 
+def write_workload_manifest(workload, thread_index_strings,
+                            workload_index_string, appendix,
+                            input_file_parameters):
+    """Writes a file describing the commands run in each task of a workload.
+
+    The manifest is used to map resource manager accounting information to
+    the tools run in each task (see --learn_resources).
+
+    Parameters:
+    workload: List of threads, each being a list of command objects.
+    thread_index_strings: Thread indexes as used in subshell file names.
+    workload_index_string: Index of the current workload as used in file names.
+    appendix: Appendix of the output file names (depends on run mode).
+    input_file_parameters: Run parameters defined in the staplefile.
+
+    Raises:
+    STAPLERerror: Unable to open output file.
+    """
+    sizes = resources.id_sizes(input_file_parameters.starting_point_directory)
+    manifest = {}
+    for thread_index_string, thread_contents in zip(thread_index_strings,
+                                                   workload):
+        manifest[thread_index_string.lstrip('0') or '0'] = {
+            'tools': [cmd.name for cmd in thread_contents],
+            'ids': [cmd.command_ids for cmd in thread_contents],
+            'input_bytes': [resources.command_input_size(cmd, sizes)
+                            for cmd in thread_contents]}
+
+    fl_name = '{0}_WORKLOAD_{1}_manifest{2}'.format(NAME,
+                                                    workload_index_string,
+                                                    appendix.replace('.sh', '.json'))
+    out_fl_path = os.path.join(input_file_parameters.output_dir, fl_name)
+    try:
+        out_fl = open(out_fl_path, 'w')
+    except IOError as emsg:
+        raise STAPLERerror.STAPLERerror('Unable to create output file:'
+                                        '\n{0}\n with error message:\n{1}'
+                                        .format(out_fl_path, str(emsg)))
+    json.dump(manifest, out_fl, indent=1, sort_keys=True)
+    out_fl.close()
+
+
+def workload_resource_manager_params(workload, input_file_parameters,
+                                     command_line_parameters):
+    """Returns the resource manager parameters for a single workload.
+
+    If --right_size is used, the run time and memory requests defined in the
+    staplefile are replaced with requests predicted by the resource model.
+    If --pack is used, the core and node requests are replaced with a request
+    for a whole node. The tasks of a packed job are run in waves, so the run
+    time request of the staplefile is multiplied by the number of waves.
+
+    Parameters:
+    workload: List of threads, each being a list of command objects.
+    input_file_parameters: Run parameters defined in the staplefile.
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Returns:
+    resmng_config: List of resource manager parameter lines
+    """
+    resmng_config = list(input_file_parameters.resource_manager_params)
+    if command_line_parameters.resumable and \
+            command_line_parameters.resource_manager in REQUEUE_PARAMETERS:
+        requeue_parameter = REQUEUE_PARAMETERS[command_line_parameters.resource_manager]
+        if requeue_parameter not in resmng_config:
+            resmng_config.append(requeue_parameter)
+    if command_line_parameters.pack_cores is not None:
+        resmng_config = packed_resource_manager_params(resmng_config,
+                                                       command_line_parameters)
+    if command_line_parameters.right_size is None:
+        if command_line_parameters.pack_cores is not None:
+            waves = int(math.ceil(float(len(workload)) /
+                                  pack_slots(command_line_parameters)))
+            resmng_config = scale_time_request(resmng_config,
+                                               waves,
+                                               command_line_parameters.resource_manager)
+        return resmng_config
+
+    model = resources.load_model(command_line_parameters.resource_model_path)
+    sizes = resources.id_sizes(input_file_parameters.starting_point_directory)
+    prediction = resources.predict_workload(model,
+                                            workload,
+                                            sizes,
+                                            command_line_parameters.right_size)
+    if prediction is None:
+        logging.warning('Resource model does not contain all tools of a '
+                        'workflow part, using the resource requests of the '
+                        'staplefile.')
+        return resmng_config
+    wall_s, memory_mb = prediction
+    if command_line_parameters.pack_cores is not None:
+        # The tasks of a packed job are run in waves of slots tasks
+        slots = pack_slots(command_line_parameters)
+        wall_s *= int(math.ceil(float(len(workload)) / slots))
+        memory_mb *= min(len(workload), slots)
+    logging.info('Right-sized resource request: {0} run time, {1} MB '
+                 'memory.'.format(resources.format_time(wall_s), memory_mb))
+
+    resource_manager = command_line_parameters.resource_manager
+    if resource_manager == 'slurm':
+        resmng_config = [p for p in resmng_config
+                         if not (p.startswith('#SBATCH --time') or
+                                 p.startswith('#SBATCH -t ') or
+                                 p.startswith('#SBATCH --mem'))]
+        resmng_config.append('#SBATCH --time={0}'.format(resources.format_time(wall_s)))
+        resmng_config.append('#SBATCH --mem={0}M'.format(memory_mb))
+    elif resource_manager in ('sge', 'torque'):
+        if resource_manager == 'sge':
+            prefix = '#$ -l'
+            time_keys = ('h_rt', 's_rt')
+            memory_keys = ('h_vmem', 's_vmem', 'mem_free', 'mem')
+        else:
+            prefix = '#PBS -l'
+            time_keys = ('walltime',)
+            memory_keys = ('mem', 'pmem', 'vmem', 'pvmem')
+        new_config = []
+        for p in resmng_config:
+            if p.startswith(prefix):
+                requests = [r for r in p[len(prefix):].strip().split(',')
+                            if r.split('=')[0] not in time_keys + memory_keys]
+                if requests:
+                    new_config.append('{0} {1}'.format(prefix, ','.join(requests)))
+            else:
+                new_config.append(p)
+        resmng_config = new_config
+        if resource_manager == 'sge':
+            # Memory is requested per slot in SGE
+            slots = 1
+            for p in resmng_config:
+                if p.startswith('#$ -pe'):
+                    try:
+                        slots = int(p.split()[-1])
+                    except ValueError:
+                        pass
+            resmng_config.append('#$ -l h_rt={0},h_vmem={1}M'.format(
+                resources.format_time(wall_s),
+                int(math.ceil(float(memory_mb) / slots))))
+        else:
+            resmng_config.append('#PBS -l walltime={0},mem={1}mb'.format(
+                resources.format_time(wall_s), memory_mb))
+    elif resource_manager == 'lsf':
+        resmng_config = [p for p in resmng_config
+                         if not (p.replace(' ', '').startswith('#BSUB-W') or
+                                 p.replace(' ', '').startswith('#BSUB-M'))]
+        resmng_config.append('#BSUB -W {0}:{1:02d}'.format(
+            wall_s // 3600,
+            int(math.ceil(wall_s % 3600 / 60.0))))
+        resmng_config.append('#BSUB -M {0}MB'.format(memory_mb))
+    return resmng_config
+
+
+def packed_resource_manager_params(resmng_config, command_line_parameters):
+    """Replaces the core and node requests with a request for a whole node.
+
+    Parameters:
+    resmng_config: List of resource manager parameter lines
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Returns:
+    resmng_config: List of resource manager parameter lines
+    """
+    cores = command_line_parameters.pack_cores
+    resource_manager = command_line_parameters.resource_manager
+    if resource_manager == 'slurm':
+        resmng_config = [p for p in resmng_config
+                         if p.replace('=', ' ').split()[1:2] not in
+                         (['--nodes'], ['-N'], ['--ntasks'], ['-n'],
+                          ['--cpus-per-task'], ['-c'], ['--ntasks-per-node'])]
+        resmng_config.append('#SBATCH --nodes=1')
+        resmng_config.append('#SBATCH --ntasks=1')
+        resmng_config.append('#SBATCH --cpus-per-task={0}'.format(cores))
+    elif resource_manager == 'sge':
+        parallel_environment = 'smp'
+        new_config = []
+        for p in resmng_config:
+            if p.startswith('#$ -pe'):
+                parallel_environment = p.split()[2]
+            else:
+                new_config.append(p)
+        resmng_config = new_config
+        resmng_config.append('#$ -pe {0} {1}'.format(parallel_environment,
+                                                    cores))
+    elif resource_manager == 'lsf':
+        resmng_config = [p for p in resmng_config
+                         if not (p.replace(' ', '').startswith('#BSUB-n') or
+                                 p.replace(' ', '').startswith('#BSUB-R"span'))]
+        resmng_config.append('#BSUB -n {0}'.format(cores))
+        resmng_config.append('#BSUB -R "span[hosts=1]"')
+    elif resource_manager == 'torque':
+        new_config = []
+        for p in resmng_config:
+            if p.startswith('#PBS -l'):
+                requests = [r for r in p[len('#PBS -l'):].strip().split(',')
+                            if r.split('=')[0] not in ('nodes', 'ppn', 'procs')]
+                if requests:
+                    new_config.append('#PBS -l {0}'.format(','.join(requests)))
+            else:
+                new_config.append(p)
+        resmng_config = new_config
+        resmng_config.append('#PBS -l nodes=1:ppn={0}'.format(cores))
+    return resmng_config
+
+
+def parse_time_request(value, resource_manager):
+    """Parses the run time request of a resource manager into seconds.
+
+    Parameters:
+    value: Run time value of the resource manager parameter.
+    resource_manager: Name of the resource manager.
+
+    Returns:
+    Run time in seconds, None if the run time is unlimited.
+
+    Raises:
+    STAPLERerror: The value is not a valid run time.
+    """
+    if value.lower() in ('unlimited', 'infinite'):
+        return None
+    try:
+        if resource_manager == 'slurm':
+            # [days-]hours[:minutes[:seconds]] or minutes[:seconds] or
+            # hours:minutes:seconds
+            days = 0
+            if '-' in value:
+                days, value = value.split('-', 1)
+                parts = [int(p) for p in value.split(':')]
+                parts += [0] * (3 - len(parts))
+            else:
+                parts = [int(p) for p in value.split(':')]
+                if len(parts) < 3:
+                    parts = [0] + parts + [0] * (2 - len(parts))
+            if len(parts) != 3:
+                raise ValueError
+            return int(days) * 86400 + parts[0] * 3600 + parts[1] * 60 + parts[2]
+        if resource_manager == 'lsf':
+            # [hours:]minutes
+            parts = [int(p) for p in value.split(':')]
+            if len(parts) > 2:
+                raise ValueError
+            minutes = parts[0] * 60 + parts[1] if len(parts) == 2 else parts[0]
+            return minutes * 60
+        return int(resources.parse_duration(value))
+    except ValueError:
+        raise STAPLERerror.STAPLERerror('Unable to parse the run time request '
+                                        '{0} of the resource manager '
+                                        'parameters!'.format(value))
+
+
+def scale_time_request(resmng_config, factor, resource_manager):
+    """Multiplies the run time request of the resource manager parameters.
+
+    Parameters:
+    resmng_config: List of resource manager parameter lines
+    factor: Integer the run time request is multiplied with.
+    resource_manager: Name of the resource manager.
+
+    Returns:
+    resmng_config: List of resource manager parameter lines
+
+    Raises:
+    STAPLERerror: The run time request is not valid.
+    """
+    if factor <= 1:
+        return resmng_config
+    new_config = []
+    for p in resmng_config:
+        if resource_manager == 'slurm' and \
+                p.replace('=', ' ').split()[1:2] in (['--time'], ['-t']):
+            seconds = parse_time_request(p.replace('=', ' ').split()[2],
+                                         resource_manager)
+            if seconds is not None:
+                p = '#SBATCH --time={0}'.format(
+                    resources.format_time(seconds * factor))
+        elif resource_manager in ('sge', 'torque'):
+            prefix = {'sge': '#$ -l', 'torque': '#PBS -l'}[resource_manager]
+            time_keys = {'sge': ('h_rt', 's_rt'),
+                         'torque': ('walltime',)}[resource_manager]
+            if p.startswith(prefix):
+                requests = []
+                for r in p[len(prefix):].strip().split(','):
+                    key = r.split('=')[0]
+                    if key in time_keys:
+                        seconds = parse_time_request(r.split('=', 1)[1],
+                                                     resource_manager)
+                        if seconds is not None:
+                            r = '{0}={1}'.format(
+                                key, resources.format_time(seconds * factor))
+                    requests.append(r)
+                p = '{0} {1}'.format(prefix, ','.join(requests))
+        elif resource_manager == 'lsf' and \
+                p.replace(' ', '').startswith('#BSUB-W'):
+            seconds = parse_time_request(p.split()[-1], resource_manager)
+            if seconds is not None:
+                seconds *= factor
+                p = '#BSUB -W {0}:{1:02d}'.format(seconds // 3600,
+                                                  seconds % 3600 // 60)
+        new_config.append(p)
+    return new_config
+
+
 def validate_resource_manager_parameters(user_defined_parameters,
                                          auto_defined_parameters):
     """Checks that user is has not defined any parameters that are auto-created
@@ -2456,11 +4090,164 @@ def validate_resource_manager_parameters(user_defined_parameters,
                                                 'inferred by {1}.'.format(adp, NAME))
 
 
-def generate_subshell_file_contents(cmd, skip_module_loading, skip_module_unloading):
+def generate_thread_file_contents(thread_contents, workload_index_string,
+                                  thread_index_string, appendix,
+                                  input_file_parameters,
+                                  command_line_parameters):
+    """Creates the contents of a subshell file for a single thread.
+
+    Parameters:
+    thread_contents: List of command objects to run in this thread.
+    workload_index_string: Index of the current workload as used in file names.
+    thread_index_string: Index of the current thread as used in file names.
+    appendix: Appendix of the output file names (depends on run mode).
+    input_file_parameters: Run parameters defined in the staplefile.
+    command_line_parameters: Named tuple containing parameters defined by
+    user's command line
+
+    Returns:
+    out_lines: List of strings to be written to a subshell file
+    """
+    # Options for the runtime command launcher, commands are run without the
+    # launcher if no options are defined
+    launcher_options = {}
+    if command_line_parameters.telemetry:
+        telemetry_file_name = '{0}_WORKLOAD_{1}_telemetry{2}'.format(
+            NAME,
+            workload_index_string,
+            appendix.replace('.sh', '.jsonl'))
+        launcher_options['--telemetry'] = os.path.join(
+            input_file_parameters.output_dir,
+            telemetry_file_name)
+        launcher_options['--workload'] = workload_index_string
+        launcher_options['--task'] = thread_index_string
+        id_sizes = resources.id_sizes(input_file_parameters.starting_point_directory)
+    if command_line_parameters.stall_timeout is not None:
+        stall_log_name = '{0}_WORKLOAD_{1}_stalls{2}'.format(
+            NAME,
+            workload_index_string,
+            appendix.replace('.sh', '.jsonl'))
+        launcher_options['--stall_log'] = os.path.join(
+            input_file_parameters.output_dir,
+            stall_log_name)
+        launcher_options['--workload'] = workload_index_string
+        launcher_options['--task'] = thread_index_string
+
+    run_dirs = []
+    if command_line_parameters.resumable:
+        marker_dir = os.path.join(input_file_parameters.output_dir,
+                                  MARKER_DIR_NAME)
+        run_dirs.append(marker_dir)
+    failure_dir = None
+    if not command_line_parameters.keep_going:
+        failure_dir = os.path.join(input_file_parameters.output_dir,
+                                   FAILURE_DIR_NAME)
+        run_dirs.append(failure_dir)
+    for run_dir in run_dirs:
+        if not os.path.isdir(run_dir):
+            try:
+                os.mkdir(run_dir)
+            except OSError as emsg:
+                raise STAPLERerror.STAPLERerror('Unable to create directory:'
+                                                '\n{0}\n with error message:'
+                                                '\n{1}'.format(run_dir,
+                                                               str(emsg)))
+
+    out_lines = []
+    if failure_dir is not None:
+        # Failures inside pipes, of any statement of a command line (caught by
+        # the ERR trap) and of decompressing inputs in process substitutions
+        # fail the command too
+        stream_failure_path = os.path.join(
+            failure_dir,
+            '{0}_WORKLOAD_{1}_subshell_{2}{3}'.format(NAME,
+                                                      workload_index_string,
+                                                      thread_index_string,
+                                                      appendix.replace('.sh', '.stream_error')))
+        out_lines.append('set -o pipefail')
+        out_lines.append("trap 'stapler_rc=$?' ERR")
+        out_lines.append('export {0}={1}'.format(utils.STREAM_FAILURE_VARIABLE,
+                                                 pipes.quote(stream_failure_path)))
+        out_lines.append('rm -f "${0}"'.format(utils.STREAM_FAILURE_VARIABLE))
+        # IDs failed in this subshell and the exit code of the subshell
+        out_lines.append('stapler_failed_ids=')
+        out_lines.append('stapler_exit=0')
+    cmds_in_thread = len(thread_contents)
+    for i in xrange(cmds_in_thread):
+        # Check if any modules need loading or are they loaded by previous command
+        skip_module_loading = False
+        if i > 0:
+            if thread_contents[i].load_module == thread_contents[i-1].load_module:
+                skip_module_loading = True
+        # Check if any modules need unloading or will they be used by following command
+        skip_module_unloading = False
+        if i < cmds_in_thread-1:
+            if thread_contents[i].load_module == thread_contents[i+1].load_module:
+                skip_module_unloading = True
+        command_launcher_options = dict(launcher_options)
+        if command_line_parameters.telemetry:
+            command_launcher_options['--id_bytes'] = str(
+                resources.command_input_size(thread_contents[i], id_sizes))
+        if command_line_parameters.stall_timeout is not None:
+            stall_timeout = command_line_parameters.stall_timeout or \
+                thread_contents[i].stall_timeout
+            command_launcher_options['--stall_timeout'] = str(stall_timeout * 60)
+        marker_path = None
+        if command_line_parameters.resumable:
+            marker_path = os.path.join(
+                marker_dir,
+                '{0}_WORKLOAD_{1}_subshell_{2}_{3}{4}'.format(
+                    NAME,
+                    workload_index_string,
+                    thread_index_string,
+                    i+1,
+                    appendix.replace('.sh', '.done')))
+        out_lines += generate_subshell_file_contents(thread_contents[i],
+                                                     skip_module_loading,
+                                                     skip_module_unloading,
+                                                     command_launcher_options,
+                                                     command_line_parameters.job_steps,
+                                                     marker_path,
+                                                     failure_dir,
+                                                     workload_index_string)
+    if failure_dir is not None:
+        out_lines.append('exit $stapler_exit')
+    return out_lines
+
+
+def generate_subshell_file_contents(cmd, skip_module_loading,
+                                    skip_module_unloading,
+                                    launcher_options=None,
+                                    job_steps=False,
+                                    marker_path=None,
+                                    failure_dir=None,
+                                    workload_index_string=None):
     """Creates a list of necessary information for each output command.
 
     Parameters:
     cmd: Instance of GenericBase or subclass of it
+    skip_module_loading: Do not write module loading lines.
+    skip_module_unloading: Do not write module unloading lines.
+    launcher_options: Dict of option:value pairs for the runtime command
+    launcher. Command lines are run without the launcher if this is empty.
+    job_steps: Run the command lines as SLURM job steps.
+    marker_path: Path to the completion marker of the command. If defined,
+    the command is skipped when the marker and the output files exist, the
+    outputs are written under temporary names and a failed command is not
+    marked as finished (see --resumable).
+
+    If a stall timeout is defined in the launcher options, the output files
+    of the command are watched by the launcher and a command killed by it
+    is handled as a failed command (see --watchdog).
+    failure_dir: Directory recording the IDs of failed and running commands.
+    If defined, the command is skipped when an earlier command of the
+    subshell or a command of an earlier workload has failed or has been
+    interrupted for any of its IDs. A failure
+    of a command line skips the rest of the command and is recorded for its
+    IDs, while the commands of other IDs of the subshell are still run (see
+    --keep_going). The subshell exits with the code of the first failure.
+    workload_index_string: Index of the workload of the command, required
+    with failure_dir.
 
     Returns:
     out_lines: List of strings to be written to a subshell file
@@ -2473,18 +4260,93 @@ def generate_subshell_file_contents(cmd, skip_module_loading, skip_module_unload
     cmd_list = cmd.command_lines
     cmd_list = map(clean_command_lines, cmd_list)
 
+    output_paths = command_output_paths(cmd)
+    if launcher_options and '--stall_timeout' in launcher_options:
+        # Outputs with unpredictable names are noticed from the modification
+        # time of the output directory
+        launcher_options = dict(launcher_options)
+        launcher_options['--watch'] = list(output_paths)
+        if cmd.out_dir is not None:
+            launcher_options['--watch'].insert(0, cmd.out_dir.path)
+        if marker_path is not None:
+            launcher_options['--watch'] += map(temp_output_path, output_paths)
+    if failure_dir is not None:
+        failure_paths = ' '.join(failure_record_paths(cmd, failure_dir,
+                                                      workload_index_string))
+        running_paths = ' '.join(failure_record_paths(cmd, failure_dir,
+                                                      workload_index_string,
+                                                      RUNNING_RECORD_EXTENSION))
+        # Commands of earlier workloads that failed or were interrupted
+        upstream_failures = ' '.join(failure_record_paths(cmd, failure_dir, '*',
+                                                          '.*'))
+        # The IDs are matched as ' <id> ' in the list of failed IDs
+        id_patterns = ['*{0}*'.format(pipes.quote(' {0} '.format(i)))
+                       for i in cmd.command_ids]
+        failed_ids = ' '.join(map(pipes.quote, cmd.command_ids))
+        skip_message = pipes.quote('Skipping {0} of {1}, as an earlier command '
+                                   'failed for the same IDs.'.format(
+                                       cmd.name, ','.join(cmd.command_ids)))
+
+        # Modules are loaded also for skipped commands, as the following
+        # commands may rely on them
+        if not skip_module_loading:
+            out_lines += cmd.load_module
+        skip_module_loading = True
+        out_lines.append('stapler_skip=')
+        out_lines.append('for f in {0}; do n=${{f##*__WORKLOAD_}}; if [ -e "$f" ] '
+                         '&& [ "${{n%.*}}" -lt {1} ]; then stapler_skip=1; '
+                         'fi; done'.format(upstream_failures,
+                                           int(workload_index_string)))
+        out_lines.append('case " $stapler_failed_ids " in {0}) stapler_skip=1;; '
+                         'esac'.format('|'.join(id_patterns)))
+        out_lines.append('if [ -n "$stapler_skip" ]; then')
+        out_lines.append('echo ' + skip_message)
+        out_lines.append('echo {0} >&2'.format(skip_message))
+        out_lines.append('stapler_failed_ids="$stapler_failed_ids "{0}'.format(
+            failed_ids))
+        out_lines.append('[ $stapler_exit -ne 0 ] || stapler_exit={0}'.format(
+            UPSTREAM_FAILURE_EXIT_CODE))
+        out_lines.append('else')
+        # Records of an earlier failed run of this command are replaced with
+        # records of the running command, which are left in place if the
+        # job is killed before the command ends
+        out_lines.append('rm -f {0}'.format(failure_paths))
+        out_lines.append('for f in {0}; do printf "%s\\t%s\\n" {1} "$(date)" > '
+                         '"$f"; done'.format(running_paths, pipes.quote(cmd.name)))
+        out_lines.append('stapler_rc=0')
+
+    if marker_path is not None:
+        # Write outputs under temporary names, longest paths first as a path
+        # may be a prefix of another
+        for path in sorted(output_paths, key=len, reverse=True):
+            cmd_list = [c.replace(path, temp_output_path(path)) for c in cmd_list]
+
+        if not skip_module_loading:
+            out_lines += cmd.load_module
+        skip_module_loading = True
+        completed_test = ' && '.join(['[ -e {0} ]'.format(pipes.quote(p)) for p
+                                      in [marker_path] + output_paths])
+        out_lines.append('if {0}; then'.format(completed_test))
+        out_lines.append('echo Skipping completed command: ' +
+                         pipes.quote(' '.join(cmd.command_lines)))
+        out_lines.append('echo Skipping completed command: ' +
+                         pipes.quote(' '.join(cmd.command_lines)) + ' >&2')
+        out_lines.append('else')
+        # Remove outputs left by an interrupted run
+        out_lines += ['rm -rf {0}'.format(p) for p in temp_output_globs(output_paths)]
+
     # Write current command to stdout
     out_lines.append('echo ' + '-'*80)
     out_lines.append('echo Executing the following command:')
     for c in cmd_list:
-        out_lines.append('echo "' + c + '"')
+        out_lines.append('echo ' + pipes.quote(c))
     out_lines.append('date')
 
     # Write current command to errout
     out_lines.append('echo ' + '-'*80 + ' >&2')
     out_lines.append('echo Executing the following command: >&2')
     for c in cmd_list:
-        out_lines.append('echo "' + c + '" >&2')
+        out_lines.append('echo ' + pipes.quote(c) + ' >&2')
     out_lines.append('date >&2')
 
     # Write module load commands required for current command to
@@ -2495,15 +4357,59 @@ def generate_subshell_file_contents(cmd, skip_module_loading, skip_module_unload
                 out_lines.append(module)
 
     # Write command lines to the output shell script
-    out_lines += cmd_list
+    for c in cmd_list:
+        command_line = wrap_command_line(c, cmd, launcher_options, job_steps,
+                                         strict=failure_dir is not None)
+        if failure_dir is not None:
+            # The rest of the command lines are skipped after a failure. The
+            # command line is not followed by || as the ERR trap is not run
+            # for the commands of || lists.
+            out_lines.append('if [ $stapler_rc -eq 0 ]; then')
+            out_lines.append(command_line)
+            out_lines.append('stapler_last=$?; [ $stapler_last -eq 0 ] || '
+                             'stapler_rc=$stapler_last')
+            if '<(' in command_line:
+                out_lines.append('wait; if [ -e "${0}" ]; then rm -f "${0}"; '
+                                 '[ $stapler_rc -ne 0 ] || stapler_rc=1; echo '
+                                 'Decompressing an input file failed. >&2; '
+                                 'fi'.format(utils.STREAM_FAILURE_VARIABLE))
+            out_lines.append('fi')
+            continue
+        elif marker_path is not None:
+            command_line += ' || exit $?'
+        elif command_line != c and '--stall_timeout' in launcher_options:
+            command_line += ' || [ $? -ne {0} ] || exit {0}'.format(
+                launcher.STALL_EXIT_CODE)
+        out_lines.append(command_line)
+    if failure_dir is not None:
+        out_lines.append('if [ $stapler_rc -ne 0 ]; then')
+        out_lines.append('for f in {0}; do printf "%s\\t%s\\t%s\\n" {1} '
+                         '"$stapler_rc" "$(date)" > "$f"; done'.format(
+                             failure_paths, pipes.quote(cmd.name)))
+        out_lines.append('echo Command failed with exit code $stapler_rc. >&2')
+        out_lines.append('stapler_failed_ids="$stapler_failed_ids "{0}'.format(
+            failed_ids))
+        out_lines.append('[ $stapler_exit -ne 0 ] && [ $stapler_exit -ne {0} ] '
+                         '|| stapler_exit=$stapler_rc'.format(
+                             UPSTREAM_FAILURE_EXIT_CODE))
+        out_lines.append('fi')
     out_lines += ['#']*5
 
-    # Write module unload commands required for current command
-    # to the output shell script
-    if not skip_module_unloading:
-        if cmd.unload_module:
-            for module in cmd.unload_module:
-                out_lines.append(module)
+    if marker_path is not None:
+        # Rename the outputs and write the completion marker
+        if failure_dir is not None:
+            out_lines.append('if [ $stapler_rc -eq 0 ]; then')
+        for temp_glob in temp_output_globs(output_paths):
+            out_lines.append('for f in {0}; do [ -e "$f" ] && mv -f "$f" '
+                             '"$(dirname "$f")/$(basename "$f" | cut -c{1}-)"; '
+                             'done'.format(temp_glob, len(TEMP_OUTPUT_PREFIX) + 1))
+        out_lines.append('printf "%s\\n" {0} > {1}'.format(
+            ' '.join(map(pipes.quote, output_paths)) or '""',
+            pipes.quote(marker_path)))
+        if failure_dir is not None:
+            out_lines.append('fi')
+    if failure_dir is not None:
+        out_lines.append('rm -f {0}'.format(running_paths))
 
     #Write to stdout
     out_lines.append('echo Finished at:')
@@ -2511,10 +4417,154 @@ def generate_subshell_file_contents(cmd, skip_module_loading, skip_module_unload
     #Write to errout
     out_lines.append('echo Finished at: >&2')
     out_lines.append('date >&2')
+    if marker_path is not None:
+        out_lines.append('fi')
+    if failure_dir is not None:
+        out_lines.append('fi')
+
+    # Write module unload commands required for current command
+    # to the output shell script
+    if not skip_module_unloading:
+        if cmd.unload_module:
+            for module in cmd.unload_module:
+                out_lines.append(module)
 
     return out_lines
 
 
+def command_output_paths(cmd):
+    """Returns the paths of the predicted output files of a command.
+
+    Output files are the values of the command line arguments pointing to
+    predicted files of the output directory. Commands writing to their input
+    directory (or no output directory at all) have no distinguishable output
+    files.
+
+    Parameters:
+    cmd: Instance of GenericBase or subclass of it
+
+    Returns:
+    List of absolute paths.
+    """
+    if cmd.out_dir is None or cmd.in_dir is cmd.out_dir or \
+            not isinstance(cmd.out_cmd, dict):
+        return []
+    output_paths = []
+    for value in cmd.out_cmd.values():
+        if not isinstance(value, list):
+            value = [value]
+        for v in value:
+            if isinstance(v, basestring) and \
+                    os.path.dirname(v) == cmd.out_dir.path and \
+                    os.path.basename(v) in cmd.out_dir.file_names and \
+                    v not in output_paths:
+                output_paths.append(v)
+    return sorted(output_paths)
+
+
+def failure_record_paths(cmd, failure_dir, workload_index_string,
+                         extension='.failed'):
+    """Returns the paths of the failure records of the IDs of a command.
+
+    Parameters:
+    cmd: Instance of GenericBase or subclass of it
+    failure_dir: Directory containing the failure records.
+    workload_index_string: Index of the workload as used in file names, or *
+    to return glob patterns matching the records of all workloads.
+    extension: Extension of the records (.failed, RUNNING_RECORD_EXTENSION
+    or .* to match both).
+
+    Returns:
+    List of shell quoted paths (or glob patterns).
+    """
+    record_name = '__WORKLOAD_{0}{1}'.format(workload_index_string, extension)
+    return [pipes.quote(os.path.join(failure_dir, command_id)) + record_name
+            for command_id in cmd.command_ids]
+
+
+def temp_output_path(path):
+    """Returns the temporary name of an output file of a resumable subshell."""
+    return os.path.join(os.path.dirname(path),
+                        TEMP_OUTPUT_PREFIX + os.path.basename(path))
+
+
+def temp_output_globs(output_paths):
+    """Returns shell glob patterns matching the temporary outputs of a command.
+
+    The patterns also match files the tools name after the output files, such
+    as index files (e.g. .stapler_tmp.sample.bam.bai or .stapler_tmp.sample.bai).
+
+    Parameters:
+    output_paths: Output file paths of the command.
+
+    Returns:
+    List of glob patterns.
+    """
+    globs = []
+    for path in output_paths:
+        stem = temp_output_path(utils.splitext(path)[0])
+        for temp_glob in [pipes.quote(temp_output_path(path)),
+                          pipes.quote(stem) + '.*']:
+            if temp_glob not in globs:
+                globs.append(temp_glob)
+    return globs
+
+
+def wrap_command_line(command_line, cmd, launcher_options, job_steps=False,
+                      strict=False):
+    """Wraps a command line to be run with the runtime command launcher
+    and/or as a SLURM job step.
+
+    Command lines that modify the state of the subshell (e.g. cd or export)
+    are never wrapped, as the launcher and srun run each command in a
+    separate process.
+
+    Parameters:
+    command_line: Command line string
+    cmd: Instance of GenericBase or subclass of it the command line belongs to
+    launcher_options: Dict of option:value pairs for the launcher. Options
+    with a list value are repeated for each value.
+    job_steps: Run the command line as a SLURM job step named <tool>:<ids>.
+    strict: Make the wrapped command line fail at the first failed statement
+    or pipe, as the checks of the subshell do not reach into the separate
+    process (see --keep_going).
+
+    Returns:
+    command_line: Command line string
+    """
+    if not launcher_options and not job_steps:
+        return command_line
+    first_word = command_line.split(' ', 1)[0]
+    if first_word in SHELL_STATE_COMMANDS or '=' in first_word:
+        return command_line
+    if strict:
+        command_line = 'set -e -o pipefail; ' + command_line
+
+    if launcher_options:
+        wrapped_command = ['python', utils.LAUNCHER_PATH]
+        for option, value in sorted(launcher_options.iteritems()):
+            if isinstance(value, list):
+                for v in value:
+                    wrapped_command += [option, v]
+            else:
+                wrapped_command += [option, value]
+        wrapped_command += ['--tool', cmd.name,
+                            '--ids', ','.join(cmd.command_ids),
+                            '--',
+                            command_line]
+        command_line = ' '.join(map(pipes.quote, wrapped_command))
+    if job_steps:
+        # The thread count is left unquoted to be expanded by the subshell
+        step_name = '{0}{1}{2}'.format(cmd.name,
+                                       resources.JOB_STEP_NAME_SEPARATOR,
+                                       ','.join(cmd.command_ids))
+        command_line = 'srun --exclusive -n1 -c{0} --job-name={1} bash -c {2}'.format(
+            JOB_STEP_THREADS,
+            pipes.quote(step_name),
+            pipes.quote(command_line))
+    return command_line
+
+
 def clean_command_lines(cmd):
     """Ensures that arguments and values are (single) white space -separated.
 
@@ -13,6 +13,7 @@ import Mosaik
 import Picard
 import PGU
 import psmc
+import reference
 import samtools
 import soap2
 import tabix
@@ -27,6 +28,7 @@ commands = {'CUSTOM':Custom.Custom,
             'stapler_bcftools_call':bcftools.bcftools_call,
             'stapler_bcftools_mpileup':bcftools.bcftools_mpileup,
             'stapler_bgzip':tabix.bgzip,
+            'stapler_bgzip_in_place':unix.bgzip_in_place,
             'stapler_bowtie2':bowtie2.bowtie2,
             'stapler_bwa_mem':BWA.bwa_mem,
             'stapler_bwa_bwasw':BWA.bwa_bwasw,
@@ -50,6 +52,8 @@ commands = {'CUSTOM':Custom.Custom,
             'stapler_psmc_fq2psmcfa':psmc.psmc_fq2psmcfa,
             'stapler_gatk_ApplyBQSR':GATK.ApplyBQSR,
             'stapler_gatk_BaseRecalibrator':GATK.BaseRecalibrator,
+            'stapler_gatk_CombineGVCFs':GATK.CombineGVCFs,
+            'stapler_gatk_GenomicsDBImport':GATK.GenomicsDBImport,
             'stapler_gatk_GenotypeGVCFs':GATK.GenotypeGVCFs,
             'stapler_gatk_HaplotypeCaller':GATK.HaplotypeCaller,
             'stapler_gatk_IndexFeatureFile':GATK.IndexFeatureFile,
@@ -69,14 +73,34 @@ commands = {'CUSTOM':Custom.Custom,
             'stapler_Picard_MarkDuplicates':Picard.Picard_MarkDuplicates,
             'stapler_Picard_SamFormatConverter':Picard.Picard_SamFormatConverter,
             'stapler_Picard_SortSam':Picard.Picard_SortSam,
+            'stapler_pigz':unix.pigz,
             'stapler_psmc':psmc.psmc,
             'stapler_psmc_plot':psmc.psmc_plot,
             'stapler_psmc2history':psmc.psmc2history,
+            'stapler_samtools_fixmate':samtools.samtools_fixmate,
             'stapler_samtools_index':samtools.samtools_index,
+            'stapler_samtools_markdup':samtools.samtools_markdup,
             'stapler_samtools_rmdup':samtools.samtools_rmdup,
+            'stapler_samtools_sort':samtools.samtools_sort,
             'stapler_soap2':soap2.soap2,
             'stapler_tabix':tabix.tabix,
             'stapler_trimmomatic':trimmomatic.trimmomatic,
             'stapler_gzip':unix.gzip,
+            'stapler_zstd':unix.zstd,
             'stapler_vcf_sort':misc.vcf_sort,
             'stapler_vcftools':VCFtools.VCFtools}
+
+# Commands created automatically by STAPLER (e.g. gather commands of scattered
+# workflow steps). These can not be used in staplefiles, but they need to be
+# configured in config.txt.
+internal_commands = {'stapler_bcftools_concat':bcftools.bcftools_concat,
+                     'stapler_bowtie2_build':reference.bowtie2_build,
+                     'stapler_bwa_index':reference.bwa_index,
+                     'stapler_bwa_shm':BWA.bwa_shm,
+                     'stapler_gatk_CreateSequenceDictionary':reference.CreateSequenceDictionary,
+                     'stapler_gatk_GatherBamFiles':GATK.GatherBamFiles,
+                     'stapler_gatk_GatherBQSRReports':GATK.GatherBQSRReports,
+                     'stapler_gatk_GatherVcfs':GATK.GatherVcfs,
+                     'stapler_samtools_faidx':reference.samtools_faidx,
+                     'stapler_samtools_merge':samtools.samtools_merge,
+                     'stapler_soap2_builder':reference.soap2_builder}
@@ -1,11 +1,16 @@
 import os
+import pipes
 
 from GenericBase import GenericBase
 from STAPLERerror import STAPLERerror
 from STAPLERerror import VirtualIOError
+import read_groups
+import samtools
+import scatter
 import utils
 
-class bwa_mem(GenericBase):
+class bwa_mem(samtools.MarkdupPipeline, read_groups.ReadGroupAssigner,
+              scatter.ChunkScatterable, GenericBase):
     """Class for using BWA MEM algorithm.
 
     Parameters:
@@ -34,14 +39,29 @@ class bwa_mem(GenericBase):
 
     name = 'stapler_bwa_mem'
     input_types = {'.fastq', '.fq'}
+    compressed_input_types = input_types
+    native_compressions = {'.gz'}
     output_types = ['.sam']
     hidden_mandatory_args = ['--!fastq1', '--!reference_path', '--!out']
     user_mandatory_args = ['--!reference_path']
-    remove_user_args = ['--!read_format']
-    user_optional_args = ['--!read_format', '--!fastq2', '-t', '-k', '-w', '-d',
-                          '-r', '-c', '-A', '-B', '-O', '-E', '-L', '-U', '-R', '-v',
-                          '-M', '-T', '-P', '-p', '-C', '-H']
+    remove_user_args = ['--!read_format', '--!scatter', '--!markdup',
+                        '--!shared_index']
+    user_optional_args = ['--!read_format', '--!scatter', '--!markdup',
+                          '--!shared_index', '--!fastq2',
+                          '-t', '-k', '-w', '-d', '-r', '-c', '-A', '-B', '-O', '-E',
+                          '-L', '-U', '-R', '-v', '-M', '-T', '-P', '-p', '-C', '-H',
+                          '--!RGID', '--!RGSM', '--!RGLB', '--!RGPL', '--!RGPU',
+                          '--!RGCN', '--!RGDS', '--!RGDT', '--!RGPI']
     parallelizable = True
+    scatter_input_args = ['--!fastq1', '--!fastq2']
+    scatter_output_arg = '--!out'
+    scatter_thread_arg = '-t'
+    gather_class = samtools.samtools_merge
+    reference_indexes = {'--!reference_path': ['bwa']}
+    read_group_conflicting_args = ['-R']
+    read_group_arg = '-R'
+    markdup_output_arg = '--!out'
+    markdup_thread_arg = '-t'
     help_description = '''
 Both paired-end and single-end data can be used as input but not at the same
 time. Paired-end mode is used when --!read_format argument is present in the
@@ -55,6 +75,37 @@ samplename_R2, the --!read_format argument should look like this:
 
 --!reference_path argument is the path to index database file created by
 applying 'bwa index' to your reference fasta file. You must do this manually.
+
+The --!scatter <N> parameter splits the input reads into N chunks and aligns
+each chunk in a separate job. The chunk alignments are merged with samtools
+merge in the beginning of the next workflow part, so stapler_samtools_merge
+must be configured in config.txt.
+
+The read group of the output can be defined with the --!RGID, --!RGSM,
+--!RGLB, --!RGPL, --!RGPU, --!RGCN, --!RGDS, --!RGDT and --!RGPI parameters
+(passed to bwa as -R). They accept the same values as the corresponding
+parameters of stapler_Picard_AddOrReplaceReadGroups, including $VALUE_TABLE
+definitions, so a separate AddOrReplaceReadGroups step is not needed.
+
+The --!markdup parameter pipes the alignments through samtools fixmate, sort
+and markdup, producing a coordinate sorted, duplicate marked and indexed BAM
+file without writing the intermediate files. The optional value of
+--!markdup is the memory per sorting thread (samtools sort -m) and the thread
+count of -t is used for the samtools commands as well. The samtools commands
+are defined by stapler_samtools_fixmate, stapler_samtools_sort and
+stapler_samtools_markdup in config.txt. --!markdup can not be used together
+with --!scatter.
+
+The --!shared_index parameter loads the reference index into shared memory
+with bwa shm (stapler_bwa_shm in config.txt) before the alignment. The first
+command on each node loads the index while holding a lock file in /dev/shm,
+and the rest of the commands on the node use the same copy instead of
+loading one of their own, leaving the memory for more concurrent aligners.
+The size and modification time of the .bwt file are recorded when the index
+is loaded, and a rebuilt index is loaded again. The last aligner using the
+index on the node removes it with bwa shm -d. Note that bwa shm -d removes
+all indexes from shared memory; commands of other references started after
+it load their index again or read it from disk.
     '''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
@@ -104,7 +155,7 @@ applying 'bwa index' to your reference fasta file. You must do this manually.
         if read_format:
             paired_files = in_dir.file_pairs(pattern=self.parsed_in_cmd['--!read_format'],
                                              user=self.name,
-                                             file_formats=list(self.input_types),
+                                             file_formats=list(self.accepted_input_types()),
                                              exclusion_iterable=['pairless',
                                                                  'unmatched'])
             file_names = set()
@@ -134,7 +185,7 @@ applying 'bwa index' to your reference fasta file. You must do this manually.
             file_names = set()
             for fl in in_dir.files:
                 if self.name not in fl.users:
-                    if utils.splitext(fl.name)[-1] in self.input_types:
+                    if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                         IO_files['--!fastq1'] = os.path.join(in_dir.path, fl.name)
                         command_ids.append(utils.infer_path_id(IO_files['--!fastq1']))
                         in_dir.use_file(fl.name, self.name)
@@ -174,12 +225,15 @@ applying 'bwa index' to your reference fasta file. You must do this manually.
         final_cmd.append(self.out_cmd['--!fastq1'])
         if '--!fastq2' in self.out_cmd:
             final_cmd.append(self.out_cmd['--!fastq2'])
-        final_cmd.append('> ' + self.out_cmd['--!out'])
-        return [' '.join(final_cmd)]
+        final_cmd.append(self._output_redirection())
+        if '--!shared_index' not in self.parsed_in_cmd:
+            return [' '.join(final_cmd)]
+        return [shared_index_cmd(self.out_cmd['--!reference_path'],
+                                 ' '.join(final_cmd))]
 
 
 
-class bwa_bwasw(GenericBase):
+class bwa_bwasw(scatter.ChunkScatterable, GenericBase):
     """Class for using BWA MEM algorithm.
 
     Parameters:
@@ -208,14 +262,21 @@ class bwa_bwasw(GenericBase):
 
     name = 'stapler_bwa_bwasw'
     input_types = {'.fastq', '.fq'}
+    compressed_input_types = input_types
+    native_compressions = {'.gz'}
     output_types = ['.sam']
     hidden_mandatory_args = ['--!fastq1', '--!reference_path', '--!out']
     user_mandatory_args = ['--!reference_path']
-    remove_user_args = []
-    user_optional_args = ['--!read_format', '-a', '-b', '-q', '-r', '-w', '-m',
+    remove_user_args = ['--!scatter']
+    user_optional_args = ['--!read_format', '--!scatter', '-a', '-b', '-q', '-r', '-w', '-m',
                           '-t', '-H', '-C', '-M', '-S', '-I', '-T', '-c', '-z',
                           '-s', '-N', '-G']
     parallelizable = True
+    scatter_input_args = ['--!fastq1', '--!fastq2']
+    scatter_output_arg = '--!out'
+    scatter_thread_arg = '-t'
+    gather_class = samtools.samtools_merge
+    reference_indexes = {'--!reference_path': ['bwa']}
     help_description = '''
 Both paired-end and single-end data can be used as input but not at the same
 time. Paired-end mode is used when --!read_format argument is present in the
@@ -229,6 +290,11 @@ samplename_R2, the --!read_format argument should look like this:
 
 --!reference_path argument is the path to index database file created by
 applying 'bwa index' to your reference fasta file. You must do this manually.
+
+The --!scatter <N> parameter splits the input reads into N chunks and aligns
+each chunk in a separate job. The chunk alignments are merged with samtools
+merge in the beginning of the next workflow part, so stapler_samtools_merge
+must be configured in config.txt.
     '''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
@@ -278,7 +344,7 @@ applying 'bwa index' to your reference fasta file. You must do this manually.
         if read_format:
             paired_files = in_dir.file_pairs(pattern=self.parsed_in_cmd['--!read_format'],
                                              user=self.name,
-                                             file_formats=list(self.input_types),
+                                             file_formats=list(self.accepted_input_types()),
                                              exclusion_iterable=['pairless',
                                                                  'unmatched'])
             file_names = set()
@@ -308,7 +374,7 @@ applying 'bwa index' to your reference fasta file. You must do this manually.
             file_names = set()
             for fl in in_dir.files:
                 if self.name not in fl.users:
-                    if utils.splitext(fl.name)[-1] in self.input_types:
+                    if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                         IO_files['--!fastq1'] = os.path.join(in_dir.path, fl.name)
                         command_ids.append(utils.infer_path_id(IO_files['--!fastq']))
                         in_dir.use_file(fl.name, self.name)
@@ -349,4 +415,50 @@ applying 'bwa index' to your reference fasta file. You must do this manually.
         if '--!fastq2' in self.out_cmd:
             final_cmd.append(self.out_cmd['--!fastq2'])
         final_cmd.append('> ' + self.out_cmd['--!out'])
-        return [' '.join(final_cmd)]
\ No newline at end of file
+        return [' '.join(final_cmd)]
+
+
+class bwa_shm(GenericBase):
+    """Class for the bwa shm command.
+
+    bwa shm is not used in staplefiles directly. Its run command is configured
+    in config.txt for the --!shared_index parameter of bwa_mem.
+    """
+
+    name = 'stapler_bwa_shm'
+
+
+def shared_index_cmd(reference_path, command):
+    """Returns a command line running bwa with the index in shared memory.
+
+    The index is loaded into shared memory once per node with bwa shm, and
+    reloaded if the .bwt file has changed since it was loaded (bwa shm names
+    the shared copy by the file name of the index prefix only). bwa mem uses
+    the shared copy whenever the index prefix matches. The index is removed
+    from shared memory after the last command using it on the node (see
+    utils.shared_resource_command).
+
+    Parameters:
+    reference_path: Prefix of the bwa index files.
+    command: bwa command line using the index.
+
+    Returns:
+    Command line string.
+    """
+    shm_command = utils.parse_config(bwa_shm.name, 'cmd_name', 'execute')
+    shm_path = utils.shared_memory_path(reference_path)
+    stamp_path = pipes.quote(shm_path + '.stamp')
+    loaded_test = '{0} -l 2>/dev/null | cut -f1 | grep -qxF {1}'.format(
+        shm_command, pipes.quote(os.path.basename(reference_path)))
+    stage = ('stamp=$(stat -L -c %s.%Y {0}) && if [ "$(cat {1} 2>/dev/null)" != '
+             '"$stamp" ] || ! {2}; then if {2}; then {3} -d; fi && {3} {4} && '
+             'echo "$stamp" > {1}; fi'.format(pipes.quote(reference_path + '.bwt'),
+                                               stamp_path, loaded_test,
+                                               shm_command,
+                                               pipes.quote(reference_path)))
+    release = '{0} -d; rm -f {1}'.format(shm_command, stamp_path)
+    return utils.shared_resource_command(shm_path + '.users',
+                                         utils.locked_command(shm_path + '.lock',
+                                                              stage),
+                                         command,
+                                         release)
@@ -32,6 +32,8 @@ class Custom():
     parsed_cmd: Final output command as option:value dict.
     file_names: Names of output files.
     command_ids: File names of input file(s) with no file extensions.
+    stall_timeout: Minutes without output growth after which the command is
+    considered hung and killed (see --watchdog).
 
 
     Methods:
@@ -47,6 +49,7 @@ class Custom():
     remove_user_args = user_mandatory_args
     optional_args = []
     parallelizable = True
+    stall_timeout = 60
     help_description = '''
 Special command for using any tool, details hidden from user.
 '''
@@ -4,14 +4,18 @@ import directory
 from STAPLERerror import STAPLERerror
 from STAPLERerror import VirtualIOError
 from GenericBase import GenericBase
+import output_compression
 import utils
 
 
-class fastx_toolkit_generic_compressable(GenericBase):
+class fastx_toolkit_generic_compressable(output_compression.CompressedOutput,
+                                        GenericBase):
     """Generic class with method for parsing fastx toolkit IO parameters.
 
     Only single type of output file is expected (but can be
-    uncompressed or compressed if -z parameter is present).
+    uncompressed or compressed if -z parameter is present). Instead of the
+    single-threaded compression of the tools, compressed output is piped to
+    the output compressor.
 
     Attributes:
     name: Name of the function.
@@ -32,6 +36,9 @@ class fastx_toolkit_generic_compressable(GenericBase):
     _parse_id: Returns the bare input file name
     """
 
+    compress_output_arg = '-z'
+    compressed_output_path_arg = '-o'
+
     def _select_IO(self, out_cmd, in_dir, out_dir):
         """Infers the input and output file paths.
 
@@ -55,7 +62,7 @@ class fastx_toolkit_generic_compressable(GenericBase):
         file_names = set()
         for fl in in_dir.files:
             if self.name not in fl.users:
-                if utils.splitext(fl.name)[-1] in self.input_types:
+                if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                     IO_files['-i'] = os.path.join(in_dir.path, fl.name)
                     command_ids = [utils.infer_path_id(IO_files['-i'])]
                     in_dir.use_file(fl.name, self.name)
@@ -66,7 +73,8 @@ class fastx_toolkit_generic_compressable(GenericBase):
                     # be compressed
                     if '-z' in out_cmd:
                         output_name = utils.splitext(fl.name)[0] + \
-                                      self.output_types[0] + '.gz'
+                                      self.output_types[0] + \
+                                      output_compression.compressed_extension(self.output_types[0])
                     else:
                         output_name = utils.splitext(fl.name)[0] + \
                                       self.output_types[0]
@@ -81,7 +89,8 @@ class fastx_toolkit_generic_compressable(GenericBase):
         return out_cmd, command_ids
 
 
-class fastx_toolkit_generic_compressable_fastx(GenericBase):
+class fastx_toolkit_generic_compressable_fastx(output_compression.CompressedOutput,
+                                              GenericBase):
     """Generic class with method for parsing fastx toolkit IO parameters.
 
     Similar to fastx_toolkit_generic_compressable, but fasta or fastq output
@@ -105,6 +114,9 @@ class fastx_toolkit_generic_compressable_fastx(GenericBase):
     _parse_id: Returns the bare input file name
     """
 
+    compress_output_arg = '-z'
+    compressed_output_path_arg = '-o'
+
     def _select_IO(self, out_cmd, in_dir, out_dir):
         """Infers the input and output file paths.
 
@@ -128,20 +140,21 @@ class fastx_toolkit_generic_compressable_fastx(GenericBase):
         file_names = set()
         for fl in in_dir.files:
             if self.name not in fl.users:
-                if utils.splitext(fl.name)[-1] in self.input_types:
+                if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                     IO_files['-i'] = os.path.join(in_dir.path, fl.name)
                     command_ids = [utils.infer_path_id(IO_files['-i'])]
                     in_dir.use_file(fl.name, self.name)
 
                     # Output filename extension is the same as input filename
                     # extension
-                    output_file_extension = utils.splitext(IO_files['-i'])
+                    output_file_extension = utils.uncompressed_extension(IO_files['-i'])
 
                     # If -z parameter is present in the input, output file will
                     # be compressed
                     if '-z' in out_cmd:
                         output_name = utils.splitext(fl.name)[0] + \
-                                      output_file_extension + '.gz'
+                                      output_file_extension + \
+                                      output_compression.compressed_extension(output_file_extension)
                     else:
                         output_name = utils.splitext(fl.name)[0] + \
                                       output_file_extension
@@ -180,6 +193,7 @@ class fasta_formatter(GenericBase):
 
     name = 'stapler_fastx_toolkit_fasta_formatter'
     input_types = {'.fasta', '.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fasta', '.fastq', '.tab']
     hidden_mandatory_args = ['-i', '-o']
     user_optional_args = ['-w', '-t', '-e']
@@ -210,7 +224,7 @@ Tested with fastx-tookit v. 0.0.14
         file_names = set()
         for fl in in_dir.files:
             if self.name not in fl.users:
-                if utils.splitext(fl.name)[-1] in self.input_types:
+                if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                     IO_files['-i'] = os.path.join(in_dir.path, fl.name)
                     command_ids = [utils.infer_path_id(IO_files['-i'])]
                     in_dir.use_file(fl.name, self.name)
@@ -221,7 +235,7 @@ Tested with fastx-tookit v. 0.0.14
                     if '-t' in out_cmd:
                         output_file_extension = '.tab'
                     else:
-                        output_file_extension = utils.splitext(IO_files['-i'])
+                        output_file_extension = utils.uncompressed_extension(IO_files['-i'])
 
                     # If -z parameter is present in the input, output file will
                     # be compressed
@@ -266,6 +280,7 @@ class fasta_nucleotide_changer(fastx_toolkit_generic_compressable_fastx):
 
     name = 'stapler_fastx_toolkit_fasta_nucleotide_changer'
     input_types = {'.fasta', '.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fasta', '.fastq']
     hidden_mandatory_args = ['-i', '-o']
     user_optional_args = ['-r', '-d', '-z', '-v']
@@ -351,6 +366,7 @@ class fastq_quality_filter(fastx_toolkit_generic_compressable_fastx):
 
     name = 'stapler_fastx_toolkit_fastq_quality_filter'
     input_types = {'.fasta', '.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fasta', '.fastq']
     hidden_mandatory_args = ['-i', '-o', '-q', '-p']
     user_optional_args = ['-v', '-z']
@@ -383,6 +399,7 @@ class fastq_quality_trimmer(fastx_toolkit_generic_compressable_fastx):
 
     name = 'stapler_fastx_toolkit_fastq_quality_trimmer'
     input_types = {'.fasta', '.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fasta', '.fastq']
     hidden_mandatory_args = ['-i', '-o', '-t']
     user_optional_args = ['-l', '-v', '-Q']
@@ -420,6 +437,7 @@ class fastq_to_fasta(fastx_toolkit_generic_compressable):
 
     name = 'stapler_fastx_toolkit_fastq_to_fasta'
     input_types = {'.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fasta']
     hidden_mandatory_args = ['-i', '-o']
     user_mandatory_args = []
@@ -455,6 +473,7 @@ class fastx_artifacts_filter(fastx_toolkit_generic_compressable_fastx):
 
     name = 'stapler_fastx_toolkit_fastx_artifacts_filter'
     input_types = {'.fasta', '.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fasta', '.fastq']
     hidden_mandatory_args = ['-i', '-o']
     user_mandatory_args = []
@@ -488,6 +507,7 @@ class fastx_clipper(fastx_toolkit_generic_compressable_fastx):
 
     name = 'stapler_fastx_toolkit_fastx_clipper'
     input_types = {'.fasta', '.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fasta', '.fastq']
     hidden_mandatory_args = ['-i', '-o']
     user_optional_args = ['-a', '-l', '-d', '-c', '-C', '-k', '-n', '-v', '-z',
@@ -521,6 +541,7 @@ class fastx_collapser(fastx_toolkit_generic_compressable_fastx):
 
     name = 'stapler_fastx_toolkit_fastx_collapser'
     input_types = {'.fasta', '.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fasta', '.fastq']
     hidden_mandatory_args = ['-i', '-o']
     user_mandatory_args = []
@@ -578,6 +599,7 @@ class fastx_quality_stats(GenericBase):
 
     name = 'stapler_fastx_toolkit_fastx_quality_stats'
     input_types = {'.fasta', '.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fastx_quality_stats']
     hidden_mandatory_args = ['-i', '-o']
     help_description = '''
@@ -609,6 +631,7 @@ class fastx_renamer(fastx_toolkit_generic_compressable_fastx):
 
     name = 'stapler_fastx_toolkit_fastx_trimmer'
     input_types = {'.fasta', '.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fasta', '.fastq']
     hidden_mandatory_args = ['-i', '-o']
     user_mandatory_args = ['-n']
@@ -642,6 +665,7 @@ class fastx_reverse_complement(fastx_toolkit_generic_compressable_fastx):
 
     name = 'stapler_fastx_toolkit_fastx_reverse_complement'
     input_types = {'.fasta', '.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fasta', '.fastq']
     hidden_mandatory_args = ['-i', '-o']
     user_optional_args = ['-z']
@@ -674,6 +698,7 @@ class fastx_trimmer(fastx_toolkit_generic_compressable_fastx):
 
     name = 'stapler_fastx_toolkit_fastx_trimmer'
     input_types = {'.fasta', '.fastq'}
+    compressed_input_types = input_types
     output_types = ['.fasta', '.fastq']
     hidden_mandatory_args = ['-i', '-o']
     user_optional_args = ['-f', '-l', '-z']
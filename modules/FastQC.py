@@ -36,6 +36,10 @@ class fastqc(GenericBase):
     name = 'stapler_fastqc'
     #Accept all defined types:
     input_types = {'.bam', '.fastq'}
+    compressed_input_types = {'.fastq'}
+    native_compressions = {'.gz', '.bz2'}
+    # Output files are named by the input file name
+    input_substitution = False
     output_types = ['.unknown']
     hidden_mandatory_args = ['-!i', '-o']
     user_mandatory_args = []
@@ -73,7 +77,7 @@ Tested with FastQC v0.10.1.
         file_names = set()
         for fl in in_dir.files:
             if self.name not in fl.users:
-                if utils.splitext(fl.name)[-1] in self.input_types:
+                if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                     IO_files['-!i'] = os.path.join(in_dir.path, fl.name)
                     command_ids = [utils.infer_path_id(IO_files['-!i'])]
                     in_dir.use_file(fl.name, self.name)
@@ -1,10 +1,59 @@
+import glob
 import os
 
 from GenericBase import GenericBase
 from STAPLERerror import STAPLERerror
 from STAPLERerror import VirtualIOError
+import bam_output
+import scatter
 import utils
 
+
+# Listings of --!known-sites directories read during this run as
+# directory:{file basename:file name}
+_known_sites_listings = {}
+
+
+def known_sites_files(directory):
+    """Returns the files of a --!known-sites directory by their basenames.
+
+    Each directory is listed only once, instead of once for every input file
+    of the BaseRecalibrator step.
+
+    Parameters:
+    directory: Path to the directory.
+
+    Returns:
+    Dict of file basename:file name.
+    """
+    if directory not in _known_sites_listings:
+        files = {}
+        for ks_file in sorted(os.listdir(directory)):
+            files.setdefault(utils.splitext(ks_file)[0], ks_file)
+        _known_sites_listings[directory] = files
+    return _known_sites_listings[directory]
+
+
+# GenomicsDBImport uses the --batch-size value when the user has not defined
+# it and there are more input files than this
+GENOMICSDB_DEFAULT_BATCH_SIZE = 50
+
+
+def genomicsdb_intervals(workspace_path):
+    """Returns the interval files of a workspace created by GenomicsDBImport.
+
+    Each interval is imported into a workspace of its own, named after the
+    interval file (e.g. interval_0001.bed and interval_0001/).
+
+    Parameters:
+    workspace_path: Path to the .genomicsdb directory.
+
+    Returns:
+    Sorted list of paths to the interval .bed files.
+    """
+    return sorted(glob.glob(os.path.join(workspace_path, 'interval_*.bed')))
+
+
 class GATK_superclass(GenericBase):
     """A superclass for GATK tools.
 
@@ -13,6 +62,11 @@ class GATK_superclass(GenericBase):
     argument_name : value
     """
 
+    reference_indexes = {'-R': ['faidx', 'dict']}
+    # GATK logs its progress to stderr every few seconds, so a silent GATK
+    # command is hung (e.g. waiting for a file lock)
+    stall_timeout = 20
+
     def _cmd_parse(self, cmd):
         """Turns a command line into argument-value pairs.
 
@@ -136,7 +190,54 @@ class GATK_superclass(GenericBase):
         return [' '.join(final_cmd)]
 
 
-class ApplyBQSR(GATK_superclass):
+class GatherBamFiles(scatter.Gather):
+    """Class for gathering scattered BAM files with GATK GatherBamFiles."""
+
+    name = 'stapler_gatk_GatherBamFiles'
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+
+        Raises:
+        STAPLERerror: The output is not a BAM file.
+        """
+        if utils.splitext(self.output_path)[1] != '.bam':
+            raise STAPLERerror('--!scatter parameter of {0} can be used only '
+                               'with .bam files, as GatherBamFiles can not '
+                               'gather other formats. Output file:\n{1}'
+                               .format(self.scattered_command.name,
+                                       self.output_path))
+        final_cmd = [self.run_command]
+        for shard_path in self.shard_paths:
+            final_cmd.append('-I ' + shard_path)
+        final_cmd.append('-O ' + self.output_path)
+        final_cmd.append('--CREATE_INDEX true')
+        return [' '.join(final_cmd) + ' && ' + self.remove_shards_cmd()]
+
+
+class GatherBQSRReports(scatter.Gather):
+    """Class for gathering scattered recalibration tables with GATK
+    GatherBQSRReports."""
+
+    name = 'stapler_gatk_GatherBQSRReports'
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        final_cmd = [self.run_command]
+        for shard_path in self.shard_paths:
+            final_cmd.append('-I ' + shard_path)
+        final_cmd.append('-O ' + self.output_path)
+        return [' '.join(final_cmd) + ' && ' + self.remove_shards_cmd()]
+
+
+class ApplyBQSR(bam_output.BAMOutputPolicy, scatter.Scatterable, GATK_superclass):
     """Class for using GATK ApplyBQSR tool.
 
     Parameters:
@@ -170,9 +271,11 @@ class ApplyBQSR(GATK_superclass):
     output_types = ['.bam', '.sam', '.cram']
     require_output_dir = True
     hidden_mandatory_args = ['-I', '-O', '--bqsr-recal-file']
+    hidden_optional_args = ['--java-options']
     user_mandatory_args = ['-R']
-    remove_user_args = []
-    user_optional_args = ['--add-output-sam-program-record',
+    remove_user_args = ['--!scatter']
+    user_optional_args = ['--!scatter', '--!bam_output',
+                          '--add-output-sam-program-record',
                           '--add-output-vcf-command-line', '--arguments_file',
                           '--cloud-index-prefetch-buffer',
                           '--cloud-prefetch-buffer', '--create-output-bam-index',
@@ -202,6 +305,16 @@ class ApplyBQSR(GATK_superclass):
                           '-jdk-inflater', '-L', '-LE', '-OBI', '-OBM', '-OQ',
                           '-OVI', '-OVM', '-R', '-RF', '-VS', '-XL']
     parallelizable = True
+    scatter_reference_arg = '-R'
+    scatter_output_arg = '-O'
+    scatter_region_args = ['-L', '--intervals', '-XL', '--exclude-intervals']
+    scatter_interval_arg = '-L'
+    scatter_split_contigs = False
+    gather_class = GatherBamFiles
+    bam_output_arg = '-O'
+    bam_reference_arg = '-R'
+    bam_compression_arg = '--java-options'
+    bam_compression_value = '-Dsamjdk.compression_level={0}'
     help_description = '''
 Tested with GATK 4.0.
 
@@ -209,8 +322,32 @@ Notice, that --bqsr-recal-file parameter is automatically inferred, and should
 not be included in the command line. The value for this parameter is a .table
 file, which is expected to be found in the input directory. This can be
 done by using the GATK BaseRecalibrator command.
+
+The --!scatter <N> parameter splits the reference genome into at most N
+intervals of whole contigs and runs a separate job for each interval (using
+the -L parameter). Contigs are not split, so that no read is written by two
+jobs, and the unmapped reads are written by the last job. The interval
+outputs are combined with GatherBamFiles in the beginning of the next
+workflow part, so stapler_gatk_GatherBamFiles must be configured in
+config.txt. Only .bam files can be scattered. The reference genome must be
+indexed with samtools faidx or have a sequence dictionary.
+
+The --!bam_output parameter selects how the output file is written:
+intermediate (BAM with compression level 1), uncompressed (BAM with
+compression level 0) or cram (CRAM compressed against the -R reference).
+GATK has no compression level argument, so the level is given to the Java
+virtual machine with --java-options.
 '''
 
+    def _scatter_units(self, scatter_dir, shard_count):
+        """Returns the interval files, the last shard also processes the
+        unmapped reads."""
+        units = [[interval_path] for interval_path in
+                 scatter.Scatterable._scatter_units(self, scatter_dir,
+                                                    shard_count)]
+        units[-1].append('unmapped')
+        return units
+
     def _select_IO(self, out_cmd, in_dir, out_dir):
         """Infers the input and output file paths.
 
@@ -273,7 +410,7 @@ done by using the GATK BaseRecalibrator command.
         return out_cmd, command_ids
 
 
-class BaseRecalibrator(GATK_superclass):
+class BaseRecalibrator(scatter.Scatterable, GATK_superclass):
     """Class for using GATK BaseRecalibrator tool.
 
     Parameters:
@@ -308,8 +445,9 @@ class BaseRecalibrator(GATK_superclass):
     require_output_dir = False
     hidden_mandatory_args = ['-I', '-O']
     user_mandatory_args = ['-R', '--!known-sites']
-    remove_user_args = ['--!known-sites']
-    user_optional_args = ['--add-output-sam-program-record',
+    remove_user_args = ['--!known-sites', '--!scatter', '--!scatter_exclude']
+    user_optional_args = ['--!scatter', '--!scatter_exclude',
+                          '--add-output-sam-program-record',
                           '--add-output-vcf-command-line', '--arguments_file',
                           '--binary-tag-name', '--bqsr-baq-gap-open-penalty',
                           '--cloud-index-prefetch-buffer',
@@ -345,6 +483,11 @@ class BaseRecalibrator(GATK_superclass):
                           '-max-cycle', '-mcs', '-OBI', '-OBM', '-OQ', '-OVI',
                           '-OVM', '-RF', '-VS', '-XL']
     parallelizable = True
+    scatter_reference_arg = '-R'
+    scatter_output_arg = '-O'
+    scatter_region_args = ['-L', '--intervals', '-XL', '--exclude-intervals']
+    scatter_interval_arg = '-L'
+    gather_class = GatherBQSRReports
     help_description = '''
 Tested with GATK 4.0.
 
@@ -361,8 +504,15 @@ for a file that has a basename corresponding to the input .bam file
 basename. E.g. for input file sample_1_R1.bam the directory is expected to
 contain a file with basename sample_1_R1 (such as sample_1_R1.vcf,
 sample_1_R1.bcf, sample_1_R1.bed etc.).
-'''
 
+The --!scatter <N> parameter splits the reference genome into N intervals of
+roughly equal size and runs a separate job for each interval (using the -L
+parameter). The interval tables are combined with GatherBQSRReports in the
+beginning of the next workflow part, so stapler_gatk_GatherBQSRReports must
+be configured in config.txt. The reference genome must be indexed with
+samtools faidx or have a sequence dictionary. A .bed file of regions to skip
+(e.g. runs of N bases) can be given with the --!scatter_exclude parameter.
+'''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
         """Infers the input and output file paths.
@@ -402,19 +552,15 @@ sample_1_R1.bcf, sample_1_R1.bed etc.).
                                 IO_files['--known-sites'] = [p]
                         elif os.path.isdir(p):
                             input_base_name = utils.splitext(fl.name)[0]
-                            ks_file_found = False
-                            for ks_file in os.listdir(p):
-                                ks_file_basename = utils.splitext(ks_file)[0]
-                                absolute_ks_file_name = os.path.join(p, ks_file)
-                                if input_base_name == ks_file_basename:
-                                    try:
-                                        IO_files['--known-sites'].append(absolute_ks_file_name)
-                                    except KeyError:
-                                        IO_files['--known-sites'] = [absolute_ks_file_name]
-                                    ks_file_found = True
-                                    break
-                            if not ks_file_found:
-                                basenames = [os.path.splitext(fn)[0] for fn in os.listdir(p)]
+                            ks_files = known_sites_files(p)
+                            if input_base_name in ks_files:
+                                absolute_ks_file_name = os.path.join(p, ks_files[input_base_name])
+                                try:
+                                    IO_files['--known-sites'].append(absolute_ks_file_name)
+                                except KeyError:
+                                    IO_files['--known-sites'] = [absolute_ks_file_name]
+                            else:
+                                basenames = sorted(ks_files.keys())
                                 raise STAPLERerror('{0} parameter '
                                                    '--!known-sites specified '
                                                    'a path to directory, '
@@ -449,7 +595,267 @@ sample_1_R1.bcf, sample_1_R1.bed etc.).
         return out_cmd, command_ids
 
 
-class GenotypeGVCFs(GATK_superclass):
+class GatherVcfs(scatter.Gather):
+    """Class for gathering scattered VCF files with GATK GatherVcfs."""
+
+    name = 'stapler_gatk_GatherVcfs'
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        final_cmd = [self.run_command]
+        for shard_path in self.shard_paths:
+            final_cmd.append('-I ' + shard_path)
+        final_cmd.append('-O ' + self.output_path)
+        return [' '.join(final_cmd) + ' && ' + self.remove_shards_cmd()]
+
+
+class CombineGVCFs(scatter.Scatterable, GATK_superclass):
+    """Class for using GATK CombineGVCFs tool.
+
+    Parameters:
+    in_cmd: String containing a command line
+    in_dir: Directory object containing input files
+    out_dir: Directory object containing output files
+    NOTICE! Keep the directory objects up to date about file edits!
+
+    Attributes:
+    name: Name of the function.
+    input_type: Input types accepted by this application.
+    output_types: List of output types produced by the application.
+    require_output_dir: Bool for whether or not a new output directory is
+    required as some tools output to input directory.
+    mandatory_args: Args the user be provided in in_cmd when initializing.
+    user_mandatory_args: Args the user must provide.
+    remove_user_args: Args that will be removed from the final command.
+    optional_args: Args that may be part of the command line.
+    in_cmd: Command entered by user.
+    parsed_cmd: Final output command as option:value dict.
+    file_names: Names of output files.
+    command_ids: File names of input file(s) with no file extensions.
+
+
+    Methods:
+    get_cmd: Method for getting the final cmd line string for output.
+    """
+
+    name = 'stapler_gatk_CombineGVCFs'
+    input_types = set(['.gvcf'])
+    output_types = ['.gvcf']
+    require_output_dir = True
+    hidden_mandatory_args = ['-V', '-O']
+    user_mandatory_args = ['-R']
+    remove_user_args = ['--!scatter', '--!scatter_exclude']
+    user_optional_args = ['--!scatter', '--!scatter_exclude', '--annotation',
+                          '-A', '--annotation-group', '-G',
+                          '--annotations-to-exclude', '-AX',
+                          '--break-bands-at-multiples-of', '-breakBandsAtMultiplesOf',
+                          '--convert-to-base-pair-resolution',
+                          '--create-output-variant-index', '--dbsnp', '-D',
+                          '--exclude-intervals', '-XL', '--interval-padding',
+                          '-ip', '--intervals', '-L', '--QUIET', '--TMP_DIR',
+                          '--tmp-dir', '--verbosity']
+    parallelizable = True
+    scatter_reference_arg = '-R'
+    scatter_output_arg = '-O'
+    scatter_region_args = ['-L', '--intervals', '-XL', '--exclude-intervals']
+    scatter_interval_arg = '-L'
+    gather_class = GatherVcfs
+    help_description = '''
+Tested with GATK 4.0.
+
+Combines all .gvcf files of the input directory into a single multi-sample
+.gvcf file, which can be genotyped with stapler_gatk_GenotypeGVCFs. For large
+cohorts stapler_gatk_GenomicsDBImport scales better.
+
+The --!scatter <N> parameter splits the reference genome into N intervals of
+roughly equal size and runs a separate job for each interval (using the -L
+parameter). The interval outputs are combined with GatherVcfs in the
+beginning of the next workflow part, so stapler_gatk_GatherVcfs must be
+configured in config.txt. The reference genome must be indexed with samtools
+faidx or have a sequence dictionary. A .bed file of regions to skip (e.g.
+runs of N bases) can be given with the --!scatter_exclude parameter.
+'''
+
+    def _select_IO(self, out_cmd, in_dir, out_dir):
+        """Infers the input and output file paths.
+
+        This method must keep the directory objects up to date of the file
+        edits!
+
+        Parameters:
+        in_cmd: A dict containing the command line.
+        in_dir: Input directory (instance of filetypes.Directory).
+        out_dir: Output directory (instance of filetypes.Directory).
+
+        Returns:
+        out_cmd: Dict containing the output commands
+        command_identifier: Input file name based identifier for the current command
+
+        Raises:
+        VirtualIOError: No valid input file can be found.
+        """
+
+        IO_files = {'-V':[]}
+        command_ids = []
+        file_names = set()
+        for fl in in_dir.files:
+            if self.name not in fl.users:
+                if utils.splitext(fl.name)[-1] in self.input_types:
+                    IO_files['-V'].append(os.path.join(in_dir.path, fl.name))
+                    command_ids.append(utils.infer_path_id(fl.name))
+                    in_dir.use_file(fl.name, self.name)
+        if not IO_files['-V']:
+            raise VirtualIOError('No more unused input files')
+
+        # Make sure that input files are sorted so that first input file is the same on successive runs
+        output_name = os.path.split(sorted(IO_files['-V'])[0])[1]
+        output_name = utils.splitext(output_name)[0] + self.output_types[0]
+        output_path = os.path.join(out_dir.path, output_name)
+        IO_files['-O'] = [output_path]
+        file_names.add(output_name)
+        out_dir.add_file(output_name)
+        out_cmd.update(IO_files)
+        return out_cmd, command_ids
+
+
+class GenomicsDBImport(scatter.Scatterable, GATK_superclass):
+    """Class for using GATK GenomicsDBImport tool.
+
+    Parameters:
+    in_cmd: String containing a command line
+    in_dir: Directory object containing input files
+    out_dir: Directory object containing output files
+    NOTICE! Keep the directory objects up to date about file edits!
+
+    Attributes:
+    name: Name of the function.
+    input_type: Input types accepted by this application.
+    output_types: List of output types produced by the application.
+    require_output_dir: Bool for whether or not a new output directory is
+    required as some tools output to input directory.
+    mandatory_args: Args the user be provided in in_cmd when initializing.
+    user_mandatory_args: Args the user must provide.
+    remove_user_args: Args that will be removed from the final command.
+    optional_args: Args that may be part of the command line.
+    in_cmd: Command entered by user.
+    parsed_cmd: Final output command as option:value dict.
+    file_names: Names of output files.
+    command_ids: File names of input file(s) with no file extensions.
+
+
+    Methods:
+    get_cmd: Method for getting the final cmd line string for output.
+    """
+
+    name = 'stapler_gatk_GenomicsDBImport'
+    input_types = set(['.gvcf'])
+    output_types = ['.genomicsdb']
+    require_output_dir = True
+    hidden_mandatory_args = ['-V', '--genomicsdb-workspace-path']
+    user_mandatory_args = ['-R']
+    remove_user_args = ['--!scatter', '--!scatter_exclude']
+    user_optional_args = ['--!scatter', '--!scatter_exclude', '--batch-size',
+                          '--consolidate', '--genomicsdb-segment-size',
+                          '--genomicsdb-vcf-buffer-size',
+                          '--interval-padding', '-ip',
+                          '--max-num-intervals-to-import-in-parallel',
+                          '--QUIET', '--reader-threads', '--TMP_DIR',
+                          '--tmp-dir', '--validate-sample-name-map',
+                          '--verbosity']
+    parallelizable = True
+    scatter_reference_arg = '-R'
+    scatter_region_args = ['-L', '--intervals', '-XL', '--exclude-intervals']
+    scatter_interval_arg = '-L'
+    help_description = '''
+Tested with GATK 4.0.
+
+Imports all .gvcf files of the input directory into a GenomicsDB workspace,
+which can be genotyped with stapler_gatk_GenotypeGVCFs. The workspace is a
+directory with the .genomicsdb extension.
+
+The --!scatter <N> parameter splits the reference genome into N intervals of
+roughly equal size and imports each interval in a separate job into a
+workspace of its own within the .genomicsdb directory. Without --!scatter the
+whole genome is imported by a single job. stapler_gatk_GenotypeGVCFs
+automatically runs a separate job for each interval of the workspace. The
+reference genome must be indexed with samtools faidx or have a sequence
+dictionary. A .bed file of regions to skip (e.g. runs of N bases) can be
+given with the --!scatter_exclude parameter.
+
+Samples are read in batches of {0} if there are more input files than that
+and --batch-size is not defined. The number of threads opening the input
+files can be set with --reader-threads.
+'''.format(GENOMICSDB_DEFAULT_BATCH_SIZE)
+
+    def _default_scatter_count(self):
+        """Imports the whole genome as a single interval by default."""
+        return 1
+
+    def _scatter_units(self, scatter_dir, shard_count):
+        """Returns the interval files, which are written into the workspace
+        directory instead of the scatter directory."""
+        return scatter.Scatterable._scatter_units(
+            self, self.out_cmd['--genomicsdb-workspace-path'][0], shard_count)
+
+    def _shard_command_lines(self, shard, interval_path):
+        """Returns the command lines importing a single interval."""
+        interval_workspace = utils.splitext(interval_path)[0]
+        shard.out_cmd['-L'] = [interval_path]
+        shard.out_cmd['--genomicsdb-workspace-path'] = [interval_workspace]
+        # GenomicsDBImport refuses to write into an existing workspace
+        return ['rm -rf ' + interval_workspace] + shard.get_cmd()
+
+
+    def _select_IO(self, out_cmd, in_dir, out_dir):
+        """Infers the input and output file paths.
+
+        This method must keep the directory objects up to date of the file
+        edits!
+
+        Parameters:
+        in_cmd: A dict containing the command line.
+        in_dir: Input directory (instance of filetypes.Directory).
+        out_dir: Output directory (instance of filetypes.Directory).
+
+        Returns:
+        out_cmd: Dict containing the output commands
+        command_identifier: Input file name based identifier for the current command
+
+        Raises:
+        VirtualIOError: No valid input file can be found.
+        """
+
+        IO_files = {'-V':[]}
+        command_ids = []
+        file_names = set()
+        for fl in in_dir.files:
+            if self.name not in fl.users:
+                if utils.splitext(fl.name)[-1] in self.input_types:
+                    IO_files['-V'].append(os.path.join(in_dir.path, fl.name))
+                    command_ids.append(utils.infer_path_id(fl.name))
+                    in_dir.use_file(fl.name, self.name)
+        if not IO_files['-V']:
+            raise VirtualIOError('No more unused input files')
+        if len(IO_files['-V']) > GENOMICSDB_DEFAULT_BATCH_SIZE and \
+                '--batch-size' not in out_cmd:
+            IO_files['--batch-size'] = [str(GENOMICSDB_DEFAULT_BATCH_SIZE)]
+
+        # Make sure that input files are sorted so that first input file is the same on successive runs
+        output_name = os.path.split(sorted(IO_files['-V'])[0])[1]
+        output_name = utils.splitext(output_name)[0] + self.output_types[0]
+        output_path = os.path.join(out_dir.path, output_name)
+        IO_files['--genomicsdb-workspace-path'] = [output_path]
+        file_names.add(output_name)
+        out_dir.add_file(output_name)
+        out_cmd.update(IO_files)
+        return out_cmd, command_ids
+
+
+class GenotypeGVCFs(scatter.Scatterable, GATK_superclass):
     """Class for using GATK GenotypeGVCFs tool.
 
     Parameters:
@@ -479,13 +885,14 @@ class GenotypeGVCFs(GATK_superclass):
     """
 
     name = 'stapler_gatk_GenotypeGVCFs'
-    input_types = set(['.gvcf'])
+    input_types = set(['.gvcf', '.genomicsdb'])
     output_types = ['.vcf']
     require_output_dir = True
     hidden_mandatory_args = ['-V', '-O']
     user_mandatory_args = ['-R']
-    remove_user_args = []
-    user_optional_args = ['--add-output-sam-program-record',
+    remove_user_args = ['--!scatter', '--!scatter_exclude']
+    user_optional_args = ['--!scatter', '--!scatter_exclude',
+                          '--add-output-sam-program-record',
                           '--add-output-vcf-command-line',
                           '--annotate-with-num-discovered-alleles',
                           '--annotation', '--annotation-group',
@@ -521,10 +928,68 @@ class GenotypeGVCFs(GATK_superclass):
                           '-new-qual', '-OBI', '-OBM', '-OVI', '-OVM', '-ploidy',
                           '-RF', '-stand-call-conf', '-VS', '-XL']
     parallelizable = True
+    scatter_reference_arg = '-R'
+    scatter_output_arg = '-O'
+    scatter_region_args = ['-L', '--intervals', '-XL', '--exclude-intervals']
+    scatter_interval_arg = '-L'
+    gather_class = GatherVcfs
     help_description = '''
 Tested with GATK 4.0.
+
+The input can be a .gvcf file (e.g. produced by stapler_gatk_CombineGVCFs) or
+a GenomicsDB workspace produced by stapler_gatk_GenomicsDBImport.
+
+The --!scatter <N> parameter splits the reference genome into N intervals of
+roughly equal size and runs a separate job for each interval (using the -L
+parameter). Workspaces imported in several intervals are always genotyped by
+a separate job for each interval, and --!scatter can not be used with them.
+The interval outputs are combined with GatherVcfs in the beginning of the next
+workflow part, so stapler_gatk_GatherVcfs must be configured in config.txt.
+The reference genome must be indexed with samtools faidx or have a sequence
+dictionary. A .bed file of regions to skip (e.g. runs of N bases) can be given
+with the --!scatter_exclude parameter.
 '''
 
+    def _workspace_intervals(self):
+        """Returns the interval files of a GenomicsDB workspace input imported
+        in several intervals, otherwise None."""
+        input_path = self.out_cmd['-V'][0]
+        if not input_path.startswith('gendb://'):
+            return None
+        return genomicsdb_intervals(input_path[len('gendb://'):]) or None
+
+    def _default_scatter_count(self):
+        """Genotypes each interval of a workspace input separately."""
+        intervals = self._workspace_intervals()
+        if intervals is None:
+            return None
+        return len(intervals)
+
+    def _scatter_units(self, scatter_dir, shard_count):
+        """Returns the interval files of the shards.
+
+        Raises:
+        STAPLERerror: --!scatter is used with a workspace input.
+        """
+        intervals = self._workspace_intervals()
+        if intervals is None:
+            return scatter.Scatterable._scatter_units(self, scatter_dir,
+                                                      shard_count)
+        if '--!scatter' in self.parsed_in_cmd:
+            raise STAPLERerror('--!scatter parameter of {0} can not be used '
+                               'with GenomicsDB workspace input, as the '
+                               'workspace intervals define the jobs:\n{1}'
+                               .format(self.name, self.out_cmd['-V'][0]))
+        return intervals
+
+    def _set_scatter_region(self, out_cmd, interval_path):
+        """Adds the interval file (and its workspace) to the command line."""
+        scatter.Scatterable._set_scatter_region(self, out_cmd, interval_path)
+        # Variants spanning interval boundaries are reported only once
+        out_cmd['--only-output-calls-starting-in-intervals'] = ['']
+        if out_cmd['-V'][0].startswith('gendb://'):
+            out_cmd['-V'] = ['gendb://' + utils.splitext(interval_path)[0]]
+
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
         """Infers the input and output file paths.
@@ -553,6 +1018,16 @@ Tested with GATK 4.0.
                     IO_files['-V'] = [os.path.join(in_dir.path, fl.name)]
                     command_ids = [utils.infer_path_id(IO_files['-V'][0])]
                     in_dir.use_file(fl.name, self.name)
+                    if utils.splitext(fl.name)[-1] == '.genomicsdb':
+                        IO_files['-V'] = ['gendb://' + IO_files['-V'][0]]
+                        # A workspace imported in a single interval is
+                        # genotyped without scattering
+                        intervals = genomicsdb_intervals(os.path.join(in_dir.path,
+                                                                      fl.name))
+                        if len(intervals) == 1:
+                            IO_files['-V'] = ['gendb://' +
+                                              utils.splitext(intervals[0])[0]]
+                            IO_files['-L'] = intervals
                     output_name = utils.splitext(fl.name)[0] + \
                                   self.output_types[0]
                     output_path = os.path.join(out_dir.path, output_name)
@@ -566,7 +1041,7 @@ Tested with GATK 4.0.
         return out_cmd, command_ids
 
 
-class HaplotypeCaller(GATK_superclass):
+class HaplotypeCaller(scatter.Scatterable, GATK_superclass):
     """Class for using GATK HaplotypeCaller tool.
 
     Parameters:
@@ -601,8 +1076,10 @@ class HaplotypeCaller(GATK_superclass):
     require_output_dir = True
     hidden_mandatory_args = ['-I', '-O']
     user_mandatory_args = ['-R', '--!input_files_per_command']
-    remove_user_args = ['--!input_files_per_command']
-    user_optional_args = ['--activity-profile-out', '--alleles', 'null',
+    remove_user_args = ['--!input_files_per_command', '--!scatter',
+                        '--!scatter_exclude']
+    user_optional_args = ['--!scatter', '--!scatter_exclude',
+                          '--activity-profile-out', '--alleles', 'null',
                           '--annotate-with-num-discovered-alleles',
                           '--annotation', '-A', '--annotation-group', '-G',
                           '--annotations-to-exclude', '-AX', '--arguments_file',
@@ -675,6 +1152,11 @@ class HaplotypeCaller(GATK_superclass):
                           '--use-filtered-reads-for-annotations',
                           '--recover-dangling-heads']
     parallelizable = True
+    scatter_reference_arg = '-R'
+    scatter_output_arg = '-O'
+    scatter_region_args = ['-L', '--intervals', '-XL', '--exclude-intervals']
+    scatter_interval_arg = '-L'
+    gather_class = GatherVcfs
     help_description = '''
 Tested with GATK 4.0.
 
@@ -683,8 +1165,15 @@ case of 'all' all bam files in the input directory are included into single
 command line, producing a single output file. In the case of 'single' each
 bam file will be processed separately, producing an output file for every
 input file
-    '''
 
+The --!scatter <N> parameter splits the reference genome into N intervals of
+roughly equal size and runs a separate job for each interval (using the -L
+parameter). The interval outputs are combined with GatherVcfs in the
+beginning of the next workflow part, so stapler_gatk_GatherVcfs must be
+configured in config.txt. The reference genome must be indexed with samtools
+faidx or have a sequence dictionary. A .bed file of regions to skip (e.g.
+runs of N bases) can be given with the --!scatter_exclude parameter.
+    '''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
         """Infers the input and output file paths.
@@ -2,6 +2,7 @@ import copy
 import itertools
 import logging
 import os
+import re
 import subprocess
 
 from STAPLERerror import STAPLERerror
@@ -33,6 +34,16 @@ class GenericBase():
     parsed_cmd: Final output command as option:value dict.
     file_names: Names of output files.
     command_ids: File names of input file(s) with no file extensions.
+    reference_indexes: Dict of argument:list of index types (see
+    reference.INDEX_TYPES) required for the reference file of the argument.
+    compressed_input_types: Input types that are also accepted compressed
+    (with any extension of utils.DECOMPRESSION_COMMANDS).
+    native_compressions: Compression extensions the tool reads natively.
+    input_substitution: Whether compressed inputs the tool can not read
+    natively may be decompressed on the fly with process substitution. Must
+    be False for tools that seek the input or name outputs by the input.
+    stall_timeout: Minutes without output growth after which a command of
+    the tool is considered hung and killed (see --watchdog).
 
 
     Methods:
@@ -49,6 +60,11 @@ class GenericBase():
     user_optional_args = []
     remove_user_args = user_mandatory_args
     parallelizable = True
+    reference_indexes = {}
+    compressed_input_types = set([])
+    native_compressions = set([])
+    input_substitution = True
+    stall_timeout = 60
     help_description = '''
 This tool cannot be used by the end user.
 '''
@@ -75,7 +91,7 @@ This tool cannot be used by the end user.
         self.run_command = self.run_command_config()
         self.load_module = self.load_module_config()
         self.unload_module = self.unload_module_config()
-        self.command_lines = self.get_cmd()
+        self.command_lines = self._stream_compressed_inputs(self.get_cmd())
         logging.info('Finished initializing {0} with user command:\n{1}'
                      .format(self.name, in_cmd))
 
@@ -139,6 +155,65 @@ This tool cannot be used by the end user.
                 raise STAPLERerror('{0} command needs the following argument to have a value: {1}'
                                    .format(self.name, m_cmd))
 
+    @classmethod
+    def accepted_input_types(cls):
+        """Returns the input types including the accepted compressed types.
+
+        Compressed variants of compressed_input_types are accepted for all
+        compression extensions if the tool input may be substituted, otherwise
+        only for the natively read ones.
+
+        Returns:
+        Set of file extensions.
+        """
+        if cls.input_substitution:
+            compressions = utils.DECOMPRESSION_COMMANDS.keys()
+        else:
+            compressions = cls.native_compressions
+        accepted = set(cls.input_types)
+        for input_type in cls.compressed_input_types:
+            for compression in compressions:
+                accepted.add(input_type + compression)
+        return accepted
+
+    def _stream_compressed_inputs(self, command_lines):
+        """Replaces the compressed input files the tool can not read natively
+        with process substitutions decompressing the files on the fly.
+
+        Parameters:
+        command_lines: List of command lines produced by get_cmd.
+
+        Returns:
+        List of command lines.
+        """
+        if not self.compressed_input_types:
+            return command_lines
+        for value in self.out_cmd.itervalues():
+            if not isinstance(value, list):
+                value = [value]
+            for path in value:
+                if not isinstance(path, basestring):
+                    continue
+                # Compressed output files are not inputs
+                if os.path.dirname(path) == self.out_dir.path:
+                    continue
+                compression = utils.compression_extension(path)
+                if not compression or compression in self.native_compressions:
+                    continue
+                if utils.splitext(path)[1] in self.input_types:
+                    continue
+                if utils.uncompressed_extension(path) not in \
+                        self.compressed_input_types:
+                    continue
+                stream = utils.decompression_stream(path)
+                # Replace only whole arguments, not other paths containing
+                # the input path
+                path_pattern = re.compile(r'(?<![^\s=]){0}(?![^\s;|&)])'
+                                          .format(re.escape(path)))
+                command_lines = [path_pattern.sub(lambda match: stream, ln)
+                                 for ln in command_lines]
+        return command_lines
+
     def _select_IO(self, out_cmd, in_dir, out_dir):
         """Infers the input and output file paths.
 
@@ -162,7 +237,7 @@ This tool cannot be used by the end user.
         file_names = set()
         for fl in in_dir.files:
             if self.name not in fl.users:
-                if utils.splitext(fl.name)[-1] in self.input_types:
+                if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                     IO_files['-i'] = os.path.join(in_dir.path, fl.name)
                     command_ids = [utils.infer_path_id(IO_files['-i'])]
                     in_dir.use_file(fl.name, self.name)
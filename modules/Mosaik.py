@@ -3,10 +3,11 @@ import os
 from STAPLERerror import STAPLERerror
 from STAPLERerror import VirtualIOError
 from GenericBase import GenericBase
+import read_groups
 import utils
 
 
-class MosaikBuild(GenericBase):
+class MosaikBuild(read_groups.ReadGroupAssigner, GenericBase):
     """Class for MosaikBuild tool of Mosaik aligner.
 
     Attributes:
@@ -21,13 +22,21 @@ class MosaikBuild(GenericBase):
 
     name = 'stapler_MosaikBuild'
     input_types = {'.fastq'}
+    compressed_input_types = input_types
+    native_compressions = {'.gz'}
     output_types = ['.dat']
     hidden_mandatory_args = ['-q', '-q2', '-out']
     user_mandatory_args = ['--!read_format']
     user_optional_args = ['-assignQual', '-bd', '-cn', '-ds', '-fq', '-fq2', '-fr',
                           '-fr2', '-gd', '-id', '-il', '-il', '-ln', '-mfl', '-out',
                           '-pu', '-q', '-q2', '-quiet', '-sam', '-split', '-srf',
-                          '-st', '-tp', '-ts']
+                          '-st', '-tp', '-ts', '--!RGID', '--!RGSM', '--!RGLB',
+                          '--!RGPL', '--!RGPU', '--!RGCN', '--!RGDS', '--!RGPI']
+    read_group_conflicting_args = ['-id', '-sam', '-ln', '-st', '-pu', '-cn',
+                                   '-ds', '-mfl']
+    # @RG tags and the corresponding MosaikBuild arguments
+    read_group_tag_args = {'ID': '-id', 'SM': '-sam', 'LB': '-ln', 'PL': '-st',
+                           'PU': '-pu', 'CN': '-cn', 'DS': '-ds', 'PI': '-mfl'}
     help_description = """
 Tested with version 2.2.30.
 
@@ -37,7 +46,21 @@ contains the read number replaced with "?" and surrounding characters.
 
 For instance if you have paired end files samplename_R1 and samplename_R2,
 the --!read_format argument should look like this:
---!read_format _R?"""
+--!read_format _R?
+
+The read group can also be defined with the --!RGID, --!RGSM, --!RGLB,
+--!RGPL, --!RGPU, --!RGCN, --!RGDS and --!RGPI parameters of
+stapler_Picard_AddOrReplaceReadGroups, which are converted to the
+corresponding MosaikBuild arguments (-id, -sam, -ln, -st, -pu, -cn, -ds and
+-mfl). Mosaik carries the read group to the aligned BAM files, so a separate
+AddOrReplaceReadGroups step is not needed."""
+
+    def _set_read_group(self, out_cmd, read_group):
+        """Adds the read group to the command line."""
+        for tag, value in read_group:
+            if tag == 'PL':
+                value = value.lower()
+            out_cmd[self.read_group_tag_args[tag]] = value
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
         """Infers the input and output file paths.
@@ -75,7 +98,7 @@ the --!read_format argument should look like this:
 
         paired_files = in_dir.file_pairs(in_dir,
                                          user=self.name,
-                                         file_formats= list(self.input_types))
+                                         file_formats= list(self.accepted_input_types()))
         if not paired_files:
             raise VirtualIOError('{0} argument did not find any pairs from'
                                  'folder {1}'.format(self.name, in_dir.path))
@@ -146,6 +169,8 @@ class MosaikAligner(GenericBase):
                           '-omi', '-p', '-pd', '-quiet', '-sref', '-srefn',
                           '-statmq', '-zn', '-ibs', '-annpe', '-annse']
     parallelizable = True
+    # The jump database and the reference are loaded without any output
+    stall_timeout = 120
     help_description = '''
     Tested with version 2.2.30.
 
@@ -13,6 +13,7 @@ import os
 
 from STAPLERerror import STAPLERerror
 from STAPLERerror import VirtualIOError
+import bam_output
 import directory
 import utils
 
@@ -59,17 +60,32 @@ class Picard_SuperClass(GenericBase):
         return [' '.join(final_cmd)]
 
 
-class Picard_AddOrReplaceReadGroups(Picard_SuperClass):
+class Picard_BAMWriter(bam_output.BAMOutputPolicy, Picard_SuperClass):
+    """Superclass for Picard tools writing alignment files.
+
+    The compression level is set with COMPRESSION_LEVEL. Picard writes CRAM
+    files when the output file has a .cram extension and the reference is
+    given with REFERENCE_SEQUENCE.
+    """
+
+    name = 'stapler_Picard_BAMWriter'
+    bam_output_arg = '-OUTPUT'
+    bam_reference_arg = '-REFERENCE_SEQUENCE'
+    bam_conflicting_args = ['-COMPRESSION_LEVEL']
+    bam_compression_arg = '-COMPRESSION_LEVEL'
+
+
+class Picard_AddOrReplaceReadGroups(Picard_BAMWriter):
 
     name = 'stapler_Picard_AddOrReplaceReadGroups'
     #Accept all defined types:
-    input_types = {'.sam', '.bam'}
-    output_types = ['.sam', '.bam']
+    input_types = {'.sam', '.bam', '.cram'}
+    output_types = ['.sam', '.bam', '.cram']
     hidden_mandatory_args = ['-INPUT', '-OUTPUT', '-RGLB', '-RGPL', '-RGPU', '-RGSM']
     user_mandatory_args = ['-RGLB', '-RGPL', '-RGPU', '-RGSM']
     remove_user_args = []
-    user_optional_args = ['-SORT_ORDER', '-RGID', '-RGCN', '-RGDS', '-RGDT',
-                          '-RGPI', '-VALIDATION_STRINGENCY', '-COMPRESSION_LEVEL',
+    user_optional_args = ['--!bam_output', '-SORT_ORDER', '-RGID', '-RGCN',
+                          '-RGDS', '-RGDT', '-RGPI', '-VALIDATION_STRINGENCY', '-COMPRESSION_LEVEL',
                           '-MAX_RECORDS_IN_RAM', '-CREATE_INDEX',
                           '-CREATE_MD5_FILE', '-REFERENCE_SEQUENCE',
                           '-GA4GH_CLIENT_SECRETS']
@@ -88,6 +104,10 @@ These (and other optional [see picard manual]) fields can be defined by using th
 STAPLER $VALUE_TABLE feature when you want to define a specific value for each file, e.g.:
 -RGLB $VALUE_TABLE:path/to/my_RGLB_names.txt:name_of_id_column:name_of_RGLB_column
 See STAPLER example directory on how to define a value_table
+
+The --!bam_output parameter selects how the output file is written:
+intermediate (BAM with compression level 1), uncompressed (BAM with
+compression level 0) or cram (CRAM, requires -REFERENCE_SEQUENCE).
     '''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
@@ -158,7 +178,7 @@ class Picard_CollectAlignmentSummaryMetrics(Picard_SuperClass):
 
     name = 'stapler_Picard_CollectAlignmentSummaryMetrics'
     #Accept all defined types:
-    input_types = {'.sam', '.bam'}
+    input_types = {'.sam', '.bam', '.cram'}
     output_types = ['.out']
     hidden_mandatory_args = ['-INPUT', '-OUTPUT']
     user_mandatory_args = []
@@ -247,7 +267,7 @@ class Picard_CollectInsertSizeMetrics(Picard_SuperClass):
 
     name = 'stapler_Picard_CollectInsertSizeMetrics'
     #Accept all defined types:
-    input_types = {'.sam', '.bam'}
+    input_types = {'.sam', '.bam', '.cram'}
     output_types = ['.out']
     hidden_mandatory_args = ['-INPUT', '-OUTPUT', '-HISTOGRAM_FILE']
     user_mandatory_args = []
@@ -341,7 +361,7 @@ class Picard_CollectWgsMetrics(Picard_SuperClass):
 
     name = 'stapler_Picard_CollectWgsMetrics'
     #Accept all defined types:
-    input_types = {'.sam', '.bam'}
+    input_types = {'.sam', '.bam', '.cram'}
     output_types = ['.out']
     hidden_mandatory_args = ['-INPUT', '-OUTPUT']
     user_mandatory_args = []
@@ -415,7 +435,7 @@ Tested with Picard 2.13.
         final_cmd.append(self.out_cmd['-o'])
         return [' '.join(final_cmd)]
 
-class Picard_MarkDuplicates(Picard_SuperClass):
+class Picard_MarkDuplicates(Picard_BAMWriter):
     """Class for using MarkDuplicates of picard toolkit.
 
     Parameters:
@@ -444,12 +464,12 @@ class Picard_MarkDuplicates(Picard_SuperClass):
 
     name = 'stapler_Picard_MarkDuplicates'
     #Accept all defined types:
-    input_types = {'.sam', '.bam'}
-    output_types = ['.sam', '.bam']
+    input_types = {'.sam', '.bam', '.cram'}
+    output_types = ['.sam', '.bam', '.cram']
     hidden_mandatory_args = ['-INPUT', '-OUTPUT', '-METRICS_FILE']
     user_mandatory_args = []
     remove_user_args = user_mandatory_args
-    user_optional_args = ['-PROGRAM_RECORD_ID', '-PROGRAM_GROUP_VERSION',
+    user_optional_args = ['--!bam_output', '-PROGRAM_RECORD_ID', '-PROGRAM_GROUP_VERSION',
                           '-PROGRAM_GROUP_COMMAND_LINE', '-PROGRAM_GROUP_NAME',
                           '-COMMENT', '-REMOVE_DUPLICATES', '-ASSUME_SORTED',
                           '-MAX_FILE_HANDLES_FOR_READ_ENDS_MAP',
@@ -465,6 +485,10 @@ Tested with Picard 2.13.
 
 The mandatory metrics file is written to the output directory along with the
 output bam/sam file.
+
+The --!bam_output parameter selects how the output file is written:
+intermediate (BAM with compression level 1), uncompressed (BAM with
+compression level 0) or cram (CRAM, requires -REFERENCE_SEQUENCE).
     '''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
@@ -509,16 +533,16 @@ output bam/sam file.
         return out_cmd, command_ids
 
 
-class Picard_SamFormatConverter(Picard_SuperClass):
+class Picard_SamFormatConverter(Picard_BAMWriter):
 
     name = 'stapler_Picard_SamFormatConverter'
     #Accept all defined types:
-    input_types = {'.sam', '.bam'}
-    output_types = ['.sam', '.bam']
+    input_types = {'.sam', '.bam', '.cram'}
+    output_types = ['.sam', '.bam', '.cram']
     hidden_mandatory_args = ['-INPUT', '-OUTPUT']
     user_mandatory_args = ['-!in_type', '-!out_type']
     remove_user_args = user_mandatory_args
-    user_optional_args = ['-VERBOSITY', '-QUIET', '-VALIDATION_STRINGENCY',
+    user_optional_args = ['--!bam_output', '-VERBOSITY', '-QUIET', '-VALIDATION_STRINGENCY',
                           '-COMPRESSION_LEVEL',
                           '-MAX_RECORDS_IN_RAM', '-CREATE_INDEX',
                           '-CREATE_MD5_FILE', '-VALIDATION_STRINGENCY',
@@ -531,7 +555,12 @@ class Picard_SamFormatConverter(Picard_SuperClass):
 Tested with Picard 2.13.
 
 The -!in_type and -!out_type parameters are required to define the input and
-output formats. Allowed values are ".sam" and ".bam".
+output formats. Allowed values are ".sam", ".bam" and ".cram". Reading and
+writing CRAM files requires the -REFERENCE_SEQUENCE parameter.
+
+The --!bam_output parameter selects how the output file is written:
+intermediate (BAM with compression level 1), uncompressed (BAM with
+compression level 0) or cram (CRAM, requires -REFERENCE_SEQUENCE).
     '''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
@@ -553,13 +582,13 @@ output formats. Allowed values are ".sam" and ".bam".
         VirtualIOError: No valid input file can be found.
         """
         #Check user input
-        if out_cmd['-!in_type'] not in {'.sam', '.bam'}:
-            raise STAPLERerror('Valid values for -!in_type are ".sam" and '
-                               '".bam"! The current value was:\n{0}'
+        if out_cmd['-!in_type'] not in self.input_types:
+            raise STAPLERerror('Valid values for -!in_type are ".sam", ".bam" '
+                               'and ".cram"! The current value was:\n{0}'
                                .format(out_cmd['-!in_type']))
-        if out_cmd['-!out_type'] not in {'.sam', '.bam'}:
-            raise STAPLERerror('Valid values for -!out_type are ".sam" and '
-                               '".bam"! The current value was:'
+        if out_cmd['-!out_type'] not in self.output_types:
+            raise STAPLERerror('Valid values for -!out_type are ".sam", ".bam" '
+                               'and ".cram"! The current value was:\n{0}'
                                .format(out_cmd['-!out_type']))
         IO_files = {}
         file_names = set()
@@ -582,7 +611,7 @@ output formats. Allowed values are ".sam" and ".bam".
         return out_cmd, command_ids
 
 
-class Picard_SortSam(Picard_SuperClass):
+class Picard_SortSam(Picard_BAMWriter):
     """Class for using SortSam of picard toolkit.
 
     Parameters:
@@ -611,18 +640,22 @@ class Picard_SortSam(Picard_SuperClass):
 
     name = 'stapler_Picard_SortSam'
     #Accept all defined types:
-    input_types = {'.sam', '.bam'}
-    output_types = ['.sam', '.bam']
+    input_types = {'.sam', '.bam', '.cram'}
+    output_types = ['.sam', '.bam', '.cram']
     hidden_mandatory_args = ['-INPUT', '-OUTPUT', '-SORT_ORDER']
     user_mandatory_args = ['-SORT_ORDER']
     remove_user_args = []
-    user_optional_args = ['-VALIDATION_STRINGENCY', '-COMPRESSION_LEVEL',
-                          '-MAX_RECORDS_IN_RAM', '-CREATE_INDEX',
+    user_optional_args = ['--!bam_output', '-VALIDATION_STRINGENCY',
+                          '-COMPRESSION_LEVEL', '-MAX_RECORDS_IN_RAM', '-CREATE_INDEX',
                           '-CREATE_MD5_FILE', '-REFERENCE_SEQUENCE',
                           '-GA4GH_CLIENT_SECRETS']
     parallelizable = True
     help_description = '''
 Tested with Picard 2.13.
+
+The --!bam_output parameter selects how the output file is written:
+intermediate (BAM with compression level 1), uncompressed (BAM with
+compression level 0) or cram (CRAM, requires -REFERENCE_SEQUENCE).
     '''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
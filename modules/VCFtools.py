@@ -3,9 +3,10 @@ import os
 from GenericBase import GenericBase
 from STAPLERerror import STAPLERerror
 from STAPLERerror import VirtualIOError
+import output_compression
 import utils
 
-class VCFtools(GenericBase):
+class VCFtools(output_compression.CompressedOutput, GenericBase):
     """Class for generic command lines, also superclass for STAPLER input classes.
 
     Parameters:
@@ -40,6 +41,8 @@ class VCFtools(GenericBase):
     hidden_mandatory_args = ['--!xcf', '--!out']
     user_mandatory_args = []
     remove_user_args = ['--!compressed_output']
+    compress_output_arg = '--!compressed_output'
+    compressed_output_path_arg = '--!out'
     user_optional_args = ['--temp', '--chr', '--not-chr', '--from-bp', '--to-bp',
                           '--positions', '--exclude-positions',
                           '--positions-overlap', '--exclude-position-overlap',
@@ -86,8 +89,11 @@ Tested with VCFtools v0.1.10.
 Remember to include the --recode argument when necessary (which is
 pretty often...)! Notice that by default the output file will be an
 uncompressed vcf file whether or not the input file has been compressed.
-Include the --!compress_output parameter to the command line to create
-compressed output.
+Include the --!compressed_output parameter to the command line to create
+compressed output. The output is piped to the compressor selected with the
+--output_compressor parameter of STAPLER, which uses all the cores allocated
+to the job. Compressed .vcf files are always written with bgzip, so that
+they can be indexed with tabix.
 
 Known quirks and issues:
 1. The format converting tools do not work yet as intended. The
@@ -138,7 +144,8 @@ original manual!
                     else:
                         output_name = fl.name + '.out'
                     if '--!compressed_output' in out_cmd:
-                        output_name += '.gz'
+                        output_name += output_compression.compressed_extension(
+                            os.path.splitext(output_name)[1])
                     output_path = os.path.join(out_dir.path, output_name)
                     IO_files['--!out'] = output_path
                     file_names.add(output_name)
@@ -248,16 +255,13 @@ original manual!
                           '--diff-site-discordance', '--diff-switch-error']:
             if parameter in self.out_cmd:
                 comparison_option = True
-                if self.out_cmd['--!out'].endswith('.gz'):
+                if self.compress_output():
                     raise STAPLERerror('vcftools diff options are not '
                                        'compatible with --!compressed_output '
                                        'option.')
 
         if not comparison_option:
-            if self.out_cmd['--!out'].endswith('.gz'):
-                final_cmd.append('--stdout | gzip > {0}'.format(self.out_cmd['--!out']))
-            else:
-                final_cmd.append('--stdout > {0}'.format(self.out_cmd['--!out']))
+            final_cmd.append('--stdout ' + self._output_redirection())
         else:
             final_cmd.append('--out {0}'.format(self.out_cmd['--!out']))
         output = ' '.join(final_cmd)
@@ -0,0 +1,161 @@
+"""Compression policy of the alignment files written by the workflow steps.
+
+By default the tools write BAM files with their default compression level,
+even though most of the files are intermediates read once by the next step
+and removed later. The --!bam_output parameter of the tools writing
+alignment files selects how the output file is written:
+
+intermediate: BAM with the fastest compression level (1).
+uncompressed: BAM without compression (level 0), which is the fastest to
+write and read, but takes several times more disk space.
+cram: CRAM file compressed against the reference genome, which is usually
+less than half of the size of the BAM file. Meant for the final outputs of
+the workflow.
+"""
+
+import os
+
+from GenericBase import GenericBase
+from STAPLERerror import STAPLERerror
+import scatter
+import utils
+
+
+# Output policies and the corresponding BAM compression levels
+BAM_COMPRESSION_LEVELS = {'intermediate': 1,
+                          'uncompressed': 0}
+
+CRAM_POLICY = 'cram'
+
+# Index file extensions of the alignment file formats
+ALIGNMENT_INDEX_EXTENSIONS = {'.bam': '.bai',
+                              '.cram': '.crai'}
+
+
+def index_extension(path):
+    """Returns the index file extension of an alignment file.
+
+    Parameters:
+    path: Path to a BAM or CRAM file.
+
+    Returns:
+    .crai for CRAM files, otherwise .bai
+    """
+    return ALIGNMENT_INDEX_EXTENSIONS.get(os.path.splitext(path)[1], '.bai')
+
+
+class BAMOutputPolicy():
+    """Mixin for tools writing alignment files with the --!bam_output
+    parameter.
+
+    Attributes:
+    bam_output_arg: Argument of the output alignment file.
+    bam_reference_arg: Argument of the reference genome, which is required
+    for writing CRAM files.
+    bam_conflicting_args: Output format arguments of the tool itself, which
+    can not be used together with --!bam_output.
+    bam_compression_arg: Argument setting the BAM compression level.
+    bam_compression_value: Value of bam_compression_arg, {0} is replaced
+    with the compression level.
+    bam_output: Selected output policy, None if --!bam_output is not given.
+    """
+
+    bam_output_arg = None
+    bam_reference_arg = None
+    bam_conflicting_args = []
+    bam_compression_arg = None
+    bam_compression_value = '{0}'
+    bam_output = None
+
+    def _set_compression_level(self, out_cmd, level):
+        """Sets the BAM compression level of the output with
+        bam_compression_arg.
+
+        The value is given as a list if the tool keeps its argument values in
+        lists (e.g. GATK).
+
+        Raises:
+        STAPLERerror: The tool does not define bam_compression_arg.
+        """
+        if self.bam_compression_arg is None:
+            raise STAPLERerror('--!bam_output {0} parameter is not supported '
+                               'by {1}, as the compression level of the '
+                               'output can not be set.'.format(self.bam_output,
+                                                               self.name))
+        value = self.bam_compression_value.format(level)
+        if isinstance(out_cmd.get(self.bam_output_arg), list):
+            value = [value]
+        out_cmd[self.bam_compression_arg] = value
+
+    def _set_cram_output(self, out_cmd, reference_path):
+        """Sets the output format to CRAM. By default the output format is
+        inferred by the tool from the file extension."""
+        pass
+
+    def _remove_user_arguments(self, out_cmd):
+        """Removes the specified arguments from final command line and applies
+        the --!bam_output policy.
+
+        Parameters:
+        out_cmd: Dict containing the output commands
+
+        Returns:
+        Output commands
+
+        Raises:
+        STAPLERerror: Invalid --!bam_output parameter.
+        """
+        policy = scatter.single_value(out_cmd.pop('--!bam_output', None))
+        out_cmd = GenericBase._remove_user_arguments(self, out_cmd)
+        if policy is None:
+            return out_cmd
+        if policy not in BAM_COMPRESSION_LEVELS and policy != CRAM_POLICY:
+            raise STAPLERerror('--!bam_output parameter of {0} requires one of '
+                               'the following values: {1}'.format(
+                                   self.name,
+                                   ', '.join(sorted(BAM_COMPRESSION_LEVELS.keys() +
+                                                    [CRAM_POLICY]))))
+        for arg in self.bam_conflicting_args:
+            if arg in out_cmd:
+                raise STAPLERerror('{0} parameter of {1} can not be used '
+                                   'together with --!bam_output.'
+                                   .format(arg, self.name))
+        self.bam_output = policy
+        if policy == CRAM_POLICY:
+            reference_path = scatter.single_value(out_cmd.get(self.bam_reference_arg))
+            if not reference_path:
+                raise STAPLERerror('--!bam_output cram parameter of {0} '
+                                   'requires the reference genome to be '
+                                   'defined with the {1} parameter.'
+                                   .format(self.name, self.bam_reference_arg))
+            self._rename_output(out_cmd, '.cram')
+            self._set_cram_output(out_cmd, reference_path)
+        else:
+            self._rename_output(out_cmd, '.bam')
+            self._set_compression_level(out_cmd, BAM_COMPRESSION_LEVELS[policy])
+        return out_cmd
+
+    def _rename_output(self, out_cmd, extension):
+        """Changes the file extension of the output file and its predicted
+        index file.
+
+        Parameters:
+        out_cmd: Dict containing the output commands
+        extension: New file extension.
+        """
+        value = out_cmd[self.bam_output_arg]
+        output_path = scatter.single_value(value)
+        new_path = utils.splitext(output_path)[0] + extension
+        if new_path == output_path:
+            return
+        old_index = os.path.basename(output_path) + index_extension(output_path)
+        self.out_dir.rm_file(os.path.basename(output_path))
+        self.out_dir.add_file(os.path.basename(new_path))
+        if old_index in self.out_dir.file_names:
+            self.out_dir.rm_file(old_index)
+            self.out_dir.add_file(os.path.basename(new_path) +
+                                  index_extension(new_path))
+        if isinstance(value, list):
+            out_cmd[self.bam_output_arg] = [new_path]
+        else:
+            out_cmd[self.bam_output_arg] = new_path
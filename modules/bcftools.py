@@ -3,6 +3,7 @@ import os
 from GenericBase import GenericBase
 from STAPLERerror import VirtualIOError
 from STAPLERerror import STAPLERerror
+import scatter
 import utils
 
 
@@ -132,7 +133,34 @@ parameters.
         return [' '.join(final_cmd)]
 
 
-class bcftools_mpileup(GenericBase):
+class bcftools_concat(scatter.Gather):
+    """Class for gathering scattered VCF/BCF files with BCFtools concat.
+
+    The output format is the same as the format of the scattered command.
+    """
+
+    name = 'stapler_bcftools_concat'
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        output_type = '-Ov'
+        if utils.splitext(self.output_path)[1] in ('.vcf.gz', '.gvcf.gz'):
+            output_type = '-Oz'
+        elif utils.splitext(self.output_path)[1] == '.bcf':
+            output_type = '-Ob'
+        for flag in ('-Ob', '-Ou', '-Oz', '-Ov'):
+            if flag in self.scattered_command.out_cmd:
+                output_type = flag
+        final_cmd = [self.run_command, output_type, '-o', self.output_path]
+        final_cmd += self.shard_paths
+        return [' '.join(final_cmd) + ' && ' + self.remove_shards_cmd()]
+
+
+class bcftools_mpileup(scatter.Scatterable, GenericBase):
     """Class for creating command lines for BCFtools mpileup.
 
     Parameters:
@@ -161,13 +189,15 @@ class bcftools_mpileup(GenericBase):
 
     name = 'stapler_bcftools_mpileup'
     #Accept all defined types:
-    input_types = {'.bam'}
+    input_types = {'.bam', '.cram'}
     output_types = ['.vcf', '.bcf']
     require_output_dir = True
     hidden_mandatory_args = ['--!i', '--!o']
     user_mandatory_args = ['-f', '--!input_files_per_command']
-    remove_user_args = ['--!input_files_per_command']
-    user_optional_args = ['--adjust-MQ', '--annotate', '--bam-list',
+    remove_user_args = ['--!input_files_per_command', '--!scatter',
+                        '--!scatter_exclude']
+    user_optional_args = ['--!scatter', '--!scatter_exclude',
+                          '--adjust-MQ', '--annotate', '--bam-list',
                           '--count-orphans', '--excl-flags', '--ext-prob',
                           '--fasta-ref', '--ff', '--gap-frac', '--gvcf',
                           '--ignore-overlaps', '--ignore-RG', '--illumina1.3+',
@@ -184,10 +214,25 @@ class bcftools_mpileup(GenericBase):
                           '-q', '-Q', '-r', '-R', '-s', '-S', '-t', '-T', '-x',
                           '-Ob', '-Ou', '-Oz', '-Ov']
     parallelizable = True
+    scatter_reference_arg = '-f'
+    scatter_output_arg = '--!o'
+    scatter_region_args = ['-r', '--regions', '-R', '--regions-file', '-t',
+                           '--targets', '-T', '--targets-file']
+    scatter_interval_arg = '-R'
+    gather_class = bcftools_concat
+    reference_indexes = {'-f': ['faidx']}
     help_description = '''
 Tested with samtools 1.7.
 
 Determine the output file format by using -Ob, -Ou, -Oz or -Ov parameter.
+
+The --!scatter <N> parameter splits the reference genome into N intervals of
+roughly equal size and runs a separate job for each interval (using the -R
+parameter). The interval outputs are combined with bcftools concat in the
+beginning of the next workflow part, so stapler_bcftools_concat must be
+configured in config.txt. The reference genome must be indexed with samtools
+faidx. A .bed file of regions to skip (e.g. runs of N bases)
+can be given with the --!scatter_exclude parameter.
     '''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
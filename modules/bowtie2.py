@@ -1,11 +1,16 @@
 import os
+import pipes
 
 from GenericBase import GenericBase
 from STAPLERerror import STAPLERerror
 from STAPLERerror import VirtualIOError
+import read_groups
+import samtools
+import scatter
 import utils
 
-class bowtie2(GenericBase):
+class bowtie2(samtools.MarkdupPipeline, read_groups.ReadGroupAssigner,
+              scatter.ChunkScatterable, GenericBase):
     """Class for using bowtie2 algorithm.
 
     Parameters:
@@ -33,12 +38,16 @@ class bowtie2(GenericBase):
     """
 
     name = 'stapler_bowtie2'
-    input_types = {'.fastq', '.fastq.gz', '.fastq.bz2', '.fq', '.fq.gz', '.fq.bz2'}
+    input_types = {'.fastq', '.fq'}
+    compressed_input_types = input_types
+    native_compressions = {'.gz', '.bz2'}
     output_types = ['.sam']
     hidden_mandatory_args = ['-S']
     user_mandatory_args = ['-x']
-    remove_user_args = ['--!read_format']
-    user_optional_args = ['-1', '-2', '-q', '-s', '-u', '-5',
+    remove_user_args = ['--!read_format', '--!scatter', '--!markdup',
+                        '--!shared_index']
+    user_optional_args = ['--!scatter', '--!markdup', '--!shared_index',
+                          '-1', '-2', '-q', '-s', '-u', '-5',
                           '-3', '--phred33', '--phred64', '--solexa-quals',
                           '--int-quals', '--end-to-end', '--very-fast', '--fast',
                           '--sensitive', '--very-sensitive', '--very-fast-local',
@@ -58,8 +67,18 @@ class bowtie2(GenericBase):
                           '--met', '--no-unal', '--no-hd', '--no-sq', '--rg-id',
                           '--rg', '--omit-sec-seq', '-o', '--offrate', '-p',
                           '--threads', '--reorder', '--mm', '--qc-filter',
-                          '--seed', '--non-deterministic', '--!read_format']
+                          '--seed', '--non-deterministic', '--!read_format',
+                          '--!RGID', '--!RGSM', '--!RGLB', '--!RGPL', '--!RGPU',
+                          '--!RGCN', '--!RGDS', '--!RGDT', '--!RGPI']
     parallelizable = True
+    scatter_input_args = ['-1', '-2', '-q']
+    scatter_output_arg = '-S'
+    scatter_thread_arg = '-p'
+    gather_class = samtools.samtools_merge
+    reference_indexes = {'-x': ['bowtie2']}
+    read_group_conflicting_args = ['--rg-id', '--rg']
+    markdup_output_arg = '-S'
+    markdup_thread_arg = '-p'
     help_description = '''
 Both paired-end and single-end data can be used as input but not at the same
 time. Paired-end mode is used when --!read_format argument is present in the
@@ -69,8 +88,48 @@ command line, otherwise single-end data is assumed.
 file names. For instance if you have paired end files samplename_R1 and
 samplename_R2, the --!read_format argument should look like this:
 --!read_format _R?
+
+The --!scatter <N> parameter splits the input reads into N chunks and aligns
+each chunk in a separate job. The chunk alignments are merged with samtools
+merge in the beginning of the next workflow part, so stapler_samtools_merge
+must be configured in config.txt.
+
+The read group of the alignments can be defined with the --!RGID, --!RGSM,
+--!RGLB, --!RGPL, --!RGPU, --!RGCN, --!RGDS, --!RGDT and --!RGPI parameters,
+which are converted to --rg-id and --rg arguments of bowtie2. The values are
+the same as for stapler_Picard_AddOrReplaceReadGroups (including $VALUE_TABLE
+definitions), so a separate AddOrReplaceReadGroups step is not needed.
+
+The --!markdup parameter pipes the alignments through samtools fixmate, sort
+and markdup, producing a coordinate sorted, duplicate marked and indexed BAM
+file without writing the intermediate files. The optional value of
+--!markdup is the memory per sorting thread (samtools sort -m) and the thread
+count of -p is used for the samtools commands as well. The samtools commands
+are defined by stapler_samtools_fixmate, stapler_samtools_sort and
+stapler_samtools_markdup in config.txt. --!markdup can not be used together
+with --!scatter.
+
+The --!shared_index parameter copies the index files into /dev/shm once per
+node (the first command holds a lock file while the rest wait) and runs
+bowtie2 with --mm, so all bowtie2 processes on the node memory map the same
+copy of the index instead of loading one each. The sizes and modification
+times of the .1.bt2 files are recorded when the index is copied, and a
+rebuilt index is copied again. The last bowtie2 command using the index on
+the node removes the copy.
     '''
 
+    def _set_read_group(self, out_cmd, read_group):
+        """Adds the read group to the command line.
+
+        bowtie2 takes each @RG field after the ID as a separate --rg argument,
+        so the rest of the fields are joined into the value of the first one.
+        """
+        out_cmd['--rg-id'] = pipes.quote(read_group[0][1])
+        fields = [pipes.quote('{0}:{1}'.format(tag, value))
+                  for tag, value in read_group[1:]]
+        if fields:
+            out_cmd['--rg'] = ' --rg '.join(fields)
+
     def _select_IO(self, out_cmd, in_dir, out_dir):
         """Infers the input and output file paths.
 
@@ -112,7 +171,7 @@ samplename_R2, the --!read_format argument should look like this:
             paired_files = in_dir.file_pairs(pattern=self.parsed_in_cmd[
                 '--!read_format'],
                                              user=self.name,
-                                             file_formats=list(self.input_types),
+                                             file_formats=list(self.accepted_input_types()),
                                              exclusion_iterable=['pairless',
                                                                  'unmatched'])
             file_names = set()
@@ -143,7 +202,7 @@ samplename_R2, the --!read_format argument should look like this:
             file_names = set()
             for fl in in_dir.files:
                 if self.name not in fl.users:
-                    if utils.splitext(fl.name)[-1] in self.input_types:
+                    if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                         IO_files['-q'] = os.path.join(in_dir.path, fl.name)
                         command_ids.append(utils.infer_path_id(IO_files['-q']))
                         in_dir.use_file(fl.name, self.name)
@@ -172,7 +231,48 @@ samplename_R2, the --!read_format argument should look like this:
         """
         run_command = utils.parse_config(self.name, 'cmd_name', 'execute')
         final_cmd = [run_command]
+        shared_index = '--!shared_index' in self.parsed_in_cmd
         for arg, val in self.out_cmd.iteritems():
+            if self.markdup and arg == '-S':
+                continue
+            if shared_index and arg == '-x':
+                val = os.path.join(utils.shared_memory_path(val),
+                                   os.path.basename(val))
             final_cmd.append(arg + ' ' + val)
-        return [' '.join(final_cmd)]
-		
\ No newline at end of file
+        if shared_index and '--mm' not in self.out_cmd:
+            final_cmd.append('--mm')
+        if self.markdup:
+            final_cmd.append(self._output_redirection())
+        if not shared_index:
+            return [' '.join(final_cmd)]
+        return [shared_index_cmd(self.out_cmd['-x'], ' '.join(final_cmd))]
+
+
+def shared_index_cmd(index_prefix, command):
+    """Returns a command line running bowtie2 with the index copied into
+    shared memory.
+
+    The index is copied once per node, and copied again if the index files
+    have changed since. The copy is removed after the last command using it
+    on the node (see utils.shared_resource_command).
+
+    Parameters:
+    index_prefix: Prefix of the bowtie2 index files.
+    command: bowtie2 command line using the copied index.
+
+    Returns:
+    Command line string.
+    """
+    shm_path = utils.shared_memory_path(index_prefix)
+    stamp_path = pipes.quote(os.path.join(shm_path, '.staged'))
+    shm_dir = pipes.quote(shm_path)
+    # Large indexes have .1.bt2l files instead of .1.bt2
+    stage = ('stamp=$(stat -L -c %s.%Y {0}.1.bt2*) && if [ "$(cat {1} 2>/dev/null)" '
+             '!= "$stamp" ]; then rm -rf {2} && mkdir -p {2} && cp {0}.*.bt2* '
+             '{2} && echo "$stamp" > {1}; fi'.format(pipes.quote(index_prefix),
+                                                      stamp_path, shm_dir))
+    return utils.shared_resource_command(shm_path + '.users',
+                                         utils.locked_command(shm_path + '.lock',
+                                                              stage),
+                                         command,
+                                         'rm -rf ' + shm_dir)
@@ -41,6 +41,7 @@ class cutadapt(GenericBase):
                    '.fastq', '.fastq.gz', '.fastq.bz2', '.fastq.xz',
                    '.fq', '.fq.gz', '.fq.bz2', '.fq.xz'}
     output_types = sorted(list(input_types))
+    native_compressions = {'.gz', '.bz2', '.xz'}
     hidden_mandatory_args = ['-!i', '-o']
     hidden_optional_args = ['-!i2']
     user_mandatory_args = []
@@ -0,0 +1,175 @@
+"""Runtime task runner for packed whole-node jobs.
+
+This script is not imported by STAPLER itself. Instead, the generated batch
+script of a packed workload (see --pack) invokes it (with the python
+interpreter available at run time) inside a job allocating a whole node. The
+subshell files listed in the task list file of the workload are run with
+bash, at most --slots of them at a time. The output and error streams of
+each task are written into files of their own, similarly to the tasks of an
+array job. The number of threads available for each task is exported to the
+tasks in the STAPLER_TASK_THREADS environment variable.
+
+The exit code is 0 if all tasks succeeded and 1 otherwise. A SIGTERM or
+SIGINT (e.g. the job being cancelled) is forwarded to the running tasks, no
+more tasks are started and the exit code is 128 + the signal number.
+
+Usage:
+python dispatcher.py --tasks <path> --slots <n> --threads <n>
+--output <template> --error <template>
+
+The {job} and {task} fields of the output and error file templates are
+replaced with the job ID of the resource manager and the task index.
+"""
+
+import argparse
+import errno
+import os
+import signal
+import sys
+import time
+
+
+# Environment variables containing the job ID of the resource managers
+JOB_ID_VARIABLES = ['SLURM_JOB_ID', 'LSB_JOBID', 'PBS_JOBID', 'JOB_ID']
+
+
+def parse_arguments(args):
+    """Parses the dispatcher command line.
+
+    Parameters:
+    args: List of command line arguments.
+
+    Returns:
+    Namespace containing the parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='STAPLER task dispatcher')
+    parser.add_argument('--tasks', required=True)
+    parser.add_argument('--slots', type=int, required=True)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--error', required=True)
+    return parser.parse_args(args)
+
+
+def read_tasks(path):
+    """Reads the task list file.
+
+    Parameters:
+    path: Path to a file containing a task index and a subshell file path
+    separated by a tab on each line.
+
+    Returns:
+    List of (task index, subshell path) tuples.
+    """
+    tasks = []
+    handle = open(path)
+    for line in handle:
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        task_index, subshell_path = line.split('\t', 1)
+        tasks.append((task_index, subshell_path))
+    handle.close()
+    return tasks
+
+
+def job_id():
+    """Returns the job ID of the resource manager or the process ID."""
+    for variable in JOB_ID_VARIABLES:
+        if os.environ.get(variable):
+            return os.environ[variable].split('.')[0]
+    return str(os.getpid())
+
+
+def start_task(task_index, subshell_path, params, current_job_id):
+    """Starts a subshell in a child process.
+
+    Returns:
+    Process ID of the child.
+    """
+    environment = dict(os.environ)
+    environment['STAPLER_TASK_THREADS'] = str(params.threads)
+    environment['STAPLER_TASK_ID'] = task_index
+    out_path = params.output.format(job=current_job_id, task=task_index)
+    err_path = params.error.format(job=current_job_id, task=task_index)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            # A process group of its own, so that a stop signal reaches the
+            # commands run by the subshell as well
+            os.setpgid(0, 0)
+            out_fd = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            err_fd = os.open(err_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.dup2(out_fd, 1)
+            os.dup2(err_fd, 2)
+            os.execvpe('bash', ['bash', '-l', subshell_path], environment)
+        finally:
+            os._exit(127)
+    return pid
+
+
+def main(args):
+    params = parse_arguments(args)
+    tasks = read_tasks(params.tasks)
+    current_job_id = job_id()
+    pending = list(reversed(tasks))
+    running = {}
+    failed = []
+    stopped = []
+
+    def stop_tasks(signum, frame):
+        stopped.append(signum)
+        del pending[:]
+        for pid in running:
+            try:
+                os.killpg(pid, signum)
+            except OSError:
+                pass
+    signal.signal(signal.SIGTERM, stop_tasks)
+    signal.signal(signal.SIGINT, stop_tasks)
+
+    sys.stdout.write('Running {0} tasks, {1} at a time with {2} threads '
+                     'each.\n'.format(len(tasks), params.slots, params.threads))
+    sys.stdout.flush()
+    while pending or running:
+        while pending and len(running) < params.slots:
+            task_index, subshell_path = pending.pop()
+            pid = start_task(task_index, subshell_path, params, current_job_id)
+            running[pid] = (task_index, time.time())
+            if stopped:
+                # The signal arrived while the task was being started
+                os.killpg(pid, stopped[0])
+        try:
+            pid, status = os.wait()
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
+            raise
+        if pid not in running:
+            continue
+        task_index, start = running.pop(pid)
+        if os.WIFSIGNALED(status):
+            exit_code = 128 + os.WTERMSIG(status)
+        else:
+            exit_code = os.WEXITSTATUS(status)
+        if exit_code != 0:
+            failed.append(task_index)
+        sys.stdout.write('Task {0} finished in {1:.0f} s with exit code '
+                         '{2}.\n'.format(task_index, time.time() - start,
+                                         exit_code))
+        sys.stdout.flush()
+
+    if failed:
+        sys.stdout.write('{0} of {1} tasks failed: {2}\n'.format(
+            len(failed), len(tasks), ', '.join(failed)))
+    if stopped:
+        sys.stdout.write('Stopped by signal {0}, the remaining tasks were not '
+                         'started.\n'.format(stopped[0]))
+        return 128 + stopped[0]
+    if failed:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
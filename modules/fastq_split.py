@@ -0,0 +1,318 @@
+"""Extracts a single chunk of a FASTQ file or a pair of FASTQ files.
+
+This script is not imported by STAPLER itself. Instead, the shard commands of
+aligners scattered with --!scatter invoke it (with the python interpreter
+available at run time) to write the reads of their own chunk into temporary
+FASTQ files.
+
+Uncompressed files are memory mapped and split into chunks of equal size at
+record boundaries, so each chunk reads only its own part of the file. The
+chunk boundaries of the second file of a read pair are located by the read
+names of the first file, keeping the pairs in sync. Compressed files can not
+be accessed randomly, so they are streamed and the chunk is formed by every
+K:th block of reads. To decompress the files only once, the first shard to
+run writes the chunks of all shards while the others wait for it.
+
+The output paths are patterns in which {chunk} is replaced with the 4-digit
+chunk number.
+
+Usage:
+python fastq_split.py --chunk <i> --chunks <K> --output <out1> [--output
+<out2>] <in1> [<in2>]
+"""
+
+import argparse
+import bz2
+import fcntl
+import gzip
+import mmap
+import os
+import subprocess
+import sys
+
+
+# Number of consecutive reads assigned to the same chunk when streaming
+# compressed files
+STREAM_BLOCK_SIZE = 10000
+
+# Size of the first window searched for the mate of a read around its
+# estimated position, the window is doubled until it covers the whole file
+MATE_SEARCH_WINDOW = 1 << 20
+
+COPY_BUFFER_SIZE = 1 << 24
+
+# Compressed formats without a python module are read through these commands
+DECOMPRESSION_COMMANDS = {'.xz': ['xz', '-dc'],
+                          '.zst': ['zstd', '-dc']}
+
+
+def parse_arguments(args):
+    """Parses the command line.
+
+    Parameters:
+    args: List of command line arguments.
+
+    Returns:
+    Namespace containing the parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='STAPLER FASTQ splitter')
+    parser.add_argument('--chunk', type=int, required=True,
+                        help='Chunk to extract (1-based)')
+    parser.add_argument('--chunks', type=int, required=True,
+                        help='Total number of chunks')
+    parser.add_argument('--output', action='append', required=True)
+    parser.add_argument('inputs', nargs='+')
+    params = parser.parse_args(args)
+    if len(params.inputs) != len(params.output) or len(params.inputs) > 2:
+        parser.error('Give one or two input files and an output file for '
+                     'each of them.')
+    if not 1 <= params.chunk <= params.chunks:
+        parser.error('--chunk must be between 1 and --chunks')
+    if any('{chunk}' not in pattern for pattern in params.output):
+        parser.error('--output paths must contain {chunk}')
+    return params
+
+
+def chunk_outputs(params, chunk):
+    """Returns the output paths of a chunk."""
+    return [pattern.format(chunk='{0:04d}'.format(chunk))
+            for pattern in params.output]
+
+
+def next_line(mm, position):
+    """Returns the position of the next line start or the size of the file."""
+    position = mm.find(b'\n', position)
+    if position == -1:
+        return mm.size()
+    return position + 1
+
+
+def record_start(mm, offset):
+    """Returns the position of the first read record starting at or after
+    offset.
+
+    A line starting with '@' is a record header only if the line after the
+    next starts with '+', as quality lines may also start with '@'.
+    """
+    size = mm.size()
+    if offset <= 0:
+        return 0
+    position = next_line(mm, offset - 1)
+    while position < size:
+        if mm[position:position+1] == b'@':
+            plus_line = next_line(mm, next_line(mm, position))
+            if mm[plus_line:plus_line+1] == b'+':
+                return position
+        position = next_line(mm, position)
+    return size
+
+
+def read_name(mm, position):
+    """Returns the read name of the record at position without mate
+    suffixes."""
+    name = mm[position:next_line(mm, position)].split()[0]
+    if name[-2:] in (b'/1', b'/2'):
+        name = name[:-2]
+    return name
+
+
+def is_record_of(mm, position, name):
+    """Returns True if a record with the given read name starts at
+    position."""
+    if position != 0 and mm[position-1:position] != b'\n':
+        return False
+    plus_line = next_line(mm, next_line(mm, position))
+    return mm[plus_line:plus_line+1] == b'+' and \
+        read_name(mm, position) == name
+
+
+def locate_mate(mm, name, hint):
+    """Returns the position of the record with the given read name.
+
+    The read name is searched around the hint position, doubling the searched
+    window until it covers the whole file. The mate files of trimmed reads may
+    differ in size, so the estimated position can be far off.
+    """
+    size = mm.size()
+    window = MATE_SEARCH_WINDOW
+    searched_low, searched_high = hint, hint
+    while True:
+        low, high = max(0, hint - window), min(size, hint + window)
+        # Only the parts not searched yet, overlapping by a name length
+        for start, end in ((low, searched_low + len(name)),
+                           (max(low, searched_high - len(name)), high)):
+            position = mm.find(name, start, end)
+            while position != -1:
+                if is_record_of(mm, position, name):
+                    return position
+                position = mm.find(name, position + 1, end)
+        if low == 0 and high == size:
+            break
+        searched_low, searched_high = low, high
+        window *= 2
+    raise ValueError('Unable to find read {0} from the second input file. Are '
+                     'the input files properly paired?'.format(name))
+
+
+def copy_range(mm, start, end, output_path):
+    """Writes bytes start..end of the memory map into a file."""
+    out = open(output_path, 'wb')
+    while start < end:
+        stop = min(end, start + COPY_BUFFER_SIZE)
+        out.write(mm[start:stop])
+        start = stop
+    out.close()
+
+
+def open_map(path):
+    """Memory maps a file, returns None for empty files."""
+    handle = open(path, 'rb')
+    if os.fstat(handle.fileno()).st_size == 0:
+        handle.close()
+        return None
+    mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    handle.close()
+    return mm
+
+
+def split_mapped(params):
+    """Extracts a chunk of uncompressed FASTQ file(s) by byte ranges."""
+    outputs = chunk_outputs(params, params.chunk)
+    maps = [open_map(path) for path in params.inputs]
+    if maps[0] is None:
+        for output_path in outputs:
+            open(output_path, 'wb').close()
+        return
+    size = maps[0].size()
+    start = record_start(maps[0], size * (params.chunk - 1) // params.chunks)
+    end = record_start(maps[0], size * params.chunk // params.chunks)
+    copy_range(maps[0], start, end, outputs[0])
+
+    if len(maps) == 2:
+        mate_map = maps[1]
+        if mate_map is None:
+            raise ValueError('The second input file is empty.')
+        mate_size = mate_map.size()
+        if start == 0:
+            mate_start = 0
+        else:
+            mate_start = locate_mate(mate_map, read_name(maps[0], start),
+                                     start * mate_size // size)
+        if end >= size:
+            mate_end = mate_size
+        else:
+            mate_end = locate_mate(mate_map, read_name(maps[0], end),
+                                   end * mate_size // size)
+        copy_range(mate_map, mate_start, mate_end, outputs[1])
+
+
+def open_stream(path):
+    """Opens a possibly compressed file for reading."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path, 'rb')
+    extension = os.path.splitext(path)[1]
+    if extension in DECOMPRESSION_COMMANDS:
+        return subprocess.Popen(DECOMPRESSION_COMMANDS[extension] + [path],
+                                stdout=subprocess.PIPE).stdout
+    return open(path, 'rb')
+
+
+def read_records(handle):
+    """Yields the 4-line records of a FASTQ file."""
+    while True:
+        record = [handle.readline() for _ in range(4)]
+        if not record[0]:
+            return
+        yield b''.join(record)
+
+
+def stream_chunks(params, chunks):
+    """Writes chunks of compressed FASTQ file(s) by blocks of reads.
+
+    The chunks are first written under temporary names, so an interrupted
+    run leaves no partial chunk files.
+
+    Parameters:
+    params: Parsed command line.
+    chunks: Numbers of the chunks to write.
+    """
+    inputs = [read_records(open_stream(path)) for path in params.inputs]
+    outputs = dict((chunk, [open(path + '.tmp', 'wb')
+                            for path in chunk_outputs(params, chunk)])
+                   for chunk in chunks)
+    index = 0
+    while True:
+        records = [next(records_iter, None) for records_iter in inputs]
+        if records[0] is None:
+            break
+        if None in records:
+            raise ValueError('The input files contain different numbers of '
+                             'reads.')
+        chunk = (index // STREAM_BLOCK_SIZE) % params.chunks + 1
+        if chunk in outputs:
+            for out, record in zip(outputs[chunk], records):
+                out.write(record)
+        index += 1
+    for chunk, chunk_outs in outputs.items():
+        for out, path in zip(chunk_outs, chunk_outputs(params, chunk)):
+            out.close()
+            os.rename(path + '.tmp', path)
+
+
+def input_signature(params):
+    """Returns a string identifying the input files and the chunk count."""
+    parts = [str(params.chunks)]
+    for path in params.inputs:
+        stat = os.stat(path)
+        parts.append('{0}:{1}:{2}'.format(os.path.realpath(path), stat.st_size,
+                                          int(stat.st_mtime)))
+    return '\n'.join(parts) + '\n'
+
+
+def split_streamed(params):
+    """Extracts a chunk of compressed FASTQ file(s) by blocks of reads.
+
+    The first shard to run writes the chunks of all shards and records it in
+    a marker file, the others wait for it holding a lock and use their
+    ready chunks. A shard run again after its chunk was removed extracts
+    only its own chunk.
+    """
+    outputs = chunk_outputs(params, params.chunk)
+    group_path = params.output[0].format(chunk='all')
+    signature = input_signature(params)
+    lock = open(group_path + '.lock', 'a')
+    fcntl.lockf(lock, fcntl.LOCK_EX)
+    try:
+        done = False
+        if os.path.isfile(group_path + '.done'):
+            with open(group_path + '.done') as handle:
+                done = handle.read() == signature
+        if not done:
+            stream_chunks(params, range(1, params.chunks + 1))
+            with open(group_path + '.done', 'w') as handle:
+                handle.write(signature)
+        elif not all(os.path.isfile(path) for path in outputs):
+            stream_chunks(params, [params.chunk])
+    finally:
+        fcntl.lockf(lock, fcntl.LOCK_UN)
+        lock.close()
+
+
+def main(args):
+    params = parse_arguments(args)
+    try:
+        if any(path.endswith(('.gz', '.bz2', '.xz', '.zst'))
+               for path in params.inputs):
+            split_streamed(params)
+        else:
+            split_mapped(params)
+    except (IOError, OSError, ValueError) as err:
+        sys.stderr.write('STAPLER FASTQ splitter: {0}\n'.format(err))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -3,9 +3,13 @@ import os
 from GenericBase import GenericBase
 from STAPLERerror import VirtualIOError
 from STAPLERerror import STAPLERerror
+import bcftools
+import output_compression
+import scatter
 import utils
 
-class freebayes(GenericBase):
+class freebayes(output_compression.CompressedOutput, scatter.Scatterable,
+                GenericBase):
     """Class for using freebayes.
 
     Parameters:
@@ -38,8 +42,10 @@ class freebayes(GenericBase):
     output_types = ['.vcf', '.vcf.gz']
     hidden_mandatory_args = ['-b', '-v']
     user_mandatory_args = ['-f', '--!input_files_per_command']
-    remove_user_args = ['--!input_files_per_command']
-    user_optional_args = ['--allele-balance-priors-off',
+    remove_user_args = ['--!input_files_per_command', '--!scatter',
+                        '--!scatter_exclude']
+    user_optional_args = ['--!scatter', '--!scatter_exclude',
+                          '--allele-balance-priors-off',
                           '--base-quality-cap', '--binomial-obs-priors-off',
                           '--cnv-map', '--contamination-estimates', '--debug',
                           '--dont-left-align-indels',
@@ -81,6 +87,14 @@ class freebayes(GenericBase):
                           '-V', '-w', '-W', '-X', '-Y', '-z', '-Z',
                           '--!compress_output']
     parallelizable = True
+    scatter_reference_arg = '-f'
+    scatter_output_arg = '-v'
+    scatter_region_args = ['-r', '--region', '-t', '--targets']
+    scatter_interval_arg = '--targets'
+    gather_class = bcftools.bcftools_concat
+    reference_indexes = {'-f': ['faidx']}
+    compress_output_arg = '--!compress_output'
+    compressed_output_path_arg = '-v'
     help_description = '''
 Tested with freebayes v1.1.0-54-g49413aa
 
@@ -91,8 +105,18 @@ bam file will be processed separately, producing an output file for every
 input file.
 
 To create compressed output files the --!compress_output parameter can be
-included into the command line. The output will be piped to gzip and the
-output files will have the .gz filename extension.
+included into the command line. The output will be piped to bgzip, which
+uses all the cores allocated to the job, and the output files will have the
+.gz filename extension. The files are in the BGZF format and can be indexed
+with tabix.
+
+The --!scatter <N> parameter splits the reference genome into N intervals of
+roughly equal size and runs a separate job for each interval (using the
+--targets parameter). The interval outputs are combined with bcftools concat
+in the beginning of the next workflow part, so stapler_bcftools_concat must
+be configured in config.txt. The reference genome must be indexed with
+samtools faidx. A .bed file of regions to skip (e.g. runs of N bases) can be
+given with the --!scatter_exclude parameter.
     '''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
@@ -175,10 +199,7 @@ output files will have the .gz filename extension.
                 final_cmd.append(arg + ' ' + val)
 
         #Include compressed/uncompressed output
-        if '--!compress_output' in self.out_cmd:
-            final_cmd.append('| gzip > ' + self.out_cmd['-v'])
-        else:
-            final_cmd.append('> ' + self.out_cmd['-v'])
+        final_cmd.append(self._output_redirection())
         return [' '.join(final_cmd)]
 
 
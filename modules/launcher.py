@@ -0,0 +1,394 @@
+"""Runtime wrapper for executing a single STAPLER command line.
+
+This script is not run by STAPLER itself. Instead, the generated subshell
+files invoke it (with the python interpreter available at run time) around
+each command line when runtime telemetry or the stall watchdog has been
+requested. The command is run with bash, the resource usage of the whole
+process tree is collected with wait4() and one JSON line describing the run
+is appended to the telemetry file of the workload. The exit code of the
+command is passed through unchanged.
+
+With --stall_timeout the launcher acts as a watchdog: if neither the output
+and error streams of the subshell nor the watched output files grow for the
+given number of seconds, the command is considered hung. Streams that are not
+regular files (e.g. the pipes of srun with --job_steps) can not be measured,
+so the output written into them is relayed by the launcher, which counts the
+relayed bytes. Its process group is
+terminated, the reason is written to the error stream and to the stall log,
+and the launcher exits with STALL_EXIT_CODE.
+
+Usage:
+python launcher.py [--telemetry <path>] --workload <n> --task <n>
+--tool <name> --ids <id1,id2,...> [--stall_timeout <s> --stall_log <path>
+--watch <path> ...] -- '<command line>'
+"""
+
+import argparse
+import errno
+import fcntl
+import json
+import os
+import re
+import select
+import signal
+import socket
+import stat
+import sys
+import time
+
+
+# Characters separating possible file paths from each other in a command line
+PATH_SEPARATORS = re.compile(r'[\s<>|;&()=,\'"]+')
+
+# Exit code of commands killed by the stall watchdog (as with timeout(1))
+STALL_EXIT_CODE = 124
+
+# Maximum interval (s) between the progress checks of the stall watchdog
+STALL_POLL_SECONDS = 30
+
+# Seconds a stalled command is given to exit after SIGTERM before SIGKILL
+STALL_KILL_GRACE = 30
+
+# Bytes relayed at a time from the output streams of the command
+RELAY_CHUNK = 65536
+
+# Environment variables containing the job ID of the resource managers
+JOB_ID_VARIABLES = ['SLURM_JOB_ID', 'LSB_JOBID', 'PBS_JOBID', 'JOB_ID']
+
+
+def parse_arguments(args):
+    """Parses the launcher command line.
+
+    Parameters:
+    args: List of command line arguments.
+
+    Returns:
+    Namespace containing the parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='STAPLER command launcher')
+    parser.add_argument('--telemetry', default=None)
+    parser.add_argument('--workload', default='')
+    parser.add_argument('--task', default='')
+    parser.add_argument('--tool', default='')
+    parser.add_argument('--ids', default='')
+    parser.add_argument('--id_bytes', type=int, default=None)
+    parser.add_argument('--stall_timeout', type=float, default=None)
+    parser.add_argument('--stall_log', default=None)
+    parser.add_argument('--watch', action='append', default=[])
+    parser.add_argument('command')
+    return parser.parse_args(args)
+
+
+def stat_command_files(command):
+    """Returns size and modification time of existing files on a command line.
+
+    Parameters:
+    command: Command line string.
+
+    Returns:
+    Dict of path:(size, mtime) for every token that is an existing file.
+    """
+    files = {}
+    for token in PATH_SEPARATORS.split(command):
+        if not token or token.startswith('-') or token in files:
+            continue
+        try:
+            if os.path.isfile(token):
+                st = os.stat(token)
+                files[token] = (st.st_size, st.st_mtime)
+        except OSError:
+            continue
+    return files
+
+
+def progress_state(watched_paths, relays):
+    """Returns a snapshot of the progress of the running command.
+
+    Progress is measured by the sizes of the output and error streams of the
+    launcher (the .out and .err files of the job) or the bytes relayed into
+    them, the sizes of the watched files and the modification times of the
+    watched directories.
+
+    Parameters:
+    watched_paths: Paths to output files or directories of the command.
+    relays: Dict of relayed stream fd:[pipe fd, relayed bytes].
+
+    Returns:
+    Tuple that changes whenever the command makes progress.
+    """
+    state = []
+    for fd in (1, 2):
+        if fd in relays:
+            state.append(relays[fd][1])
+            continue
+        try:
+            state.append(os.fstat(fd).st_size)
+        except OSError:
+            state.append(None)
+    for path in watched_paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            state.append(None)
+            continue
+        if os.path.isdir(path):
+            state.append(st.st_mtime)
+        else:
+            state.append(st.st_size)
+    return tuple(state)
+
+
+def unmeasurable_streams():
+    """Returns the output streams of the launcher that are not regular files.
+
+    The size of a pipe or a terminal does not grow with the output written
+    into it, so the output of the command has to be relayed through the
+    launcher for the watchdog to see it.
+
+    Returns:
+    List of file descriptors.
+    """
+    streams = []
+    for fd in (1, 2):
+        try:
+            if stat.S_ISREG(os.fstat(fd).st_mode):
+                continue
+        except OSError:
+            continue
+        streams.append(fd)
+    return streams
+
+
+def relay_output(relays, seconds):
+    """Copies the output of the command into the launcher's own streams.
+
+    Returns after the given number of seconds, or at once when all pipes
+    have been closed and seconds is 0.
+
+    Parameters:
+    relays: Dict of relayed stream fd:[pipe fd, relayed bytes]. Pipes closed
+    by the command are closed and their pipe fd is set to None.
+    seconds: Seconds to relay the output for.
+    """
+    deadline = time.time() + seconds
+    while True:
+        pipes = dict((r[0], fd) for fd, r in relays.items() if r[0] is not None)
+        remaining = max(0.0, deadline - time.time())
+        if not pipes:
+            time.sleep(remaining)
+            return
+        try:
+            readable = select.select(list(pipes), [], [], remaining)[0]
+        except (select.error, OSError) as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            continue
+        if not readable:
+            return
+        for pipe_fd in readable:
+            fd = pipes[pipe_fd]
+            data = os.read(pipe_fd, RELAY_CHUNK)
+            if not data:
+                os.close(pipe_fd)
+                relays[fd][0] = None
+                continue
+            relays[fd][1] += len(data)
+            try:
+                while data:
+                    data = data[os.write(fd, data):]
+            except OSError:
+                # The reader has gone away, the output is dropped
+                pass
+
+
+def run_command(command, stall_timeout=None, watched_paths=()):
+    """Executes the command with bash and waits for it to finish.
+
+    SIGTERM and SIGINT received by the launcher are forwarded to the command,
+    so that resource managers can still stop the job normally. With a stall
+    timeout, output streams that are not regular files are relayed through
+    the launcher (see relay_output).
+
+    Parameters:
+    command: Command line string.
+    stall_timeout: Seconds without progress (see progress_state) after which
+    the command is killed. The command is never killed if this is None.
+    watched_paths: Paths to output files or directories of the command.
+
+    Returns:
+    exit_code: Exit code of the command (128 + signal number if the command
+    was killed by a signal).
+    rusage: Resource usage of the command and all of its children.
+    stalled_s: Seconds without progress if the command was killed by the
+    watchdog, otherwise None.
+    """
+    relays = {}
+    if stall_timeout is not None:
+        for fd in unmeasurable_streams():
+            relays[fd] = list(os.pipe()) + [0]
+    pid = os.fork()
+    if pid == 0:
+        try:
+            for fd, (read_fd, write_fd, _) in relays.items():
+                os.dup2(write_fd, fd)
+                os.close(read_fd)
+                os.close(write_fd)
+            # Run the command in a process group of its own, so that all
+            # processes of a pipeline can be killed if the command stalls
+            os.setpgid(0, 0)
+            os.execvp('bash', ['bash', '-c', command])
+        finally:
+            os._exit(127)
+    for fd, (read_fd, write_fd, _) in relays.items():
+        os.close(write_fd)
+        relays[fd] = [read_fd, 0]
+
+    def forward_signal(signum, frame):
+        try:
+            os.killpg(pid, signum)
+        except OSError:
+            pass
+    signal.signal(signal.SIGTERM, forward_signal)
+    signal.signal(signal.SIGINT, forward_signal)
+
+    stalled_s = None
+    kill_time = None
+    if stall_timeout is not None:
+        poll_interval = max(1.0, min(STALL_POLL_SECONDS, stall_timeout / 10.0))
+        state = progress_state(watched_paths, relays)
+        last_progress = time.time()
+    while True:
+        try:
+            if stall_timeout is None:
+                _, status, rusage = os.wait4(pid, 0)
+                break
+            finished_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if finished_pid == pid:
+                break
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
+            continue
+        relay_output(relays, poll_interval if stalled_s is None else 1)
+        if stalled_s is not None:
+            # The stalled command is killed if it ignores SIGTERM
+            if time.time() >= kill_time:
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            continue
+        new_state = progress_state(watched_paths, relays)
+        if new_state != state:
+            state = new_state
+            last_progress = time.time()
+        elif time.time() - last_progress >= stall_timeout:
+            stalled_s = time.time() - last_progress
+            kill_time = time.time() + STALL_KILL_GRACE
+            try:
+                os.killpg(pid, signal.SIGTERM)
+            except OSError:
+                pass
+    # Output left in the pipes when the command finished. Pipes kept open by
+    # processes left running in the background are not waited for.
+    relay_output(relays, 0)
+    for r in relays.values():
+        if r[0] is not None:
+            os.close(r[0])
+    if stalled_s is not None:
+        exit_code = STALL_EXIT_CODE
+    elif os.WIFSIGNALED(status):
+        exit_code = 128 + os.WTERMSIG(status)
+    else:
+        exit_code = os.WEXITSTATUS(status)
+    return exit_code, rusage, stalled_s
+
+
+def write_record(path, record):
+    """Appends a JSON record into the telemetry file.
+
+    Array tasks of the same workload share the telemetry file, so the file is
+    locked for the duration of the write.
+
+    Parameters:
+    path: Path to the telemetry file.
+    record: Dict to write.
+    """
+    handle = open(path, 'a')
+    try:
+        fcntl.lockf(handle, fcntl.LOCK_EX)
+        handle.write(json.dumps(record, sort_keys=True) + '\n')
+        handle.flush()
+        fcntl.lockf(handle, fcntl.LOCK_UN)
+    finally:
+        handle.close()
+
+
+def main(args):
+    params = parse_arguments(args)
+    files_before = stat_command_files(params.command)
+    start = time.time()
+    exit_code, rusage, stalled_s = run_command(params.command,
+                                               params.stall_timeout,
+                                               params.watch)
+    end = time.time()
+    files_after = stat_command_files(params.command)
+
+    # Files existing before the run and left untouched by it are considered
+    # inputs, new or modified files are considered outputs.
+    in_bytes = 0
+    out_bytes = 0
+    for path, stats in files_after.items():
+        if files_before.get(path) == stats:
+            in_bytes += stats[0]
+        else:
+            out_bytes += stats[0]
+
+    record = {'workload': params.workload,
+              'task': params.task,
+              'tool': params.tool,
+              'ids': [i for i in params.ids.split(',') if i],
+              'host': socket.gethostname(),
+              'start': round(start, 3),
+              'end': round(end, 3),
+              'wall_s': round(end - start, 3),
+              'user_s': round(rusage.ru_utime, 3),
+              'sys_s': round(rusage.ru_stime, 3),
+              'max_rss_kb': rusage.ru_maxrss,
+              'read_bytes': rusage.ru_inblock * 512,
+              'write_bytes': rusage.ru_oublock * 512,
+              'in_bytes': in_bytes,
+              'out_bytes': out_bytes,
+              'exit_code': exit_code}
+    if params.id_bytes is not None:
+        record['id_bytes'] = params.id_bytes
+    if stalled_s is not None:
+        record['stalled_s'] = round(stalled_s, 3)
+        sys.stderr.write('STAPLER watchdog: the command was killed as its '
+                         'output did not grow in {0:.0f} s (exit code {1}).\n'
+                         .format(stalled_s, STALL_EXIT_CODE))
+        sys.stderr.flush()
+        if params.stall_log is not None:
+            stall_record = dict(record)
+            stall_record['command'] = params.command
+            stall_record['job'] = ''
+            for variable in JOB_ID_VARIABLES:
+                if os.environ.get(variable):
+                    stall_record['job'] = os.environ[variable]
+                    break
+            try:
+                write_record(params.stall_log, stall_record)
+            except (IOError, OSError) as err:
+                sys.stderr.write('STAPLER launcher: unable to write stall log '
+                                 'to {0}: {1}\n'.format(params.stall_log, err))
+    if params.telemetry is not None:
+        try:
+            write_record(params.telemetry, record)
+        except (IOError, OSError) as err:
+            sys.stderr.write('STAPLER launcher: unable to write telemetry to '
+                             '{0}: {1}\n'.format(params.telemetry, err))
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,162 @@
+"""Compression of the output files tools write through a pipe.
+
+Tools which can not compress their output, or compress it with a single
+thread only, pipe their output to the output compressor selected with the
+--output_compressor parameter of STAPLER (bgzip by default). The compressor
+uses all cores allocated to the job by the resource manager. The number of
+cores is read from the environment of the job when the command is run, so a
+single thread is used when no resource manager is used.
+
+Output types which are indexed downstream (.vcf) are always written in the
+BGZF format with bgzip, whatever compressor is selected. BGZF files can be
+indexed with tabix and are still readable with gzip.
+"""
+
+from GenericBase import GenericBase
+from STAPLERerror import NotConfiguredError
+from STAPLERerror import STAPLERerror
+import scatter
+import utils
+
+
+# Compressors available for the output files: config.txt tool name, thread
+# count argument and file extension of the compressed files
+OUTPUT_COMPRESSORS = {'bgzip': ('stapler_bgzip', '-@', '.gz'),
+                      'gzip': ('stapler_gzip', None, '.gz'),
+                      'pigz': ('stapler_pigz', '-p', '.gz'),
+                      'zstd': ('stapler_zstd', '-T', '.zst')}
+
+DEFAULT_OUTPUT_COMPRESSOR = 'bgzip'
+
+# Output types that are compressed into BGZF for indexing
+BGZF_COMPRESSOR = 'bgzip'
+BGZF_OUTPUT_TYPES = set(['.vcf'])
+
+# Number of cores allocated to the task by the task dispatcher of packed jobs
+# or to the job by SLURM, SGE, LSF or Torque. The value is evaluated by the
+# shell when the command is run.
+ALLOCATED_THREADS = ('${STAPLER_TASK_THREADS:-${SLURM_CPUS_PER_TASK:-${NSLOTS:-'
+                     '${LSB_DJOB_NUMPROC:-${PBS_NUM_PPN:-1}}}}}')
+
+_output_compressor = DEFAULT_OUTPUT_COMPRESSOR
+
+
+def set_output_compressor(compressor):
+    """Selects the compressor used for the compressed output files.
+
+    Parameters:
+    compressor: Key of OUTPUT_COMPRESSORS.
+
+    Raises:
+    STAPLERerror: Unknown compressor.
+    """
+    global _output_compressor
+    if compressor not in OUTPUT_COMPRESSORS:
+        raise STAPLERerror('--output_compressor requires one of the following '
+                           'values: {0}'.format(', '.join(sorted(OUTPUT_COMPRESSORS))))
+    _output_compressor = compressor
+
+
+def output_compressor(uncompressed_type):
+    """Returns the compressor used for an output type.
+
+    Parameters:
+    uncompressed_type: File extension of the output without compression,
+    e.g. .vcf
+
+    Returns:
+    Key of OUTPUT_COMPRESSORS.
+    """
+    if uncompressed_type in BGZF_OUTPUT_TYPES:
+        return BGZF_COMPRESSOR
+    return _output_compressor
+
+
+def compressed_extension(uncompressed_type):
+    """Returns the compression extension added to an output type, e.g. .gz"""
+    return OUTPUT_COMPRESSORS[output_compressor(uncompressed_type)][2]
+
+
+def compressor_command(output_path):
+    """Returns a command compressing stdin into the output file.
+
+    Parameters:
+    output_path: Path of the compressed output file.
+
+    Returns:
+    Command line string.
+
+    Raises:
+    STAPLERerror: The compressor is not configured in config.txt.
+    """
+    tool_name, thread_arg = OUTPUT_COMPRESSORS[
+        output_compressor(utils.uncompressed_extension(output_path))][:2]
+    try:
+        final_cmd = [utils.parse_config(tool_name, 'cmd_name', 'execute')]
+    except NotConfiguredError:
+        raise STAPLERerror('Compressed output files are written with {0}, '
+                           'but config.txt is missing configuration for this '
+                           'command. Edit config.txt appropriately or select '
+                           'another compressor with --output_compressor.'
+                           .format(tool_name))
+    if thread_arg is not None:
+        final_cmd += [thread_arg, ALLOCATED_THREADS]
+    final_cmd += ['-c', '>', output_path]
+    return ' '.join(final_cmd)
+
+
+class CompressedOutput():
+    """Mixin for tools piping their compressed output to the output
+    compressor.
+
+    Attributes:
+    compress_output_arg: Parameter requesting compressed output.
+    compressed_output_path_arg: Argument of the output file.
+    """
+
+    compress_output_arg = None
+    compressed_output_path_arg = None
+
+    def __init__(self, in_cmd, in_dir, out_dir):
+        GenericBase.__init__(self, in_cmd, in_dir, out_dir)
+        if self.compress_output():
+            tool_name = OUTPUT_COMPRESSORS[output_compressor(
+                utils.uncompressed_extension(self._compressed_output_path()))][0]
+            for module in utils.parse_module(tool_name, 'cmd_name', 'load_module'):
+                if module not in self.load_module:
+                    self.load_module.append(module)
+            for module in utils.parse_module(tool_name, 'cmd_name', 'unload_module'):
+                if module not in self.unload_module:
+                    self.unload_module.append(module)
+
+    def compress_output(self):
+        """Returns True if the user has requested compressed output."""
+        return self.compress_output_arg in self.parsed_in_cmd
+
+    def _compressed_output_path(self):
+        return scatter.single_value(self.out_cmd[self.compressed_output_path_arg])
+
+    def _output_redirection(self):
+        """Returns the end of the command line writing the output file."""
+        if not self.compress_output():
+            return '> ' + self._compressed_output_path()
+        return '| ' + compressor_command(self._compressed_output_path())
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        The output file argument is replaced with a pipe to the output
+        compressor if compressed output is requested.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        if not self.compress_output():
+            return GenericBase.get_cmd(self)
+        final_cmd = [self.run_command]
+        for arg, val in self.out_cmd.iteritems():
+            if arg in (self.compress_output_arg, self.compressed_output_path_arg):
+                continue
+            final_cmd.append(arg + ' ' + val)
+        final_cmd.append(self._output_redirection())
+        return [' '.join(final_cmd)]
@@ -33,7 +33,9 @@ class psmc_fq2psmcfa(GenericBase):
     """
 
     name = 'stapler_psmc_fq2psmcfa'
-    input_types = set(['.fq', '.fq.gz'])
+    input_types = set(['.fq'])
+    compressed_input_types = input_types
+    native_compressions = set(['.gz'])
     output_types = ['.psmcfa']
     hidden_mandatory_args = ['-!i', '->']
     user_mandatory_args = []
@@ -67,7 +69,7 @@ This utility script is part of psmc software (.../psmc/utils/fq2psmcfa).
         file_names = set()
         for fl in in_dir.files:
             if self.name not in fl.users:
-                if utils.splitext(fl.name)[-1] in self.input_types:
+                if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                     IO_files['-!i'] = os.path.join(in_dir.path, fl.name)
                     command_ids = [utils.infer_path_id(IO_files['-!i'])]
                     in_dir.use_file(fl.name, self.name)
@@ -170,7 +172,7 @@ history2ms tools can then be used to further work with the outputs.
         file_names = set()
         for fl in in_dir.files:
             if self.name not in fl.users:
-                if utils.splitext(fl.name)[-1] in self.input_types:
+                if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                     IO_files['-!i'] = os.path.join(in_dir.path, fl.name)
                     command_ids = [utils.infer_path_id(IO_files['-!i'])]
                     in_dir.use_file(fl.name, self.name)
@@ -266,7 +268,7 @@ This utility script is part of psmc software (.../psmc/utils/psmc_plot.pl).
         file_names = set()
         for fl in in_dir.files:
             if self.name not in fl.users:
-                if utils.splitext(fl.name)[-1] in self.input_types:
+                if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                     IO_files['-!i'] = os.path.join(in_dir.path, fl.name)
                     command_ids = [utils.infer_path_id(IO_files['-!i'])]
                     in_dir.use_file(fl.name, self.name)
@@ -364,7 +366,7 @@ This utility script is part of psmc software (.../psmc/utils/psmc2history.pl).
         file_names = set()
         for fl in in_dir.files:
             if self.name not in fl.users:
-                if utils.splitext(fl.name)[-1] in self.input_types:
+                if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                     IO_files['-!i'] = os.path.join(in_dir.path, fl.name)
                     command_ids = [utils.infer_path_id(IO_files['-!i'])]
                     in_dir.use_file(fl.name, self.name)
@@ -462,7 +464,7 @@ This utility script is part of psmc software (.../psmc/utils/history2ms.pl).
         file_names = set()
         for fl in in_dir.files:
             if self.name not in fl.users:
-                if utils.splitext(fl.name)[-1] in self.input_types:
+                if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                     IO_files['-!i'] = os.path.join(in_dir.path, fl.name)
                     command_ids = [utils.infer_path_id(IO_files['-!i'])]
                     in_dir.use_file(fl.name, self.name)
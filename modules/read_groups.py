@@ -0,0 +1,136 @@
+"""Read group assignment by aligners.
+
+Aligners accepting the --!RG* parameters write the read group into the
+alignments directly, which makes a separate Picard AddOrReplaceReadGroups
+step (and the extra pass over every alignment file it requires)
+unnecessary. The parameters have the same names and values as the
+parameters of stapler_Picard_AddOrReplaceReadGroups, so the same $VALUE_TABLE
+definitions can be used with both.
+"""
+
+import pipes
+
+from GenericBase import GenericBase
+from STAPLERerror import STAPLERerror
+
+
+# STAPLER parameters and the corresponding SAM @RG tags in the output order
+READ_GROUP_ARGS = [('--!RGID', 'ID'),
+                   ('--!RGSM', 'SM'),
+                   ('--!RGLB', 'LB'),
+                   ('--!RGPL', 'PL'),
+                   ('--!RGPU', 'PU'),
+                   ('--!RGCN', 'CN'),
+                   ('--!RGDS', 'DS'),
+                   ('--!RGDT', 'DT'),
+                   ('--!RGPI', 'PI')]
+
+# Picard uses the same read group ID when RGID is not defined
+DEFAULT_READ_GROUP_ID = '1'
+
+class ReadGroupAssigner():
+    """Mixin for aligners writing the read group given with --!RG* parameters.
+
+    Attributes:
+    read_group_conflicting_args: Read group arguments of the tool itself, which
+    can not be used together with the --!RG* parameters.
+    read_group_arg: Argument taking the @RG header line of the read group.
+    read_group: List of (tag, value) tuples of the read group, None if no
+    --!RG* parameters were given.
+    """
+
+    read_group_conflicting_args = []
+    read_group_arg = None
+    read_group = None
+
+    def _set_read_group(self, out_cmd, read_group):
+        """Adds the @RG header line of the read group to the command line with
+        read_group_arg.
+
+        Raises:
+        STAPLERerror: The tool does not define read_group_arg.
+        """
+        if self.read_group_arg is None:
+            raise STAPLERerror('The --!RG* parameters are not supported by {0}.'
+                               .format(self.name))
+        out_cmd[self.read_group_arg] = sam_header_line(read_group)
+
+    def _remove_user_arguments(self, out_cmd):
+        """Removes the specified arguments from final command line and
+        replaces the --!RG* parameters with the read group arguments of the
+        tool.
+
+        Parameters:
+        out_cmd: Dict containing the output commands
+
+        Returns:
+        Output commands
+
+        Raises:
+        STAPLERerror: Invalid read group parameters.
+        """
+        read_group = []
+        for arg, tag in READ_GROUP_ARGS:
+            if arg not in out_cmd:
+                continue
+            value = out_cmd.pop(arg)
+            if not value:
+                raise STAPLERerror('{0} parameter of {1} requires a value.'
+                                   .format(arg, self.name))
+            read_group.append((tag, value))
+        out_cmd = GenericBase._remove_user_arguments(self, out_cmd)
+        if not read_group:
+            return out_cmd
+
+        for arg in self.read_group_conflicting_args:
+            if arg in out_cmd:
+                raise STAPLERerror('{0} parameter of {1} can not be used '
+                                   'together with the --!RG* parameters.'
+                                   .format(arg, self.name))
+        if read_group[0][0] != 'ID':
+            read_group.insert(0, ('ID', DEFAULT_READ_GROUP_ID))
+        self.read_group = read_group
+        self._set_read_group(out_cmd, read_group)
+        return out_cmd
+
+
+def sam_header_line(read_group):
+    """Returns the @RG header line of a read group, tabs written as \\t.
+
+    Parameters:
+    read_group: List of (tag, value) tuples.
+
+    Returns:
+    Shell quoted header line.
+    """
+    return pipes.quote('\\t'.join(['@RG'] + ['{0}:{1}'.format(tag, value)
+                                            for tag, value in read_group]))
+
+
+def find_redundant_read_group_steps(workflows):
+    """Finds AddOrReplaceReadGroups steps following aligners that assign the
+    read groups already.
+
+    Parameters:
+    workflows: List of workflow parts, each a list of steps, each a list of
+    command objects.
+
+    Returns:
+    List of names of the aligners whose read groups a later
+    AddOrReplaceReadGroups step replaces.
+    """
+    redundant = []
+    assigning_tool = None
+    for workflow in workflows:
+        for step in workflow:
+            if not step:
+                continue
+            if isinstance(step[0], ReadGroupAssigner):
+                if all(cmd.read_group is not None for cmd in step):
+                    assigning_tool = step[0].name
+                else:
+                    assigning_tool = None
+            elif step[0].name == 'stapler_Picard_AddOrReplaceReadGroups':
+                if assigning_tool is not None:
+                    redundant.append(assigning_tool)
+    return redundant
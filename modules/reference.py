@@ -0,0 +1,381 @@
+"""Preparation of the reference genome indexes used by the workflow.
+
+Tools taking a reference genome declare the indexes they need with the
+reference_indexes attribute, a dict of argument:list of index types (keys of
+INDEX_TYPES). Before the workflow is written, the reference of each such
+argument is checked for missing index files. Each missing index is built once
+in a workflow part of its own, which is run before the rest of the workflow.
+
+The indexes are built into a reference cache directory shared by all
+projects. The cache is keyed by the MD5 digest of the reference file
+contents, so the same genome is indexed only once, whatever its path or file
+name is. The built index files are linked next to the reference file, where
+the tools expect to find them.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import pipes
+
+from GenericBase import GenericBase
+from STAPLERerror import STAPLERerror
+import scatter
+import utils
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(utils.CONFIG_FILE_PATH),
+                                 'reference_cache')
+
+# Digests of the reference files are stored here to avoid reading the files
+# on each run
+DIGEST_FILE_NAME = 'digests.json'
+
+# Name of the reference file link in each cache directory
+CACHED_REFERENCE_NAME = 'genome.fa'
+
+# Marker file written after an index has been built successfully
+DONE_MARKER_NAME = '.done'
+
+HASH_BLOCK_SIZE = 1 << 24
+
+
+def read_digests(digest_file_path):
+    """Returns the stored reference digests, an empty dict if there are none.
+    """
+    if not os.path.isfile(digest_file_path):
+        return {}
+    try:
+        with open(digest_file_path) as handle:
+            return json.load(handle)
+    except (IOError, ValueError):
+        return {}
+
+
+def reference_digest(reference_path, cache_dir):
+    """Returns the MD5 digest of the contents of a reference file.
+
+    The digests are stored into the cache directory by the path, size and
+    modification time of the files, so each file is read only once. The cache
+    is shared by concurrent runs, so the digest file is updated holding a lock
+    and replaced atomically.
+
+    Parameters:
+    reference_path: Path to the reference file.
+    cache_dir: Reference cache directory.
+
+    Returns:
+    Hexadecimal digest string.
+
+    Raises:
+    STAPLERerror: The reference file can not be read or the digest file can
+    not be written.
+    """
+    digest_file_path = os.path.join(cache_dir, DIGEST_FILE_NAME)
+    reference_path = os.path.realpath(reference_path)
+    stat = os.stat(reference_path)
+    key = '{0}:{1}:{2}'.format(reference_path, stat.st_size,
+                               int(stat.st_mtime))
+    digests = read_digests(digest_file_path)
+    if key in digests:
+        return digests[key]
+
+    md5 = hashlib.md5()
+    try:
+        with open(reference_path, 'rb') as handle:
+            while True:
+                block = handle.read(HASH_BLOCK_SIZE)
+                if not block:
+                    break
+                md5.update(block)
+    except IOError as err:
+        raise STAPLERerror('Unable to read the reference file {0}:\n{1}'
+                           .format(reference_path, err))
+    try:
+        with open(digest_file_path + '.lock', 'a') as lock:
+            fcntl.lockf(lock, fcntl.LOCK_EX)
+            # Digests added by other runs while this file was read
+            digests = read_digests(digest_file_path)
+            digests[key] = md5.hexdigest()
+            with open(digest_file_path + '.tmp', 'w') as handle:
+                json.dump(digests, handle, indent=1, sort_keys=True)
+            os.rename(digest_file_path + '.tmp', digest_file_path)
+    except (IOError, OSError) as err:
+        raise STAPLERerror('Unable to write the reference digest file {0}:\n'
+                           '{1}\nCheck that the reference cache directory is '
+                           'writable or define another one with '
+                           '--reference_cache.'.format(digest_file_path, err))
+    return digests[key]
+
+
+class ReferenceIndex(GenericBase):
+    """Superclass for commands building a reference index into the cache.
+
+    Index commands are not defined by the user in the staplefile, but are
+    created automatically for the references missing indexes.
+
+    Parameters:
+    reference_path: Path to the reference fasta file.
+    cache_dir: Reference cache directory.
+    digest: Digest of the reference file contents.
+
+    Attributes:
+    index_suffixes: Suffixes added to the reference path to get the index
+    file paths.
+    index_dir_name: Name of the cache subdirectory of the index.
+    in_dir, out_dir: None, index commands have no input or output directory.
+
+    Raises:
+    STAPLERerror: The subclass does not define index_dir_name.
+    """
+
+    name = 'ReferenceIndex'
+    index_suffixes = []
+    index_dir_name = None
+    in_dir = None
+    out_dir = None
+    help_description = '''
+This tool cannot be used by the end user.
+'''
+
+    def __init__(self, reference_path, cache_dir, digest):
+        if self.index_dir_name is None:
+            raise STAPLERerror('{0} does not define the cache directory of its '
+                               'index.'.format(self.name))
+        self.in_cmd = ''
+        self.parsed_in_cmd = {}
+        self.out_cmd = {}
+        self.reference_path = os.path.abspath(reference_path)
+        self.index_dir = os.path.join(cache_dir, digest, self.index_dir_name)
+        self.command_ids = ['{0}_{1}'.format(self.index_dir_name, digest[:12])]
+        self.run_command = self.run_command_config()
+        self.load_module = self.load_module_config()
+        self.unload_module = self.unload_module_config()
+        self.command_lines = self.get_cmd()
+
+    @classmethod
+    def reference_path_of(cls, value):
+        """Returns the reference path of a tool argument value, None if the
+        value does not name a reference file."""
+        return value
+
+    @classmethod
+    def index_paths(cls, reference_path):
+        """Returns the paths of the index files of a reference."""
+        return [reference_path + suffix for suffix in cls.index_suffixes]
+
+    @classmethod
+    def is_missing(cls, reference_path):
+        """Returns True if any of the index files of a reference is missing."""
+        return not all(os.path.exists(p) for p in cls.index_paths(reference_path))
+
+    def build_cmd(self):
+        """Returns the command building the index of CACHED_REFERENCE_NAME in
+        the current directory. By default the reference is given to the tool
+        as the only argument."""
+        return '{0} {1}'.format(self.run_command, CACHED_REFERENCE_NAME)
+
+    def link_cmd(self):
+        """Returns the command linking the built index files next to the
+        reference file."""
+        cached_prefix = os.path.join(self.index_dir, CACHED_REFERENCE_NAME)
+        return ('for f in {0}.*; do ln -sfn "$f" {1}"${{f#{0}}}"; done'
+                .format(pipes.quote(cached_prefix),
+                        pipes.quote(self.reference_path)))
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        The index is built while holding a lock, so concurrent workflows
+        needing the same index wait for the first one to finish it.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        index_dir = pipes.quote(self.index_dir)
+        done_path = pipes.quote(os.path.join(self.index_dir, DONE_MARKER_NAME))
+        build = ('test -e {0} || {{ rm -rf {1} && mkdir -p {1} && ln -s {2} '
+                 '{3} && cd {1} && {4} && touch {0}; }}'.format(
+                     done_path,
+                     index_dir,
+                     pipes.quote(os.path.realpath(self.reference_path)),
+                     pipes.quote(os.path.join(self.index_dir,
+                                              CACHED_REFERENCE_NAME)),
+                     self.build_cmd()))
+        return ['mkdir -p ' + pipes.quote(os.path.dirname(self.index_dir)),
+                utils.locked_command(self.index_dir + '.lock', build),
+                self.link_cmd()]
+
+
+class bwa_index(ReferenceIndex):
+    """Builds the bwa index of a reference."""
+
+    name = 'stapler_bwa_index'
+    index_suffixes = ['.amb', '.ann', '.bwt', '.pac', '.sa']
+    index_dir_name = 'bwa'
+
+
+class bowtie2_build(ReferenceIndex):
+    """Builds the bowtie2 index of a reference.
+
+    The index prefix is the path of the reference file. Large genomes get
+    .bt2l index files instead of .bt2 files.
+    """
+
+    name = 'stapler_bowtie2_build'
+    index_suffixes = ['.1.bt2', '.2.bt2', '.3.bt2', '.4.bt2', '.rev.1.bt2',
+                      '.rev.2.bt2']
+    index_dir_name = 'bowtie2'
+
+    @classmethod
+    def is_missing(cls, reference_path):
+        """Returns True if neither a small nor a large index exists."""
+        return not (all(os.path.exists(p) for p in cls.index_paths(reference_path)) or
+                    all(os.path.exists(p + 'l') for p in cls.index_paths(reference_path)))
+
+    def build_cmd(self):
+        return '{0} {1} {1}'.format(self.run_command, CACHED_REFERENCE_NAME)
+
+
+class samtools_faidx(ReferenceIndex):
+    """Builds the .fai index of a reference."""
+
+    name = 'stapler_samtools_faidx'
+    index_suffixes = ['.fai']
+    index_dir_name = 'faidx'
+
+
+class CreateSequenceDictionary(ReferenceIndex):
+    """Builds the sequence dictionary (.dict) of a reference.
+
+    The dictionary replaces the file extension of the reference instead of
+    being appended to it.
+    """
+
+    name = 'stapler_gatk_CreateSequenceDictionary'
+    index_dir_name = 'dict'
+
+    @classmethod
+    def index_paths(cls, reference_path):
+        return [os.path.splitext(reference_path)[0] + '.dict']
+
+    def build_cmd(self):
+        return '{0} -R {1} -O {2}'.format(
+            self.run_command,
+            CACHED_REFERENCE_NAME,
+            os.path.splitext(CACHED_REFERENCE_NAME)[0] + '.dict')
+
+    def link_cmd(self):
+        cached_path = os.path.join(self.index_dir,
+                                   os.path.splitext(CACHED_REFERENCE_NAME)[0] +
+                                   '.dict')
+        return 'ln -sfn {0} {1}'.format(
+            pipes.quote(cached_path),
+            pipes.quote(self.index_paths(self.reference_path)[0]))
+
+
+class soap2_builder(ReferenceIndex):
+    """Builds the soap2 index (2bwt-builder) of a reference.
+
+    soap2 is given the index prefix <reference>.index with -D.
+    """
+
+    name = 'stapler_soap2_builder'
+    index_suffixes = ['.index.amb', '.index.ann', '.index.bwt', '.index.fmv',
+                      '.index.hot', '.index.lkt', '.index.pac',
+                      '.index.rev.bwt', '.index.rev.fmv', '.index.rev.lkt',
+                      '.index.rev.pac', '.index.sa', '.index.sai']
+    index_dir_name = 'soap2'
+
+    @classmethod
+    def reference_path_of(cls, value):
+        if not value.endswith('.index'):
+            return None
+        return value[:-len('.index')]
+
+    def build_cmd(self):
+        return '{0} {1}'.format(self.run_command, CACHED_REFERENCE_NAME)
+
+
+# Index types available for the reference_indexes attribute of tools
+INDEX_TYPES = {'bwa': bwa_index,
+               'bowtie2': bowtie2_build,
+               'faidx': samtools_faidx,
+               'dict': CreateSequenceDictionary,
+               'soap2': soap2_builder}
+
+
+def missing_indexes(workflows):
+    """Finds the references with missing index files.
+
+    Parameters:
+    workflows: List of workflow parts, each a list of steps, each a list of
+    command objects.
+
+    Returns:
+    List of (index command class, reference path) tuples in the order the
+    references appear in the workflow.
+    """
+    missing = []
+    for workflow in workflows:
+        for step in workflow:
+            for cmd in step:
+                reference_indexes = getattr(cmd, 'reference_indexes', {})
+                out_cmd = getattr(cmd, 'out_cmd', {})
+                for arg, index_types in sorted(reference_indexes.iteritems()):
+                    if arg not in out_cmd:
+                        continue
+                    for index_type in index_types:
+                        index_class = INDEX_TYPES[index_type]
+                        reference_path = index_class.reference_path_of(
+                            scatter.single_value(out_cmd[arg]))
+                        # Index prefixes which are not reference files can not
+                        # be built
+                        if reference_path is None or \
+                                not os.path.isfile(reference_path):
+                            continue
+                        reference_path = os.path.abspath(reference_path)
+                        if (index_class, reference_path) in missing:
+                            continue
+                        if index_class.is_missing(reference_path):
+                            missing.append((index_class, reference_path))
+    return missing
+
+
+def index_commands(workflows, cache_dir):
+    """Creates the commands building the missing reference indexes.
+
+    Parameters:
+    workflows: List of workflow parts, each a list of steps, each a list of
+    command objects.
+    cache_dir: Reference cache directory.
+
+    Returns:
+    List of index command objects, which can be run in parallel.
+
+    Raises:
+    STAPLERerror: The cache directory can not be created or the index files
+    can not be linked next to the reference.
+    """
+    missing = missing_indexes(workflows)
+    if not missing:
+        return []
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError as err:
+            raise STAPLERerror('Unable to create the reference cache '
+                               'directory {0}:\n{1}'.format(cache_dir, err))
+    commands = []
+    for index_class, reference_path in missing:
+        if not os.access(os.path.dirname(reference_path), os.W_OK):
+            raise STAPLERerror('The {0} index of the reference {1} is missing, '
+                               'but the index files can not be linked to its '
+                               'directory, which is not writable. Build the '
+                               'index manually or copy the reference into a '
+                               'writable directory.'.format(
+                                   index_class.index_dir_name, reference_path))
+        commands.append(index_class(reference_path, cache_dir,
+                                    reference_digest(reference_path, cache_dir)))
+    return commands
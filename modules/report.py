@@ -0,0 +1,434 @@
+"""Functions for analyzing the runtime of a finished workflow."""
+
+import json
+import os
+import re
+import time
+
+from STAPLERerror import STAPLERerror
+
+
+# Patterns for inferring the workload and task of a resource manager log file
+LOG_NAME_PATTERNS = [re.compile(r'WORKLOAD_(\d+)_subshell_(\d+)'),
+                     re.compile(r'_(\d+)_(\d+)\.out$'),
+                     re.compile(r'()_(\d+)\.out$')]
+
+
+def read_telemetry(output_dir):
+    """Reads all telemetry records written by the command launcher.
+
+    Parameters:
+    output_dir: Path to the batch script directory of the workflow.
+
+    Returns:
+    records: List of telemetry record dicts.
+
+    Raises:
+    STAPLERerror: A telemetry file can not be read.
+    """
+    records = []
+    for file_name in sorted(os.listdir(output_dir)):
+        if '_telemetry' not in file_name or not file_name.endswith('.jsonl'):
+            continue
+        records += read_telemetry_file(os.path.join(output_dir, file_name))
+    return records
+
+
+def read_telemetry_file(path):
+    """Reads the telemetry records of a single telemetry file.
+
+    Parameters:
+    path: Path to a telemetry file.
+
+    Returns:
+    records: List of telemetry record dicts.
+
+    Raises:
+    STAPLERerror: The file can not be read.
+    """
+    records = []
+    try:
+        handle = open(path)
+    except IOError as err:
+        raise STAPLERerror('Unable to open telemetry file:\n{0}\nReason:'
+                           '\n{1}'.format(path, err))
+    for ln in handle:
+        ln = ln.strip()
+        if not ln:
+            continue
+        try:
+            records.append(json.loads(ln))
+        except ValueError:
+            # Partially written line of a job that was killed
+            continue
+    handle.close()
+    return records
+
+
+def parse_date_line(line):
+    """Parses the output of the unix date command into seconds since epoch.
+
+    Parameters:
+    line: Line printed by date, e.g. "Mon Oct 19 05:04:56 UTC 2026".
+
+    Returns:
+    Seconds since epoch or None if the line could not be parsed.
+    """
+    parts = line.split()
+    if len(parts) == 6:
+        # Time zone names can not be parsed reliably, omit them.
+        del parts[4]
+    try:
+        return time.mktime(time.strptime(' '.join(parts),
+                                         '%a %b %d %H:%M:%S %Y'))
+    except ValueError:
+        return None
+
+
+def read_subshell_logs(output_dir):
+    """Reads command timing information from the .out files of a workflow.
+
+    This is used when the workflow has been run without telemetry. Only wall
+    time can be inferred from the log files.
+
+    Parameters:
+    output_dir: Path to the batch script directory of the workflow.
+
+    Returns:
+    records: List of record dicts similar to telemetry records.
+    """
+    records = []
+    for file_name in sorted(os.listdir(output_dir)):
+        if not file_name.endswith('.out'):
+            continue
+        workload = ''
+        task = file_name
+        for pattern in LOG_NAME_PATTERNS:
+            match = pattern.search(file_name)
+            if match is not None:
+                workload, task = match.groups()
+                break
+
+        handle = open(os.path.join(output_dir, file_name))
+        lines = [ln.strip() for ln in handle]
+        handle.close()
+
+        current = None
+        i = 0
+        while i < len(lines):
+            ln = lines[i]
+            if ln == 'Executing the following command:':
+                # Command lines are followed by the output of date
+                command_lines = []
+                i += 1
+                while i < len(lines) and parse_date_line(lines[i]) is None:
+                    command_lines.append(lines[i])
+                    i += 1
+                if i == len(lines) or not command_lines:
+                    break
+                tool = os.path.basename(command_lines[0].split(' ', 1)[0])
+                current = {'workload': workload,
+                           'task': task,
+                           'tool': tool,
+                           'ids': [],
+                           'start': parse_date_line(lines[i])}
+            elif ln == 'Finished at:' and current is not None:
+                if i + 1 < len(lines):
+                    end = parse_date_line(lines[i+1])
+                    if end is not None:
+                        current['end'] = end
+                        current['wall_s'] = end - current['start']
+                        records.append(current)
+                current = None
+            i += 1
+    return records
+
+
+def analyze(records):
+    """Computes the runtime statistics of a workflow.
+
+    Parameters:
+    records: List of telemetry records.
+
+    Returns:
+    Dict containing statistics for tools, tasks and workloads and the
+    critical path of the workflow.
+    """
+    tools = {}
+    tasks = {}
+    for r in records:
+        t = tools.setdefault(r['tool'], {'commands': 0,
+                                         'failed': 0,
+                                         'wall_s': 0.0,
+                                         'cpu_s': 0.0,
+                                         'in_bytes': 0,
+                                         'max_rss_kb': 0,
+                                         'usage_recorded': 'user_s' in r})
+        t['commands'] += 1
+        t['wall_s'] += r['wall_s']
+        t['cpu_s'] += r.get('user_s', 0.0) + r.get('sys_s', 0.0)
+        t['in_bytes'] += r.get('in_bytes', 0)
+        t['max_rss_kb'] = max(t['max_rss_kb'], r.get('max_rss_kb', 0))
+        if r.get('exit_code', 0) != 0:
+            t['failed'] += 1
+
+        key = (r['workload'], r['task'])
+        task = tasks.setdefault(key, {'start': r['start'],
+                                      'end': r['end'],
+                                      'records': []})
+        task['start'] = min(task['start'], r['start'])
+        task['end'] = max(task['end'], r['end'])
+        task['records'].append(r)
+
+    for t in tools.itervalues():
+        if t['wall_s'] > 0 and t['in_bytes']:
+            t['throughput'] = t['in_bytes'] / t['wall_s']
+        else:
+            t['throughput'] = None
+
+    workloads = {}
+    for (workload, task_name), task in tasks.iteritems():
+        task['makespan'] = task['end'] - task['start']
+        w = workloads.setdefault(workload, {'start': task['start'],
+                                            'end': task['end'],
+                                            'tasks': {}})
+        w['start'] = min(w['start'], task['start'])
+        w['end'] = max(w['end'], task['end'])
+        w['tasks'][task_name] = task
+
+    # Workloads are run one after another, so the critical path consists of
+    # the slowest task of each workload.
+    critical_path = []
+    previous_end = None
+    for workload in sorted(workloads, key=workload_sort_key):
+        w = workloads[workload]
+        makespans = [t['makespan'] for t in w['tasks'].itervalues()]
+        w['mean_makespan'] = sum(makespans) / len(makespans)
+        w['max_makespan'] = max(makespans)
+        if w['mean_makespan'] > 0:
+            w['imbalance'] = w['max_makespan'] / w['mean_makespan']
+        else:
+            w['imbalance'] = 1.0
+        if previous_end is not None:
+            w['idle_before'] = max(0.0, w['start'] - previous_end)
+        else:
+            w['idle_before'] = 0.0
+        previous_end = w['end']
+        slowest = max(w['tasks'], key=lambda name: w['tasks'][name]['makespan'])
+        critical_path.append((workload, slowest, w['tasks'][slowest]))
+
+    return {'tools': tools,
+            'workloads': workloads,
+            'critical_path': critical_path}
+
+
+def workload_sort_key(name):
+    """Sorts workload and task names numerically when possible."""
+    try:
+        return (0, int(name), '')
+    except ValueError:
+        return (1, 0, name)
+
+
+def format_bytes(value):
+    """Returns a human readable representation of a byte count."""
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(value) < 1024.0:
+            return '{0:.1f} {1}'.format(value, unit)
+        value /= 1024.0
+    return '{0:.1f} PB'.format(value)
+
+
+def print_report(statistics):
+    """Prints the workflow runtime statistics.
+
+    Parameters:
+    statistics: Output of analyze().
+    """
+    print '\nPER TOOL STATISTICS:'
+    print '\t'.join(['tool', 'commands', 'failed', 'wall_time_s',
+                     'cpu_efficiency', 'input', 'throughput', 'max_rss'])
+    for name in sorted(statistics['tools']):
+        t = statistics['tools'][name]
+        if t['throughput'] is None:
+            throughput = 'NA'
+        else:
+            throughput = format_bytes(t['throughput']) + '/s'
+        if t['wall_s'] > 0 and t['usage_recorded']:
+            cpu_efficiency = '{0:.2f}'.format(t['cpu_s'] / t['wall_s'])
+        else:
+            cpu_efficiency = 'NA'
+        if t['usage_recorded']:
+            max_rss = format_bytes(t['max_rss_kb'] * 1024)
+        else:
+            max_rss = 'NA'
+        print '\t'.join([name,
+                         str(t['commands']),
+                         str(t['failed']),
+                         '{0:.1f}'.format(t['wall_s']),
+                         cpu_efficiency,
+                         format_bytes(t['in_bytes']),
+                         throughput,
+                         max_rss])
+
+    print '\nPER WORKLOAD STATISTICS:'
+    print '\t'.join(['workload', 'tasks', 'span_s', 'mean_task_makespan_s',
+                     'max_task_makespan_s', 'imbalance', 'idle_before_s'])
+    for name in sorted(statistics['workloads'], key=workload_sort_key):
+        w = statistics['workloads'][name]
+        print '\t'.join([name,
+                         str(len(w['tasks'])),
+                         '{0:.1f}'.format(w['end'] - w['start']),
+                         '{0:.1f}'.format(w['mean_makespan']),
+                         '{0:.1f}'.format(w['max_makespan']),
+                         '{0:.2f}'.format(w['imbalance']),
+                         '{0:.1f}'.format(w['idle_before'])])
+
+    print '\nPER TASK MAKESPAN:'
+    print '\t'.join(['workload', 'task', 'commands', 'makespan_s'])
+    for name in sorted(statistics['workloads'], key=workload_sort_key):
+        w = statistics['workloads'][name]
+        for task_name in sorted(w['tasks'], key=workload_sort_key):
+            task = w['tasks'][task_name]
+            print '\t'.join([name, task_name, str(len(task['records'])),
+                             '{0:.1f}'.format(task['makespan'])])
+
+    print '\nCRITICAL PATH:'
+    total = 0.0
+    for workload, task_name, task in statistics['critical_path']:
+        total += task['makespan']
+        print 'Workload {0}, task {1}: {2:.1f} s'.format(workload,
+                                                        task_name,
+                                                        task['makespan'])
+        for r in sorted(task['records'], key=lambda r: r['start']):
+            print '\t{0} ({1}): {2:.1f} s'.format(r['tool'],
+                                                 ', '.join(r['ids']),
+                                                 r['wall_s'])
+    print 'Critical path length: {0:.1f} s'.format(total)
+
+
+def write_chrome_trace(records, path):
+    """Writes the records in Chrome trace-event format.
+
+    The file can be opened with chrome://tracing or Perfetto. Each workload
+    is shown as a process and each task as a thread of it.
+
+    Parameters:
+    records: List of telemetry records.
+    path: Output file path.
+    """
+    if not records:
+        return
+    origin = min(r['start'] for r in records)
+    events = []
+    workloads = set()
+    for r in records:
+        try:
+            pid = int(r['workload'])
+        except ValueError:
+            pid = 0
+        try:
+            tid = int(r['task'])
+        except ValueError:
+            tid = 0
+        if pid not in workloads:
+            workloads.add(pid)
+            events.append({'name': 'process_name',
+                           'ph': 'M',
+                           'pid': pid,
+                           'args': {'name': 'Workload {0}'.format(r['workload'])}})
+        args = dict((k, v) for k, v in r.iteritems()
+                    if k not in ('start', 'end', 'tool', 'workload', 'task'))
+        events.append({'name': r['tool'],
+                       'cat': 'command',
+                       'ph': 'X',
+                       'ts': int((r['start'] - origin) * 1000000),
+                       'dur': int(r['wall_s'] * 1000000),
+                       'pid': pid,
+                       'tid': tid,
+                       'args': args})
+    write_file(path, json.dumps({'traceEvents': events,
+                                 'displayTimeUnit': 'ms'}))
+
+
+def write_prometheus_textfile(statistics, job_name, path):
+    """Writes the statistics in Prometheus textfile collector format.
+
+    Parameters:
+    statistics: Output of analyze().
+    job_name: Name of the workflow.
+    path: Output file path.
+    """
+    metrics = [('stapler_tool_commands_total', 'counter',
+                'Number of commands run.', 'commands'),
+               ('stapler_tool_failed_commands_total', 'counter',
+                'Number of commands with non-zero exit code.', 'failed'),
+               ('stapler_tool_wall_seconds_total', 'counter',
+                'Total wall time of commands.', 'wall_s'),
+               ('stapler_tool_cpu_seconds_total', 'counter',
+                'Total CPU time of commands.', 'cpu_s'),
+               ('stapler_tool_input_bytes_total', 'counter',
+                'Total size of command input files.', 'in_bytes'),
+               ('stapler_tool_throughput_bytes_per_second', 'gauge',
+                'Input bytes processed per second of wall time.', 'throughput'),
+               ('stapler_tool_max_rss_bytes', 'gauge',
+                'Maximum resident set size of a single command.', 'max_rss_kb')]
+    lines = []
+    for metric, metric_type, help_text, key in metrics:
+        lines.append('# HELP {0} {1}'.format(metric, help_text))
+        lines.append('# TYPE {0} {1}'.format(metric, metric_type))
+        for name in sorted(statistics['tools']):
+            value = statistics['tools'][name][key]
+            if value is None:
+                continue
+            if key == 'max_rss_kb':
+                value *= 1024
+            lines.append('{0}{{job="{1}",tool="{2}"}} {3}'.format(metric,
+                                                                 job_name,
+                                                                 name,
+                                                                 value))
+
+    metrics = [('stapler_workload_makespan_seconds', 'gauge',
+                'Wall time from the first start to the last end of a workload.'),
+               ('stapler_workload_imbalance_ratio', 'gauge',
+                'Slowest task makespan divided by the mean task makespan.'),
+               ('stapler_workload_idle_seconds', 'gauge',
+                'Idle time between the previous workload and this workload.')]
+    for metric, metric_type, help_text in metrics:
+        lines.append('# HELP {0} {1}'.format(metric, help_text))
+        lines.append('# TYPE {0} {1}'.format(metric, metric_type))
+        for name in sorted(statistics['workloads'], key=workload_sort_key):
+            w = statistics['workloads'][name]
+            if metric == 'stapler_workload_makespan_seconds':
+                value = w['end'] - w['start']
+            elif metric == 'stapler_workload_imbalance_ratio':
+                value = w['imbalance']
+            else:
+                value = w['idle_before']
+            lines.append('{0}{{job="{1}",workload="{2}"}} {3}'.format(metric,
+                                                                     job_name,
+                                                                     name,
+                                                                     value))
+
+    lines.append('# HELP stapler_critical_path_seconds Length of the critical '
+                 'path of the workflow.')
+    lines.append('# TYPE stapler_critical_path_seconds gauge')
+    lines.append('stapler_critical_path_seconds{{job="{0}"}} {1}'.format(
+        job_name,
+        sum(task['makespan'] for _, _, task in statistics['critical_path'])))
+    write_file(path, '\n'.join(lines) + '\n')
+
+
+def write_file(path, contents):
+    """Writes a string into a file.
+
+    Raises:
+    STAPLERerror: Unable to write the file.
+    """
+    try:
+        out_fl = open(path, 'w')
+        out_fl.write(contents)
+        out_fl.close()
+    except IOError as err:
+        raise STAPLERerror('Unable to create output file:\n{0}\nReason:\n{1}'
+                           .format(path, err))
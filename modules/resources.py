@@ -0,0 +1,537 @@
+"""Usage based resource model for right-sizing resource manager requests.
+
+The model is learned from the telemetry files written by the command launcher
+and from accounting output of the resource managers (sacct, qacct). For each
+tool, the run time (s) and the memory use (MB) are modeled as a linear
+function of the size of the input data of the command. The size of the input
+data is defined as the total size of the starting point directory files that
+share an ID with the command, as this size is known for every workflow step
+already when the workflow is being generated.
+"""
+
+import json
+import logging
+import math
+import os
+import pipes
+import re
+
+from STAPLERerror import STAPLERerror
+import utils
+
+
+# Default location of the resource model file
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(utils.CONFIG_FILE_PATH),
+                                  'resource_model.json')
+
+# Requests are never made smaller than these values
+MIN_TIME_S = 60
+MIN_MEMORY_MB = 100
+
+# Separates the tool name and the IDs in the names of SLURM job steps (see
+# --job_steps)
+JOB_STEP_NAME_SEPARATOR = ':'
+
+# Cache of ID sizes for each starting point directory
+_id_sizes = {}
+
+
+def id_sizes(starting_point_directory):
+    """Returns the total size of starting point files for each ID.
+
+    Parameters:
+    starting_point_directory: Path to the starting point directory.
+
+    Returns:
+    Dict of id:size in bytes.
+    """
+    if starting_point_directory not in _id_sizes:
+        sizes = {}
+        for file_name in os.listdir(starting_point_directory):
+            path = os.path.join(starting_point_directory, file_name)
+            if not os.path.isfile(path):
+                continue
+            file_id = utils.infer_path_id(file_name)
+            sizes[file_id] = sizes.get(file_id, 0) + os.path.getsize(path)
+        _id_sizes[starting_point_directory] = sizes
+    return _id_sizes[starting_point_directory]
+
+
+def command_input_size(cmd, sizes):
+    """Returns the input size of a command object.
+
+    Parameters:
+    cmd: Instance of GenericBase or subclass of it.
+    sizes: Output of id_sizes().
+    """
+    return sum(sizes.get(i, 0) for i in cmd.command_ids)
+
+
+def task_signature(tools):
+    """Returns the model key for a task running the given tools."""
+    return '+'.join(tools)
+
+
+def load_model(path):
+    """Reads the resource model file.
+
+    Parameters:
+    path: Path to the model file. An empty model is returned if the file does
+    not exist.
+
+    Raises:
+    STAPLERerror: The model file can not be read.
+    """
+    if not os.path.exists(path):
+        return {'sources': [], 'tools': {}, 'tasks': {}}
+    try:
+        handle = open(path)
+        model = json.load(handle)
+        handle.close()
+    except (IOError, ValueError) as err:
+        raise STAPLERerror('Unable to read resource model file:\n{0}\nReason:'
+                           '\n{1}'.format(path, err))
+    return model
+
+
+def save_model(model, path):
+    """Writes the resource model file.
+
+    Raises:
+    STAPLERerror: The model file can not be written.
+    """
+    try:
+        handle = open(path, 'w')
+        json.dump(model, handle, indent=1, sort_keys=True)
+        handle.close()
+    except IOError as err:
+        raise STAPLERerror('Unable to write resource model file:\n{0}\nReason:'
+                           '\n{1}'.format(path, err))
+
+
+def add_sample(model, section, key, input_bytes, wall_s, memory_mb):
+    """Adds a single usage observation to the model.
+
+    Only sums are stored, so that the model can be updated incrementally.
+
+    Parameters:
+    model: Resource model dict.
+    section: 'tools' for single commands or 'tasks' for whole array tasks.
+    key: Tool name or task signature.
+    input_bytes: Input size of the command or task.
+    wall_s: Observed wall time.
+    memory_mb: Observed memory use.
+    """
+    entry = model[section].setdefault(key, {})
+    x = float(input_bytes)
+    for metric, y in (('wall_s', wall_s), ('memory_mb', memory_mb)):
+        if y is None:
+            continue
+        stats = entry.setdefault(metric, {'n': 0, 'sx': 0.0, 'sy': 0.0,
+                                          'sxx': 0.0, 'sxy': 0.0, 'max': 0.0})
+        stats['n'] += 1
+        stats['sx'] += x
+        stats['sy'] += y
+        stats['sxx'] += x * x
+        stats['sxy'] += x * y
+        stats['max'] = max(stats['max'], y)
+
+
+def predict_metric(stats, input_bytes):
+    """Predicts a metric value with a least squares fit of the observations.
+
+    Parameters:
+    stats: Sums of the observations (see add_sample).
+    input_bytes: Input size to predict for.
+
+    Returns:
+    Predicted value.
+    """
+    n = stats['n']
+    mean_x = stats['sx'] / n
+    mean_y = stats['sy'] / n
+    variance = stats['sxx'] / n - mean_x ** 2
+    if n > 1 and variance > 1e-9 * max(1.0, mean_x ** 2):
+        slope = (stats['sxy'] / n - mean_x * mean_y) / variance
+        if slope < 0:
+            slope = 0.0
+        intercept = max(0.0, mean_y - slope * mean_x)
+    elif mean_x > 0:
+        # Observations of a single input size, assume direct proportionality
+        intercept = 0.0
+        slope = mean_y / mean_x
+    else:
+        return stats['max']
+    return intercept + slope * input_bytes
+
+
+def predict_task(model, tools, input_sizes):
+    """Predicts the wall time and memory requirement of an array task.
+
+    Parameters:
+    model: Resource model dict.
+    tools: List of tool names of the commands run in the task.
+    input_sizes: List of input sizes of the commands run in the task.
+
+    Returns:
+    (wall_s, memory_mb) or None if the task can not be predicted.
+    """
+    signature = task_signature(tools)
+    if signature in model['tasks']:
+        entry = model['tasks'][signature]
+        if 'wall_s' in entry and 'memory_mb' in entry:
+            input_size = sum(input_sizes)
+            return (predict_metric(entry['wall_s'], input_size),
+                    predict_metric(entry['memory_mb'], input_size))
+
+    # Commands of a task are run one after another
+    wall_s = 0.0
+    memory_mb = 0.0
+    for tool, input_size in zip(tools, input_sizes):
+        entry = model['tools'].get(tool)
+        if entry is None or 'wall_s' not in entry or 'memory_mb' not in entry:
+            return None
+        wall_s += predict_metric(entry['wall_s'], input_size)
+        memory_mb = max(memory_mb, predict_metric(entry['memory_mb'], input_size))
+    return wall_s, memory_mb
+
+
+def predict_workload(model, workload, sizes, margin):
+    """Predicts the resource request for an array job.
+
+    All tasks of an array job share the same request, so the request is the
+    maximum of the predictions of the tasks.
+
+    Parameters:
+    model: Resource model dict.
+    workload: List of threads, each being a list of command objects.
+    sizes: Output of id_sizes().
+    margin: Safety margin as a fraction of the prediction (e.g. 0.2).
+
+    Returns:
+    (wall_s, memory_mb) as integers or None if some of the tasks can not be
+    predicted.
+    """
+    wall_s = 0.0
+    memory_mb = 0.0
+    for thread in workload:
+        prediction = predict_task(model,
+                                  [cmd.name for cmd in thread],
+                                  [command_input_size(cmd, sizes) for cmd in thread])
+        if prediction is None:
+            return None
+        wall_s = max(wall_s, prediction[0])
+        memory_mb = max(memory_mb, prediction[1])
+    wall_s = max(MIN_TIME_S, int(math.ceil(wall_s * (1 + margin))))
+    memory_mb = max(MIN_MEMORY_MB, int(math.ceil(memory_mb * (1 + margin))))
+    return wall_s, memory_mb
+
+
+def learn_from_telemetry(model, records):
+    """Adds telemetry records to the model.
+
+    Only successfully finished commands are used.
+
+    Returns:
+    Number of records used.
+    """
+    used = 0
+    for r in records:
+        if r.get('exit_code') != 0 or 'id_bytes' not in r:
+            continue
+        add_sample(model, 'tools', r['tool'], r['id_bytes'], r['wall_s'],
+                   r['max_rss_kb'] / 1024.0)
+        used += 1
+    return used
+
+
+def parse_duration(string):
+    """Parses sacct/qacct durations ([D-]HH:MM:SS, MM:SS.sss or seconds)."""
+    string = string.strip().rstrip('s')
+    days = 0
+    if '-' in string:
+        days, string = string.split('-', 1)
+        days = int(days)
+    seconds = 0.0
+    for part in string.split(':'):
+        seconds = seconds * 60 + float(part)
+    return days * 86400 + seconds
+
+
+def parse_memory(string):
+    """Parses sacct/qacct memory values (e.g. 1234K, 1.5G) into MB."""
+    string = string.strip()
+    if not string:
+        return None
+    units = {'K': 1.0 / 1024, 'M': 1.0, 'G': 1024.0, 'T': 1024.0 ** 2}
+    unit = string[-1].upper()
+    if unit == 'B':
+        string = string[:-1]
+        unit = string[-1].upper()
+    if unit in units:
+        return float(string[:-1]) * units[unit]
+    # Plain numbers are bytes
+    return float(string) / 1024 ** 2
+
+
+def parse_sacct(handle):
+    """Parses the output of sacct -P --format=JobID,Elapsed,MaxRSS,State
+
+    Returns:
+    List of (job_id, task_index, wall_s, memory_mb) tuples of successfully
+    finished array tasks.
+    """
+    header = None
+    tasks = {}
+    for ln in handle:
+        ln = ln.strip()
+        if not ln:
+            continue
+        fields = ln.split('|')
+        if header is None:
+            header = fields
+            for column in ('JobID', 'Elapsed', 'MaxRSS', 'State'):
+                if column not in header:
+                    raise STAPLERerror('sacct output must contain the column '
+                                       '{0}. Use sacct -P --format=JobID,'
+                                       'Elapsed,MaxRSS,State'.format(column))
+            continue
+        row = dict(zip(header, fields))
+        job_step = row['JobID'].split('.')
+        match = re.match(r'^(\d+)_(\d+)$', job_step[0])
+        if match is None:
+            continue
+        task = tasks.setdefault(match.groups(), {'wall_s': None,
+                                                 'memory_mb': None,
+                                                 'completed': False})
+        if len(job_step) == 1:
+            task['wall_s'] = parse_duration(row['Elapsed'])
+            task['completed'] = row['State'].startswith('COMPLETED')
+        memory_mb = parse_memory(row['MaxRSS'])
+        if memory_mb is not None:
+            task['memory_mb'] = max(task['memory_mb'], memory_mb)
+    return [(job_id, task_index, t['wall_s'], t['memory_mb'])
+            for (job_id, task_index), t in tasks.iteritems()
+            if t['completed'] and t['wall_s'] is not None]
+
+
+def parse_sacct_job_steps(handle):
+    """Parses the job steps of the commands (see --job_steps) from the output
+    of sacct -P --format=JobID,JobName,Elapsed,MaxRSS,State
+
+    Returns:
+    List of (tool, ids, wall_s, memory_mb) tuples of successfully finished
+    job steps. Empty if the output does not contain the JobName column.
+    """
+    header = None
+    steps = []
+    for ln in handle:
+        ln = ln.strip()
+        if not ln:
+            continue
+        fields = ln.split('|')
+        if header is None:
+            header = fields
+            if 'JobName' not in header:
+                return []
+            continue
+        row = dict(zip(header, fields))
+        if '.' not in row['JobID'] or \
+                JOB_STEP_NAME_SEPARATOR not in row['JobName'] or \
+                not row['State'].startswith('COMPLETED'):
+            continue
+        memory_mb = parse_memory(row['MaxRSS'])
+        if memory_mb is None:
+            continue
+        tool, ids = row['JobName'].split(JOB_STEP_NAME_SEPARATOR, 1)
+        steps.append((tool, ids.split(','), parse_duration(row['Elapsed']),
+                      memory_mb))
+    return steps
+
+
+def parse_qacct(handle):
+    """Parses the output of qacct -j <job_id>
+
+    Returns:
+    List of (job_id, task_index, wall_s, memory_mb) tuples of successfully
+    finished array tasks.
+    """
+    tasks = []
+    row = {}
+    for ln in list(handle) + ['=' * 10]:
+        ln = ln.strip()
+        if ln.startswith('=' * 10):
+            if row and row.get('exit_status', '1').split()[0] == '0' and \
+                    row.get('failed', '0').split()[0] == '0':
+                tasks.append((row['jobnumber'],
+                              row.get('taskid', 'undefined'),
+                              parse_duration(row['ru_wallclock']),
+                              parse_memory(row.get('maxvmem', ''))))
+            row = {}
+            continue
+        fields = ln.split(None, 1)
+        if len(fields) == 2:
+            row[fields[0]] = fields[1].strip()
+    return tasks
+
+
+def _read_accounting_file(path):
+    try:
+        handle = open(path)
+        lines = handle.readlines()
+        handle.close()
+    except IOError as err:
+        raise STAPLERerror('Unable to open accounting file:\n{0}\nReason:\n{1}'
+                           .format(path, err))
+    return lines
+
+
+def parse_accounting_file(path):
+    """Parses sacct or qacct output file.
+
+    Raises:
+    STAPLERerror: The file can not be read or its format is not recognized.
+    """
+    lines = _read_accounting_file(path)
+    if lines and lines[0].startswith('JobID'):
+        return parse_sacct(lines)
+    if any(ln.startswith('jobnumber') for ln in lines):
+        return parse_qacct(lines)
+    raise STAPLERerror('Unable to recognize the format of accounting file:\n{0}'
+                       '\nThe file should contain the output of\nsacct -P '
+                       '--format=JobID,Elapsed,MaxRSS,State\nor\nqacct -j '
+                       '<job id>'.format(path))
+
+
+def parse_accounting_job_steps(path):
+    """Parses the job steps of the commands from an accounting file.
+
+    Returns:
+    Output of parse_sacct_job_steps(), empty for qacct output.
+
+    Raises:
+    STAPLERerror: The file can not be read.
+    """
+    lines = _read_accounting_file(path)
+    if lines and lines[0].startswith('JobID'):
+        return parse_sacct_job_steps(lines)
+    return []
+
+
+def read_manifests(output_dir):
+    """Reads the task manifests written when the workflow was generated.
+
+    Returns:
+    Dict of workload key:{task index:task dict}. The workload key is the
+    workload index followed by the possible file name appendix of split
+    workflows (e.g. '2_split_1').
+    """
+    manifests = {}
+    for file_name in os.listdir(output_dir):
+        match = re.match(r'^.*_WORKLOAD_(\d+)_manifest(_\w+_\d+)?\.json$',
+                         file_name)
+        if match is None:
+            continue
+        handle = open(os.path.join(output_dir, file_name))
+        manifests[match.group(1) + (match.group(2) or '')] = json.load(handle)
+        handle.close()
+    return manifests
+
+
+def find_job_workload(output_dir, job_id):
+    """Infers the workload of a resource manager job from its .out files.
+
+    The first command found from an .out file of the job is searched from the
+    subshell files of the workflow.
+
+    Returns:
+    Workload key (see read_manifests()) or None if the workload could not be
+    inferred.
+    """
+    file_names = os.listdir(output_dir)
+    for file_name in file_names:
+        if '_{0}_'.format(job_id) not in file_name or not file_name.endswith('.out'):
+            continue
+        handle = open(os.path.join(output_dir, file_name))
+        lines = [ln.strip() for ln in handle]
+        handle.close()
+        if 'Executing the following command:' not in lines:
+            continue
+        first_command = lines[lines.index('Executing the following command:') + 1]
+        echo_line = 'echo ' + pipes.quote(first_command)
+        for subshell_name in file_names:
+            match = re.match(r'^.*_WORKLOAD_(\d+)_subshell_\d+(_\w+_\d+)?\.sh$',
+                             subshell_name)
+            if match is None:
+                continue
+            handle = open(os.path.join(output_dir, subshell_name))
+            found = any(ln.strip() == echo_line for ln in handle)
+            handle.close()
+            if found:
+                return match.group(1) + (match.group(2) or '')
+    return None
+
+
+def learn_from_accounting(model, accounting_tasks, output_dir):
+    """Adds resource manager accounting information to the model.
+
+    Parameters:
+    model: Resource model dict.
+    accounting_tasks: Output of parse_accounting_file().
+    output_dir: Path to the batch script directory of the workflow.
+
+    Returns:
+    Number of tasks used.
+    """
+    manifests = read_manifests(output_dir)
+    if not manifests:
+        raise STAPLERerror('No task manifest files were found from the output '
+                           'directory:\n{0}\nAccounting information can only be '
+                           'used with workflows generated by this version of '
+                           'STAPLER.'.format(output_dir))
+    job_workloads = {}
+    used = 0
+    for job_id, task_index, wall_s, memory_mb in accounting_tasks:
+        if job_id not in job_workloads:
+            if len(manifests) == 1:
+                job_workloads[job_id] = manifests.keys()[0]
+            else:
+                job_workloads[job_id] = find_job_workload(output_dir, job_id)
+            if job_workloads[job_id] is None:
+                logging.warning('Unable to infer the workload of job {0}, '
+                                'skipping its accounting information.'
+                                .format(job_id))
+        workload = job_workloads[job_id]
+        if workload is None:
+            continue
+        task = manifests[workload].get(str(task_index))
+        if task is None:
+            continue
+        add_sample(model, 'tasks', task_signature(task['tools']),
+                   sum(task['input_bytes']), wall_s, memory_mb)
+        used += 1
+    return used
+
+
+def learn_from_job_steps(model, job_steps, sizes):
+    """Adds the usage of the commands run as SLURM job steps to the model.
+
+    Parameters:
+    model: Resource model dict.
+    job_steps: Output of parse_accounting_job_steps().
+    sizes: Output of id_sizes().
+
+    Returns:
+    Number of job steps used.
+    """
+    for tool, ids, wall_s, memory_mb in job_steps:
+        add_sample(model, 'tools', tool, sum(sizes.get(i, 0) for i in ids),
+                   wall_s, memory_mb)
+    return len(job_steps)
+
+
+def format_time(seconds):
+    """Formats seconds as H:MM:SS"""
+    return '{0}:{1:02d}:{2:02d}'.format(seconds // 3600,
+                                        seconds % 3600 // 60,
+                                        seconds % 60)
@@ -3,6 +3,8 @@ import os
 from GenericBase import GenericBase
 from STAPLERerror import VirtualIOError
 from STAPLERerror import STAPLERerror
+import bam_output
+import scatter
 import utils
 
 
@@ -35,18 +37,23 @@ class samtools_index(GenericBase):
 
     name = 'stapler_samtools_index'
     #Accept all defined types:
-    input_types = {'.bam'}
+    input_types = {'.bam', '.cram'}
     output_types = []
     require_output_dir = False
     hidden_mandatory_args = ['--!i']
     user_mandatory_args = []
     remove_user_args = user_mandatory_args
-    user_optional_args = ['-b', '-c', '-m']
+    user_optional_args = ['-@', '-b', '-c', '-m']
     parallelizable = True
     help_description = '''
 Tested with samtools 1.2.
 
-The index files are generated into the input directory.
+The index files (.bai for BAM and .crai for CRAM files) are generated into
+the input directory. The -@ parameter
+(samtools 1.9 or newer) sets the number of additional compression threads.
+Index files can also be written while sorting or marking duplicates with the
+--write-index parameter of stapler_samtools_sort and stapler_samtools_markdup,
+which makes a separate index step unnecessary.
     '''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
@@ -79,7 +86,7 @@ The index files are generated into the input directory.
                     in_dir.use_file(fl.name, self.name)
 
                     # Add index file to the input directory
-                    in_dir.add_file(fl.name + '.bai')
+                    in_dir.add_file(fl.name + bam_output.index_extension(fl.name))
                     break
         if not IO_files:
             raise VirtualIOError('No more unused input files')
@@ -205,3 +212,350 @@ conflicts!
             final_cmd.append(arg + ' ' + val)
         return [' '.join(final_cmd)]
 
+
+class SamtoolsBAMWriter(bam_output.BAMOutputPolicy, GenericBase):
+    """Base class for samtools tools converting a single alignment file into a
+    BAM file.
+
+    The input file is given as --!i and the output file as --!o. When the
+    --write-index parameter is present, the BAM index is written by the tool
+    itself into the output directory. The --!bam_output policy is applied
+    with the --output-fmt parameter.
+    """
+
+    input_types = {'.sam', '.bam', '.cram'}
+    output_types = ['.bam']
+    hidden_mandatory_args = ['--!i', '--!o']
+    hidden_optional_args = ['--output-fmt']
+    user_mandatory_args = []
+    remove_user_args = user_mandatory_args
+    parallelizable = True
+    bam_output_arg = '--!o'
+    bam_reference_arg = '--reference'
+    bam_compression_arg = '--output-fmt'
+    bam_compression_value = 'bam,level={0}'
+
+    def _set_cram_output(self, out_cmd, reference_path):
+        """Sets the output format to CRAM."""
+        out_cmd['--output-fmt'] = 'cram'
+
+    def _select_IO(self, out_cmd, in_dir, out_dir):
+        """Infers the input and output file paths.
+
+        This method must keep the directory objects up to date of the file
+        edits!
+
+        Parameters:
+        in_cmd: A dict containing the command line.
+        in_dir: Input directory (instance of filetypes.Directory).
+        out_dir: Output directory (instance of filetypes.Directory).
+
+        Returns:
+        out_cmd: Dict containing the output commands
+        command_identifier: Input file name based identifier for the current command
+
+        Raises:
+        VirtualIOError: No valid input file can be found.
+        """
+
+        IO_files = {}
+        for fl in in_dir.files:
+            if self.name not in fl.users:
+                if utils.splitext(fl.name)[-1] in self.input_types:
+                    IO_files['--!i'] = os.path.join(in_dir.path, fl.name)
+                    command_ids = [utils.infer_path_id(IO_files['--!i'])]
+                    in_dir.use_file(fl.name, self.name)
+
+                    output_name = utils.splitext(fl.name)[0] + \
+                                  self.output_types[0]
+                    IO_files['--!o'] = os.path.join(out_dir.path, output_name)
+                    out_dir.add_file(output_name)
+                    if '--write-index' in out_cmd:
+                        out_dir.add_file(output_name +
+                                         bam_output.index_extension(output_name))
+                    break
+        if not IO_files:
+            raise VirtualIOError('No more unused input files')
+        out_cmd.update(IO_files)
+        return out_cmd, command_ids
+
+    def _output_target(self):
+        """Returns the output file name for samtools, including the name of the
+        index file when --write-index is used."""
+        return indexed_output(self.out_cmd['--!o'],
+                              '--write-index' in self.out_cmd)
+
+    def _options(self):
+        """Returns the user defined options of the final command line."""
+        return [arg + ' ' + val for arg, val in self.out_cmd.iteritems()
+                if arg not in {'--!i', '--!o'}]
+
+
+class samtools_sort(SamtoolsBAMWriter):
+    """Class for creating command lines for samtools sort.
+
+    Parameters:
+    in_cmd: String containing a command line
+    in_dir: Directory object containing input files
+    out_dir: Directory object containing output files
+    NOTICE! Keep the directory objects up to date about file edits!
+    """
+
+    name = 'stapler_samtools_sort'
+    user_optional_args = ['--!bam_output', '-@', '-l', '-m', '-n', '-t', '-T',
+                          '--reference', '--write-index']
+    bam_conflicting_args = ['-l']
+    help_description = '''
+Tested with samtools 1.13.
+
+Sorts the alignments by coordinate (or by read name if -n is given) into a
+BAM file. Use -@ to set the number of sorting and compression threads and -m
+to set the memory used per thread. The --write-index parameter writes a BAI
+index next to the output, so stapler_samtools_index is not needed afterwards.
+
+The --!bam_output parameter selects how the output file is written:
+intermediate (BAM with compression level 1), uncompressed (BAM with
+compression level 0) or cram (CRAM, requires --reference).
+    '''
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        final_cmd = [self.run_command] + self._options()
+        final_cmd += ['-o', self._output_target(), self.out_cmd['--!i']]
+        return [' '.join(final_cmd)]
+
+
+class samtools_fixmate(SamtoolsBAMWriter):
+    """Class for creating command lines for samtools fixmate.
+
+    Parameters:
+    in_cmd: String containing a command line
+    in_dir: Directory object containing input files
+    out_dir: Directory object containing output files
+    NOTICE! Keep the directory objects up to date about file edits!
+    """
+
+    name = 'stapler_samtools_fixmate'
+    user_optional_args = ['--!bam_output', '-@', '-c', '-m', '-p', '-r',
+                          '--reference']
+    help_description = '''
+Tested with samtools 1.13.
+
+The input alignments must be grouped by read name, as in the aligner output
+or after stapler_samtools_sort -n. The -m parameter adds the mate score tags
+stapler_samtools_markdup requires, so it is always used.
+
+Aligners may also pipe their output through fixmate, sort and markdup
+directly, see the --!markdup parameter of stapler_bwa_mem and
+stapler_bowtie2.
+
+The --!bam_output parameter selects how the output file is written:
+intermediate (BAM with compression level 1), uncompressed (BAM with
+compression level 0) or cram (CRAM, requires --reference).
+    '''
+
+    def _select_IO(self, out_cmd, in_dir, out_dir):
+        """Infers the input and output file paths and adds the -m parameter.
+
+        Parameters:
+        in_cmd: A dict containing the command line.
+        in_dir: Input directory (instance of filetypes.Directory).
+        out_dir: Output directory (instance of filetypes.Directory).
+
+        Returns:
+        out_cmd: Dict containing the output commands
+        command_identifier: Input file name based identifier for the current command
+
+        Raises:
+        VirtualIOError: No valid input file can be found.
+        """
+        out_cmd, command_ids = SamtoolsBAMWriter._select_IO(self, out_cmd,
+                                                            in_dir, out_dir)
+        out_cmd['-m'] = ''
+        return out_cmd, command_ids
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        final_cmd = [self.run_command] + self._options()
+        final_cmd += [self.out_cmd['--!i'], self.out_cmd['--!o']]
+        return [' '.join(final_cmd)]
+
+
+class samtools_markdup(SamtoolsBAMWriter):
+    """Class for creating command lines for samtools markdup.
+
+    Parameters:
+    in_cmd: String containing a command line
+    in_dir: Directory object containing input files
+    out_dir: Directory object containing output files
+    NOTICE! Keep the directory objects up to date about file edits!
+    """
+
+    name = 'stapler_samtools_markdup'
+    input_types = {'.bam', '.cram'}
+    user_optional_args = ['--!bam_output', '-@', '-d', '-l', '-m', '-r', '-s',
+                          '-S', '-T', '--reference', '--write-index']
+    help_description = '''
+Tested with samtools 1.13.
+
+Marks (or with -r removes) duplicate reads of coordinate sorted BAM files,
+which must contain the mate score tags of samtools fixmate -m. This is a
+multi-threaded alternative to stapler_Picard_MarkDuplicates and
+stapler_samtools_rmdup. The --write-index parameter writes a BAI index next
+to the output.
+
+The --!bam_output parameter selects how the output file is written:
+intermediate (BAM with compression level 1), uncompressed (BAM with
+compression level 0) or cram (CRAM, requires --reference).
+    '''
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        final_cmd = [self.run_command] + self._options()
+        final_cmd += [self.out_cmd['--!i'], self._output_target()]
+        return [' '.join(final_cmd)]
+
+
+def indexed_output(output_path, write_index):
+    """Returns the samtools output file name of a BAM or CRAM file.
+
+    Parameters:
+    output_path: Path of the BAM or CRAM file.
+    write_index: True if the index is written along with the output.
+
+    Returns:
+    The output path, followed by the name of the BAI (or CRAI) index if
+    write_index is True (otherwise samtools would write a CSI index).
+    """
+    if not write_index:
+        return output_path
+    return '{0}##idx##{0}{1}'.format(output_path,
+                                     bam_output.index_extension(output_path))
+
+
+def markdup_pipeline(output_path, threads=None, memory=None):
+    """Returns a command reading SAM from stdin and writing an indexed,
+    duplicate marked BAM file.
+
+    The alignments are piped through samtools fixmate, sort and markdup
+    without compressing or writing the intermediate files.
+
+    Parameters:
+    output_path: Path of the output BAM file.
+    threads: Number of threads for each samtools command or None.
+    memory: Memory per sorting thread (samtools sort -m) or None.
+
+    Returns:
+    Command line string starting with the samtools fixmate command.
+    """
+    thread_args = ['-@', threads] if threads else []
+    fixmate = ([samtools_fixmate.run_command_config()] + thread_args +
+               ['-m', '-u', '-', '-'])
+    sort = [samtools_sort.run_command_config()] + thread_args + ['-u']
+    if memory:
+        sort += ['-m', memory]
+    sort += ['-T', output_path + '.sort_tmp', '-']
+    markdup = ([samtools_markdup.run_command_config()] + thread_args +
+               ['--write-index', '-', indexed_output(output_path, True)])
+    return ' | '.join(' '.join(cmd) for cmd in [fixmate, sort, markdup])
+
+
+class MarkdupPipeline():
+    """Mixin for aligners piping their output into markdup_pipeline.
+
+    The pipeline is used when the --!markdup parameter is given. Its value
+    sets the memory per sorting thread. The output of the aligner is then an
+    indexed, duplicate marked BAM file instead of a SAM file.
+
+    Attributes:
+    markdup_output_arg: Argument of the output file of the aligner.
+    markdup_thread_arg: Argument of the thread count of the aligner, which is
+    also used for the samtools commands.
+    markdup: True if the --!markdup parameter is given.
+    """
+
+    markdup_output_arg = None
+    markdup_thread_arg = None
+    markdup = False
+
+    def __init__(self, in_cmd, in_dir, out_dir):
+        GenericBase.__init__(self, in_cmd, in_dir, out_dir)
+        if self.markdup:
+            output_path = self.out_cmd[self.markdup_output_arg]
+            self.out_dir.add_file(os.path.basename(output_path) + '.bai')
+            for tool in [samtools_fixmate, samtools_sort, samtools_markdup]:
+                for module in tool.load_module_config():
+                    if module not in self.load_module:
+                        self.load_module.append(module)
+                for module in tool.unload_module_config():
+                    if module not in self.unload_module:
+                        self.unload_module.append(module)
+
+    def _validate_user_input(self, in_cmd):
+        """Ensures the user has included all mandatory arguments and switches
+        the output type to BAM when --!markdup is given.
+
+        Parameters:
+        in_cmd: String the user has input.
+
+        Raises:
+        STAPLERerror: Invalid format.
+        """
+        GenericBase._validate_user_input(self, in_cmd)
+        if '--!markdup' in in_cmd:
+            if '--!scatter' in in_cmd:
+                raise STAPLERerror('{0}: --!markdup can not be used together '
+                                   'with --!scatter, as the duplicates must be '
+                                   'marked over all reads of a sample.'
+                                   .format(self.name))
+            self.markdup = True
+            self.output_types = ['.bam']
+
+    def _output_redirection(self):
+        """Returns the end of the aligner command line writing the output
+        file."""
+        output_path = self.out_cmd[self.markdup_output_arg]
+        if not self.markdup:
+            return '> ' + output_path
+        return '| ' + markdup_pipeline(output_path,
+                                       self.out_cmd.get(self.markdup_thread_arg),
+                                       self.parsed_in_cmd['--!markdup'])
+
+
+class samtools_merge(scatter.Gather):
+    """Class for gathering the shard outputs of scattered aligners.
+
+    The read group and program headers of the shards are identical, so they
+    are combined instead of being made unique, keeping the IDs unchanged.
+    """
+
+    name = 'stapler_samtools_merge'
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        final_cmd = [self.run_command]
+        threads = self.scatter_threads()
+        if threads is not None:
+            final_cmd.append('-@ ' + threads)
+        output_format = utils.splitext(self.output_path)[1].lstrip('.').upper()
+        if output_format in ('SAM', 'BAM', 'CRAM'):
+            final_cmd.append('-O ' + output_format)
+        final_cmd += ['-c', '-p', '-f', self.output_path]
+        final_cmd += self.shard_paths
+        return [' '.join(final_cmd) + ' && ' + self.remove_shards_cmd()]
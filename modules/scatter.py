@@ -0,0 +1,528 @@
+"""Scatter/gather of variant calling and read alignment commands.
+
+When a variant caller command line contains the --!scatter <N> parameter, the
+reference genome is split into N intervals containing roughly the same
+number of bases. When an aligner command line contains the parameter, the
+input reads are split into N chunks instead. Each command is then replaced by
+N shard commands, each processing a single interval or chunk, and by a gather
+command combining the shard outputs into the output file the command would
+have produced. The shard commands are run as separate jobs in a workflow part
+of their own, and the gather commands start the next workflow part.
+
+The interval .bed files, the read chunks and the shard outputs are written
+into a STAPLER_scatter subdirectory of the output directory of the command.
+"""
+
+import copy
+import os
+
+from GenericBase import GenericBase
+from STAPLERerror import STAPLERerror
+import utils
+
+
+SCATTER_DIR_NAME = 'STAPLER_scatter'
+
+# Interval files already written during this run as scatter dir:intervals
+_written_intervals = {}
+
+
+def single_value(value):
+    """Returns the first value of an argument that may have several values."""
+    if isinstance(value, list):
+        return value[0]
+    return value
+
+
+def shard_output_path(output_path, scatter_dir, shard_number):
+    """Returns the path of a shard output corresponding to an output file."""
+    output_name, output_ext = utils.splitext(os.path.basename(output_path))
+    return os.path.join(scatter_dir, '{0}.shard_{1:04d}{2}'.format(output_name,
+                                                                   shard_number,
+                                                                   output_ext))
+
+
+def read_contig_lengths(reference_path):
+    """Reads the contig names and lengths of a reference genome.
+
+    The lengths are read from the .fai index (samtools faidx) or the
+    sequence dictionary (.dict, Picard CreateSequenceDictionary) of the
+    reference. If neither exists yet (e.g. the index is built by the
+    reference index part of the workflow), the reference itself is read.
+
+    Parameters:
+    reference_path: Path to the reference fasta file.
+
+    Returns:
+    List of (contig name, length) tuples in the reference order.
+
+    Raises:
+    STAPLERerror: No index, dictionary or reference file is found.
+    """
+    fai_path = reference_path + '.fai'
+    if os.path.isfile(fai_path):
+        contigs = []
+        with open(fai_path) as handle:
+            for ln in handle:
+                ln = ln.split('\t')
+                if len(ln) >= 2:
+                    contigs.append((ln[0], int(ln[1])))
+        return contigs
+    for dict_path in (os.path.splitext(reference_path)[0] + '.dict',
+                      reference_path + '.dict'):
+        if os.path.isfile(dict_path):
+            contigs = []
+            with open(dict_path) as handle:
+                for ln in handle:
+                    if not ln.startswith('@SQ'):
+                        continue
+                    fields = dict(f.split(':', 1) for f in
+                                  ln.strip().split('\t')[1:] if ':' in f)
+                    contigs.append((fields['SN'], int(fields['LN'])))
+            return contigs
+    if os.path.isfile(reference_path):
+        contigs = []
+        with open(reference_path) as handle:
+            for ln in handle:
+                if ln.startswith('>'):
+                    contigs.append([ln[1:].split()[0], 0])
+                elif contigs:
+                    contigs[-1][1] += len(ln.strip())
+        return [tuple(c) for c in contigs]
+    raise STAPLERerror('--!scatter requires the contig lengths of the '
+                       'reference genome, but the reference file, its .fai '
+                       'index or its sequence dictionary (.dict) does not '
+                       'exist:\n{0}'.format(reference_path))
+
+
+def read_bed(path):
+    """Reads the regions of a .bed file.
+
+    Parameters:
+    path: Path to the .bed file.
+
+    Returns:
+    Dict of contig name:sorted list of (start, end) tuples (0-based, end
+    exclusive).
+
+    Raises:
+    STAPLERerror: The file can not be read or parsed.
+    """
+    regions = {}
+    try:
+        handle = open(path)
+    except IOError as err:
+        raise STAPLERerror('Unable to open .bed file:\n{0}\nReason:\n{1}'
+                           .format(path, err))
+    for ln in handle:
+        if not ln.strip() or ln.startswith(('#', 'track', 'browser')):
+            continue
+        ln = ln.split('\t')
+        try:
+            regions.setdefault(ln[0], []).append((int(ln[1]), int(ln[2])))
+        except (IndexError, ValueError):
+            raise STAPLERerror('Invalid line in .bed file {0}:\n{1}'
+                               .format(path, '\t'.join(ln)))
+    handle.close()
+    for contig_regions in regions.itervalues():
+        contig_regions.sort()
+    return regions
+
+
+def included_segments(contigs, excluded):
+    """Returns the parts of the contigs not covered by excluded regions.
+
+    Parameters:
+    contigs: Output of read_contig_lengths().
+    excluded: Output of read_bed().
+
+    Returns:
+    List of (contig, start, end) tuples (0-based, end exclusive).
+    """
+    segments = []
+    for contig, length in contigs:
+        position = 0
+        for start, end in excluded.get(contig, []):
+            if start > position:
+                segments.append((contig, position, min(start, length)))
+            position = max(position, end)
+            if position >= length:
+                break
+        if position < length:
+            segments.append((contig, position, length))
+    return segments
+
+
+def make_intervals(segments, shard_count, split_contigs=True):
+    """Splits the segments into intervals of roughly equal size.
+
+    Segments are assigned in the reference order, so that the shard outputs
+    can be concatenated without sorting. Segments are split at interval
+    boundaries if necessary.
+
+    Parameters:
+    segments: Output of included_segments().
+    shard_count: Number of intervals to create.
+    split_contigs: If False, all segments of a contig are assigned to the same
+    interval, so that no read can overlap two intervals. Fewer intervals than
+    requested may be created.
+
+    Returns:
+    List of intervals, each being a list of (contig, start, end) tuples.
+    """
+    total = sum(end - start for _, start, end in segments)
+    target = max(1, -(-total // shard_count))
+    intervals = [[]]
+    if not split_contigs:
+        size = 0
+        for contig, start, end in segments:
+            if size >= target and intervals[-1][-1][0] != contig:
+                intervals.append([])
+                size = 0
+            intervals[-1].append((contig, start, end))
+            size += end - start
+        return intervals
+    space = target
+    for contig, start, end in segments:
+        while start < end:
+            if space == 0:
+                intervals.append([])
+                space = target
+            piece_end = min(end, start + space)
+            intervals[-1].append((contig, start, piece_end))
+            space -= piece_end - start
+            start = piece_end
+    return intervals
+
+
+def write_interval_files(reference_path, exclude_path, shard_count, scatter_dir,
+                         split_contigs=True):
+    """Writes the interval .bed files of a scattered workflow step.
+
+    The files are written only once for each scatter directory.
+
+    Returns:
+    List of paths to the interval .bed files.
+    """
+    key = (reference_path, exclude_path, shard_count, split_contigs)
+    if scatter_dir in _written_intervals:
+        if _written_intervals[scatter_dir][0] != key:
+            raise STAPLERerror('All commands of a workflow step must use the '
+                               'same --!scatter parameters.')
+        return _written_intervals[scatter_dir][1]
+
+    excluded = {}
+    if exclude_path is not None:
+        excluded = read_bed(exclude_path)
+    intervals = make_intervals(included_segments(read_contig_lengths(reference_path),
+                                                 excluded),
+                               shard_count,
+                               split_contigs)
+    if not os.path.isdir(scatter_dir):
+        os.makedirs(scatter_dir)
+    paths = []
+    for i, interval in enumerate(intervals):
+        path = os.path.join(scatter_dir, 'interval_{0:04d}.bed'.format(i+1))
+        with open(path, 'w') as handle:
+            for region in interval:
+                handle.write('{0}\t{1}\t{2}\n'.format(*region))
+        paths.append(path)
+    _written_intervals[scatter_dir] = (key, paths)
+    return paths
+
+
+class Scatterable():
+    """Mixin for tools whose commands can be scattered over genomic regions.
+
+    Attributes:
+    scatter_reference_arg: Argument defining the reference fasta file.
+    scatter_output_arg: Argument defining the output file of the command.
+    scatter_extra_output_args: Other output file arguments, each shard gets
+    its own copy of these files as well.
+    scatter_region_args: Region arguments that can not be used with --!scatter.
+    scatter_interval_arg: Argument the interval file of each shard is given
+    with.
+    scatter_thread_arg: Thread count argument of the tool, the gather command
+    may use the same number of threads.
+    scatter_split_contigs: Whether contigs may be split between intervals.
+    gather_class: Class producing the gather commands, or None if the shard
+    outputs are used as such by the next workflow step.
+    """
+
+    scatter_reference_arg = None
+    scatter_output_arg = None
+    scatter_extra_output_args = []
+    scatter_region_args = []
+    scatter_interval_arg = None
+    scatter_thread_arg = None
+    scatter_split_contigs = True
+    gather_class = None
+
+    def _scatter_parameter(self, arg):
+        """Returns a single value of a user defined argument or None."""
+        return single_value(self.parsed_in_cmd.get(arg))
+
+    def _scatter_output_args(self):
+        """Returns the output arguments present in the command line."""
+        return [arg for arg in [self.scatter_output_arg] +
+                self.scatter_extra_output_args if arg in self.out_cmd]
+
+    def _default_scatter_count(self):
+        """Returns the number of shards used without --!scatter, None if the
+        command is not scattered by default."""
+        return None
+
+    def _set_scatter_region(self, out_cmd, intervals):
+        """Adds the interval file(s) of a shard to the command line as the
+        value of scatter_interval_arg.
+
+        The value is given as a list if the tool keeps its argument values in
+        lists (e.g. GATK).
+
+        Raises:
+        STAPLERerror: The tool does not define scatter_interval_arg.
+        """
+        if self.scatter_interval_arg is None:
+            raise STAPLERerror('--!scatter parameter is not supported by {0}.'
+                               .format(self.name))
+        if isinstance(out_cmd.get(self.scatter_output_arg), list) and \
+                not isinstance(intervals, list):
+            intervals = [intervals]
+        out_cmd[self.scatter_interval_arg] = intervals
+
+    def _scatter_units(self, scatter_dir, shard_count):
+        """Returns the work units of the shards, i.e. the interval files.
+
+        Raises:
+        STAPLERerror: Invalid --!scatter_exclude parameter.
+        """
+        exclude_path = self._scatter_parameter('--!scatter_exclude')
+        if exclude_path is not None and not os.path.isfile(exclude_path):
+            raise STAPLERerror('The --!scatter_exclude file does not exist:\n{0}'
+                               .format(exclude_path))
+        return write_interval_files(self._scatter_parameter(self.scatter_reference_arg),
+                                    exclude_path,
+                                    shard_count,
+                                    scatter_dir,
+                                    self.scatter_split_contigs)
+
+    def _shard_command_lines(self, shard, unit):
+        """Returns the command lines of a shard processing a work unit."""
+        self._set_scatter_region(shard.out_cmd, unit)
+        return shard.get_cmd()
+
+    def scatter(self):
+        """Splits the command into shard commands and a gather command.
+
+        Returns:
+        shards: List of command objects, one for each work unit, or None if
+        --!scatter is not used.
+        gather: Command object combining the outputs of shards or None if the
+        command has no gather_class.
+
+        Raises:
+        STAPLERerror: Invalid --!scatter parameters.
+        """
+        shard_count = self._scatter_parameter('--!scatter')
+        if shard_count is None:
+            shard_count = self._default_scatter_count()
+            if shard_count is None:
+                return None, None
+        try:
+            shard_count = int(shard_count)
+        except ValueError:
+            shard_count = 0
+        if shard_count < 1:
+            raise STAPLERerror('--!scatter parameter of {0} requires a '
+                               'positive integer value, e.g. --!scatter 20'
+                               .format(self.name))
+        for arg in self.scatter_region_args:
+            if arg in self.parsed_in_cmd:
+                raise STAPLERerror('{0} parameter of {1} can not be used '
+                                   'together with --!scatter.'.format(arg,
+                                                                      self.name))
+
+        scatter_dir = os.path.join(self.out_dir.path, SCATTER_DIR_NAME)
+        shards = []
+        for i, unit in enumerate(self._scatter_units(scatter_dir, shard_count)):
+            shard = copy.copy(self)
+            shard.out_cmd = copy.deepcopy(self.out_cmd)
+            for arg in self._scatter_output_args():
+                shard_path = shard_output_path(single_value(self.out_cmd[arg]),
+                                               scatter_dir,
+                                               i+1)
+                if isinstance(shard.out_cmd[arg], list):
+                    shard.out_cmd[arg] = [shard_path]
+                else:
+                    shard.out_cmd[arg] = shard_path
+            shard.scatter_index = i
+            shard.command_lines = self._shard_command_lines(shard, unit)
+            shards.append(shard)
+        if self.gather_class is None:
+            return shards, None
+        return shards, self.gather_class(self, shards)
+
+
+class ChunkScatterable(Scatterable):
+    """Mixin for aligners whose commands can be scattered over read chunks.
+
+    The input FASTQ file(s) are split at run time: each shard first extracts
+    its own chunk of reads into the scatter directory with fastq_split.py,
+    aligns the chunk and removes the chunk files. Compressed inputs are
+    decompressed once, by the first shard writing the chunks of all shards.
+
+    Attributes:
+    scatter_input_args: Arguments defining the input FASTQ files, mates of
+    paired-end data in the order of the read pairs.
+    """
+
+    scatter_input_args = []
+
+    def _scatter_units(self, scatter_dir, shard_count):
+        """Returns the work units of the shards as (chunk, chunk count)."""
+        if not os.path.isdir(scatter_dir):
+            os.makedirs(scatter_dir)
+        return [(i+1, shard_count) for i in range(shard_count)]
+
+    def _shard_command_lines(self, shard, unit):
+        """Returns the chunk extraction, alignment and clean up commands."""
+        chunk, chunk_count = unit
+        scatter_dir = os.path.join(self.out_dir.path, SCATTER_DIR_NAME)
+        split_cmd = ['python', utils.FASTQ_SPLITTER_PATH,
+                     '--chunk', str(chunk),
+                     '--chunks', str(chunk_count)]
+        input_paths = []
+        chunk_paths = []
+        for arg in self.scatter_input_args:
+            if arg not in shard.out_cmd:
+                continue
+            input_path = single_value(shard.out_cmd[arg])
+            # The splitter may write the chunks of all shards, so it is given
+            # the chunk paths as a pattern
+            chunk_prefix = os.path.join(scatter_dir, '{0}.chunk_'.format(
+                utils.splitext(os.path.basename(input_path))[0]))
+            chunk_pattern = (chunk_prefix.replace('{', '{{').replace('}', '}}') +
+                             '{chunk}.fastq')
+            chunk_path = chunk_pattern.format(chunk='{0:04d}'.format(chunk))
+            shard.out_cmd[arg] = chunk_path
+            split_cmd += ['--output', chunk_pattern]
+            input_paths.append(input_path)
+            chunk_paths.append(chunk_path)
+        split_cmd += input_paths
+        return ([' '.join(split_cmd)] + shard.get_cmd() +
+                ['rm -f ' + ' '.join(chunk_paths)])
+
+
+class Gather(GenericBase):
+    """Superclass for commands combining the outputs of shard commands.
+
+    Gather commands are not defined by the user in the staplefile, but are
+    created automatically for scattered commands.
+
+    Parameters:
+    scattered_command: The original (not scattered) command object.
+    shards: Shard command objects in the reference (or read chunk) order.
+    """
+
+    name = 'Gather'
+    help_description = '''
+This tool cannot be used by the end user.
+'''
+
+    def __init__(self, scattered_command, shards):
+        self.in_cmd = ''
+        self.in_dir = scattered_command.out_dir
+        self.out_dir = scattered_command.out_dir
+        self.parsed_in_cmd = {}
+        self.out_cmd = {}
+        self.command_ids = list(scattered_command.command_ids)
+        self.scattered_command = scattered_command
+        self.shards = shards
+        self.shard_paths = self.shard_outputs(scattered_command.scatter_output_arg)
+        self.output_path = single_value(
+            scattered_command.out_cmd[scattered_command.scatter_output_arg])
+        self.run_command = self.run_command_config()
+        self.load_module = self.load_module_config()
+        self.unload_module = self.unload_module_config()
+        self.command_lines = self.get_cmd()
+
+    def shard_outputs(self, arg):
+        """Returns the paths given to an output argument in the shards."""
+        return [single_value(s.out_cmd[arg]) for s in self.shards]
+
+    def scatter_threads(self):
+        """Returns the thread count defined for the scattered command or None."""
+        if self.scattered_command.scatter_thread_arg is None:
+            return None
+        return self.scattered_command._scatter_parameter(
+            self.scattered_command.scatter_thread_arg)
+
+    def remove_shards_cmd(self):
+        """Returns a command line removing the shard outputs and indexes."""
+        patterns = []
+        for arg in self.scattered_command._scatter_output_args():
+            output_path = single_value(self.scattered_command.out_cmd[arg])
+            name = utils.splitext(os.path.basename(output_path))[0]
+            patterns.append(os.path.join(os.path.dirname(self.shard_paths[0]),
+                                         name + '.shard_*'))
+        return 'rm -f ' + ' '.join(patterns)
+
+
+class ConcatenateGather(Gather):
+    """Gathers shard outputs by concatenating them with cat.
+
+    Used for headerless text outputs, for which no configuration is needed.
+    """
+
+    name = 'stapler_cat'
+
+    @classmethod
+    def run_command_config(cls):
+        return 'cat'
+
+    @classmethod
+    def load_module_config(cls):
+        return []
+
+    @classmethod
+    def unload_module_config(cls):
+        return []
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        final_cmd = []
+        for arg in self.scattered_command._scatter_output_args():
+            final_cmd.append(' '.join([self.run_command] +
+                                      self.shard_outputs(arg) +
+                                      ['>', single_value(self.scattered_command.out_cmd[arg])]))
+        return [' && '.join(final_cmd + [self.remove_shards_cmd()])]
+
+
+def scatter_step(step_commands):
+    """Scatters the commands of a workflow step if requested by the user.
+
+    Parameters:
+    step_commands: List of command objects of a single workflow step.
+
+    Returns:
+    shards: List of shard command objects or None if the step is not
+    scattered.
+    gathers: List of gather command objects (empty if the commands have no
+    gather commands) or None if the step is not scattered.
+    """
+    if not step_commands or not isinstance(step_commands[0], Scatterable):
+        return None, None
+    shards = []
+    gathers = []
+    for cmd in step_commands:
+        cmd_shards, gather = cmd.scatter()
+        if cmd_shards is None:
+            return None, None
+        shards += cmd_shards
+        if gather is not None:
+            gathers.append(gather)
+    return shards, gathers
@@ -3,9 +3,10 @@ import os
 from GenericBase import GenericBase
 from STAPLERerror import STAPLERerror
 from STAPLERerror import VirtualIOError
+import scatter
 import utils
 
-class soap2(GenericBase):
+class soap2(scatter.ChunkScatterable, GenericBase):
     """Class for using soap2 algorithm.
 
     Parameters:
@@ -34,14 +35,20 @@ class soap2(GenericBase):
 
     name = 'stapler_soap2'
     input_types = {'.fastq', '.fq'}
+    compressed_input_types = input_types
     output_types = ['.sam']
     hidden_mandatory_args = ['-a', '-o']
     hidden_optional_args = ['-2', '-b']
     user_mandatory_args = ['-D']
-    remove_user_args = []
-    user_optional_args = ['--!read_format', '-l', '-m', '-M', '-n', '-p', '-r',
-                          '-R', '-t', '-v', '-x']
+    remove_user_args = ['--!scatter']
+    user_optional_args = ['--!read_format', '--!scatter', '-l', '-m', '-M',
+                          '-n', '-p', '-r', '-R', '-t', '-v', '-x']
     parallelizable = True
+    scatter_input_args = ['-a', '-b']
+    scatter_output_arg = '-o'
+    scatter_extra_output_args = ['-2']
+    gather_class = scatter.ConcatenateGather
+    reference_indexes = {'-D': ['soap2']}
     help_description = '''
 Tested with soap2 version 2.21.
 
@@ -58,6 +65,10 @@ samplename_R2, the --!read_format argument should look like this:
 Notice, that STAPLER uses soap parameter -2 to create output files with
 unpaired alignments. These files have file extension ".unpaired" and are
 omitted from possible further steps of the workflow.
+
+The --!scatter <N> parameter splits the input reads into N chunks and aligns
+each chunk in a separate job. The chunk outputs (and unpaired outputs) are
+concatenated in the beginning of the next workflow part.
 '''
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
@@ -101,7 +112,7 @@ omitted from possible further steps of the workflow.
         if read_format:
             paired_files = in_dir.file_pairs(pattern=self.parsed_in_cmd['--!read_format'],
                                              user=self.name,
-                                             file_formats=list(self.input_types),
+                                             file_formats=list(self.accepted_input_types()),
                                              exclusion_iterable=['pairless',
                                                                  'unmatched'])
             file_names = set()
@@ -133,7 +144,7 @@ omitted from possible further steps of the workflow.
             file_names = set()
             for fl in in_dir.files:
                 if self.name not in fl.users:
-                    if utils.splitext(fl.name)[-1] in self.input_types:
+                    if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                         IO_files['-a'] = os.path.join(in_dir.path, fl.name)
                         command_ids.append(utils.infer_path_id(IO_files['-a']))
                         in_dir.use_file(fl.name, self.name)
@@ -0,0 +1,858 @@
+"""Submission of the generated workloads to the resource manager.
+
+The workload files are submitted in order with the submit command of the
+resource manager (see --submit). The jobs of each workflow part depend on
+the jobs of the previous part, so the parts are started one after another
+without any further action from the user. When the subshells skip the IDs of
+failed commands (see --keep_going), the parts wait for the previous part to
+finish in any state (afterany), otherwise to finish successfully (afterok).
+The job IDs are recorded into a submission file in the batch script
+directory, which is read by --status to poll the state of the jobs.
+
+Tasks of the submitted array jobs that failed because of exceeding their
+memory or time limits, because of a node failure or because the stall
+watchdog killed a hung command (see --watchdog), can be resubmitted with
+--retry. The memory or time request of the retried tasks is scaled up on each
+attempt.
+
+The resource manager commands are run through backend objects, which can be
+replaced (see BACKENDS). The stub backend does not run any commands and can
+be used for testing the submission without a resource manager.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import subprocess
+import time
+
+from STAPLERerror import STAPLERerror
+import launcher
+import resources
+
+
+# Name of the file recording the submitted jobs in the batch script directory
+SUBMISSION_FILE_NAME = 'STAPLER_submitted_jobs.json'
+
+# Job states are cached for this many seconds to avoid flooding the resource
+# manager with queries when --status is run repeatedly
+STATUS_CACHE_SECONDS = 60
+
+# Delays (s) between the retries of a failed status query
+STATUS_RETRY_DELAYS = [5, 15, 45]
+
+# Job states after which the state of a job does not change anymore
+FINAL_STATES = set(['COMPLETED', 'FAILED', 'CANCELLED', 'FINISHED'])
+
+# Task failures retried by --retry in the order of precedence, when a task
+# has several failed job steps. The value tells whether the memory and run
+# time requests are scaled up for the retry.
+RETRYABLE_FAILURES = [('OUT_OF_MEMORY', (True, False)),
+                      ('TIMEOUT', (False, True)),
+                      ('NODE_FAIL', (False, False)),
+                      ('STALLED', (False, False))]
+
+# Memory and time requests are multiplied by this factor on each retry
+RETRY_SCALE_FACTOR = 2
+
+DEFAULT_MAX_RETRIES = 2
+
+
+def run_command(cmd, cwd=None, stdin_path=None):
+    """Runs a resource manager command and returns its output.
+
+    Parameters:
+    cmd: Command as a list of arguments.
+    cwd: Working directory of the command.
+    stdin_path: Path to a file to read as the standard input of the command.
+
+    Returns:
+    Standard output of the command.
+
+    Raises:
+    STAPLERerror: The command can not be run or it fails.
+    """
+    stdin = None
+    try:
+        if stdin_path is not None:
+            stdin = open(stdin_path)
+        process = subprocess.Popen(cmd, cwd=cwd, stdin=stdin,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        out, err = process.communicate()
+    except (IOError, OSError) as emsg:
+        raise STAPLERerror('Unable to run command:\n{0}\nwith error message:'
+                           '\n{1}'.format(' '.join(cmd), str(emsg)))
+    finally:
+        if stdin is not None:
+            stdin.close()
+    if process.returncode != 0:
+        raise STAPLERerror('Command failed with exit code {0}:\n{1}\n{2}'
+                           .format(process.returncode, ' '.join(cmd),
+                                   err.strip()))
+    return out
+
+
+def job_number(job_id):
+    """Returns the numeric part of a job ID (e.g. 123 of 123[].server)."""
+    match = re.match(r'^(\d+)', job_id)
+    if match is None:
+        return job_id
+    return match.group(1)
+
+
+class SubmissionBackend():
+    """Base class of the resource manager backends.
+
+    Attributes:
+    name: Name of the backend (see BACKENDS).
+    """
+
+    name = None
+
+    def submit(self, workload_file_path, dependencies, dependency_type='afterok'):
+        """Submits a workload file. Override to support --submit!
+
+        Parameters:
+        workload_file_path: Path to the workload file.
+        dependencies: List of job IDs which have to finish before the job is
+        started.
+        dependency_type: afterok to start the job after the dependencies have
+        finished successfully, afterany to start it after they have finished
+        in any state.
+
+        Returns:
+        Job ID of the submitted job.
+        """
+        raise STAPLERerror('Submitting jobs is not supported for the {0} '
+                           'resource manager.'.format(self.name))
+
+    def job_states(self, job_ids):
+        """Queries the states of the tasks of the jobs. Override to support
+        --status!
+
+        Parameters:
+        job_ids: List of job IDs.
+
+        Returns:
+        Dict of job number:{state:task count} pairs. States are one of
+        PENDING, RUNNING, SUSPENDED, COMPLETED, FAILED, CANCELLED or FINISHED
+        (finished with unknown exit status). Tasks not listed are counted as
+        FINISHED by submission_status (see task_count).
+        """
+        raise STAPLERerror('Querying job states is not supported for the {0} '
+                           'resource manager.'.format(self.name))
+
+    def task_count(self, lines):
+        """Returns the number of tasks of a workload file, None if it is not
+        needed by job_states. Override if finished tasks are not listed by
+        the resource manager!
+
+        Parameters:
+        lines: Lines of the workload file.
+        """
+        return None
+
+    def failed_tasks(self, job_id):
+        """Queries the failure causes of the failed tasks of an array job.
+        Override to support --retry!
+
+        Parameters:
+        job_id: Job ID.
+
+        Returns:
+        Dict of task index:failure pairs. Failures are either one of
+        RETRYABLE_FAILURES or FAILED for other failures.
+        """
+        raise STAPLERerror('Retrying failed tasks is not supported for the {0} '
+                           'resource manager.'.format(self.name))
+
+    def retry_workload(self, lines, task_indexes, memory_factor, time_factor):
+        """Creates a workload file running only the given tasks. Override to
+        support --retry!
+
+        Parameters:
+        lines: Lines of the workload file of the failed job.
+        task_indexes: Array task indexes to run.
+        memory_factor: Factor for scaling the memory request.
+        time_factor: Factor for scaling the run time request.
+
+        Returns:
+        Lines of the new workload file.
+        """
+        raise STAPLERerror('Retrying failed tasks is not supported for the {0} '
+                           'resource manager.'.format(self.name))
+
+    def update_dependencies(self, job_id, dependencies, dependency_type='afterok'):
+        """Replaces the dependencies of a pending job. Override to support
+        --retry!
+        """
+        raise STAPLERerror('Retrying failed tasks is not supported for the {0} '
+                           'resource manager.'.format(self.name))
+
+
+def parse_slurm_memory(value):
+    """Parses a SLURM memory request (e.g. 4G or 4000) into MB."""
+    units = {'K': 1.0 / 1024, 'M': 1.0, 'G': 1024.0, 'T': 1024.0 ** 2}
+    value = value.strip().upper()
+    if value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def parse_slurm_time(value):
+    """Parses a SLURM time request (e.g. 60, 1:00:00 or 1-12) into seconds."""
+    days = 0
+    if '-' in value:
+        days, value = value.split('-', 1)
+        days = int(days)
+        parts = map(int, value.split(':'))
+        parts += [0] * (3 - len(parts))
+    else:
+        parts = map(int, value.split(':'))
+        if len(parts) == 1:
+            # Minutes only
+            parts = [0, parts[0], 0]
+        elif len(parts) == 2:
+            # Minutes and seconds
+            parts = [0] + parts
+    hours, minutes, seconds = parts
+    return days * 86400 + hours * 3600 + minutes * 60 + seconds
+
+
+class SlurmBackend(SubmissionBackend):
+    """Submits jobs with sbatch and queries their states with sacct."""
+
+    name = 'slurm'
+
+    def submit(self, workload_file_path, dependencies, dependency_type='afterok'):
+        cmd = ['sbatch', '--parsable']
+        if dependencies:
+            cmd.append('--dependency={0}:{1}'.format(dependency_type,
+                                                     ':'.join(dependencies)))
+            if dependency_type == 'afterok':
+                # Jobs waiting for a failed job are cancelled instead of
+                # being left pending forever
+                cmd.append('--kill-on-invalid-dep=yes')
+        cmd.append(workload_file_path)
+        out = run_command(cmd, cwd=os.path.dirname(workload_file_path))
+        return out.strip().split(';')[0]
+
+    def job_states(self, job_ids):
+        out = run_command(['sacct', '-P', '-n', '-X',
+                           '--format=JobID,State',
+                           '-j', ','.join(job_ids)])
+        states = {}
+        for ln in out.splitlines():
+            fields = ln.strip().split('|')
+            if len(fields) < 2:
+                continue
+            job_id, state = fields[0], fields[1].split()[0]
+            if state.startswith('CANCELLED'):
+                state = 'CANCELLED'
+            elif state in ('TIMEOUT', 'OUT_OF_MEMORY', 'NODE_FAIL',
+                           'BOOT_FAIL', 'DEADLINE', 'PREEMPTED'):
+                state = 'FAILED'
+            elif state in ('REQUEUED', 'RESIZING'):
+                state = 'PENDING'
+            # Pending array tasks are shown in a single row, e.g. 123_[5-10%2]
+            task_count = 1
+            match = re.search(r'_\[([^\]%]*)', job_id)
+            if match is not None:
+                task_count = 0
+                for task_range in match.group(1).split(','):
+                    bounds = task_range.split('-')
+                    task_count += int(bounds[-1]) - int(bounds[0]) + 1
+            job_states = states.setdefault(job_number(job_id), {})
+            job_states[state] = job_states.get(state, 0) + task_count
+        return states
+
+    def failed_tasks(self, job_id):
+        out = run_command(['sacct', '-P', '-n',
+                           '--format=JobID,State,ExitCode',
+                           '-j', job_id])
+        precedence = [failure for failure, scaling in RETRYABLE_FAILURES] + \
+                     ['FAILED']
+        failures = {}
+        for ln in out.splitlines():
+            fields = ln.strip().split('|')
+            if len(fields) < 2:
+                continue
+            # Rows of the job steps of each task are included, e.g. 123_4.batch
+            match = re.match(r'^\d+_(\d+)(\.|$)', fields[0])
+            state = fields[1].split()[0] if fields[1].strip() else ''
+            # Commands killed by the stall watchdog exit with a code of their own
+            if state == 'FAILED' and len(fields) > 2 and \
+                    fields[2].split(':')[0] == str(launcher.STALL_EXIT_CODE):
+                state = 'STALLED'
+            if match is None or state not in precedence:
+                continue
+            task_index = match.group(1)
+            if task_index not in failures or \
+                    precedence.index(state) < precedence.index(failures[task_index]):
+                failures[task_index] = state
+        return failures
+
+    def retry_workload(self, lines, task_indexes, memory_factor, time_factor):
+        new_lines = []
+        memory_scaled = memory_factor == 1
+        for ln in lines:
+            fields = ln.replace('=', ' ', 1).split()
+            if len(fields) >= 3 and fields[0] == '#SBATCH':
+                option, value = fields[1], fields[2]
+                if option in ('--array', '-a'):
+                    throttle = ''
+                    if '%' in value:
+                        throttle = value[value.index('%'):]
+                    ln = '#SBATCH --array={0}{1}'.format(','.join(task_indexes),
+                                                         throttle)
+                elif option in ('--mem', '--mem-per-cpu') and memory_factor != 1:
+                    ln = '#SBATCH {0}={1}M'.format(
+                        option,
+                        int(math.ceil(parse_slurm_memory(value) * memory_factor)))
+                    memory_scaled = True
+                elif option in ('--time', '-t') and time_factor != 1:
+                    ln = '#SBATCH --time={0}'.format(resources.format_time(
+                        int(math.ceil(parse_slurm_time(value) * time_factor))))
+            new_lines.append(ln)
+        if not memory_scaled:
+            logging.warning('The workload file does not define a memory request '
+                            '(--mem or --mem-per-cpu), so the memory of the '
+                            'retried tasks can not be increased.')
+        return new_lines
+
+    def update_dependencies(self, job_id, dependencies, dependency_type='afterok'):
+        run_command(['scontrol', 'update', 'JobId={0}'.format(job_id),
+                     'Dependency={0}:{1}'.format(dependency_type,
+                                                 ':'.join(dependencies))])
+
+
+class SGEBackend(SubmissionBackend):
+    """Submits jobs with qsub and queries their states with qstat.
+
+    Finished tasks are not shown by qstat, so their exit status is unknown.
+    They are counted from the task count of the job. Jobs held with -hold_jid
+    are started when the jobs they wait for have finished in any state, so
+    both dependency types are submitted the same way.
+    """
+
+    name = 'sge'
+
+    def submit(self, workload_file_path, dependencies, dependency_type='afterok'):
+        cmd = ['qsub', '-terse']
+        if dependencies:
+            cmd += ['-hold_jid', ','.join(dependencies)]
+        cmd.append(workload_file_path)
+        out = run_command(cmd, cwd=os.path.dirname(workload_file_path))
+        return out.strip().split('.')[0]
+
+    def job_states(self, job_ids):
+        out = run_command(['qstat'])
+        states = dict((job_number(j), {}) for j in job_ids)
+        for ln in out.splitlines():
+            fields = ln.split()
+            if len(fields) < 5 or fields[0] not in states:
+                continue
+            state = fields[4]
+            if 'E' in state:
+                state = 'FAILED'
+            elif 'd' in state:
+                state = 'CANCELLED'
+            elif 's' in state.lower():
+                state = 'SUSPENDED'
+            elif 'r' in state or 't' in state:
+                state = 'RUNNING'
+            else:
+                state = 'PENDING'
+            # Pending array tasks are shown in a single row, e.g. 5-10:1
+            task_count = 1
+            if fields[-1] != fields[4]:
+                match = re.match(r'^(\d+)-(\d+):(\d+)$', fields[-1])
+                if match is not None:
+                    first, last, step = map(int, match.groups())
+                    task_count = (last - first) // step + 1
+            job_states = states[fields[0]]
+            job_states[state] = job_states.get(state, 0) + task_count
+        return states
+
+    def task_count(self, lines):
+        for ln in lines:
+            fields = ln.split()
+            if fields[:2] == ['#$', '-t'] and len(fields) > 2:
+                match = re.match(r'^(\d+)-(\d+)(?::(\d+))?$', fields[2])
+                if match is not None:
+                    first, last = int(match.group(1)), int(match.group(2))
+                    return (last - first) // int(match.group(3) or 1) + 1
+        # Packed workloads are run as a single job
+        return 1
+
+
+class LSFBackend(SubmissionBackend):
+    """Submits jobs with bsub and queries their states with bjobs."""
+
+    name = 'lsf'
+
+    def submit(self, workload_file_path, dependencies, dependency_type='afterok'):
+        cmd = ['bsub']
+        if dependencies:
+            condition = 'done' if dependency_type == 'afterok' else 'ended'
+            cmd += ['-w', ' && '.join('{0}({1})'.format(condition, j)
+                                      for j in dependencies)]
+        # The #BSUB lines are only read when the file is given as stdin
+        out = run_command(cmd, cwd=os.path.dirname(workload_file_path),
+                          stdin_path=workload_file_path)
+        match = re.search(r'Job <(\d+)>', out)
+        if match is None:
+            raise STAPLERerror('Unable to read the job ID from the output of '
+                               'bsub:\n{0}'.format(out))
+        return match.group(1)
+
+    def job_states(self, job_ids):
+        out = run_command(['bjobs', '-a', '-noheader', '-o', 'jobid stat'] +
+                          list(job_ids))
+        lsf_states = {'PEND': 'PENDING', 'PSUSP': 'SUSPENDED',
+                      'USUSP': 'SUSPENDED', 'SSUSP': 'SUSPENDED',
+                      'RUN': 'RUNNING', 'DONE': 'COMPLETED', 'EXIT': 'FAILED'}
+        states = {}
+        for ln in out.splitlines():
+            fields = ln.split()
+            if len(fields) < 2:
+                continue
+            state = lsf_states.get(fields[1], 'PENDING')
+            job_states = states.setdefault(job_number(fields[0]), {})
+            job_states[state] = job_states.get(state, 0) + 1
+        return states
+
+
+class TorqueBackend(SubmissionBackend):
+    """Submits jobs with qsub and queries their states with qstat.
+
+    The exit status of completed jobs is not shown by qstat.
+    """
+
+    name = 'torque'
+
+    def submit(self, workload_file_path, dependencies, dependency_type='afterok'):
+        cmd = ['qsub']
+        if dependencies:
+            array_jobs = [j for j in dependencies if '[]' in j]
+            jobs = [j for j in dependencies if '[]' not in j]
+            depend = []
+            if jobs:
+                depend.append('{0}:{1}'.format(dependency_type, ':'.join(jobs)))
+            if array_jobs:
+                depend.append('{0}array:{1}'.format(dependency_type,
+                                                    ':'.join(array_jobs)))
+            cmd += ['-W', 'depend=' + ','.join(depend)]
+        cmd.append(workload_file_path)
+        out = run_command(cmd, cwd=os.path.dirname(workload_file_path))
+        return out.strip()
+
+    def job_states(self, job_ids):
+        out = run_command(['qstat', '-t'] + list(job_ids))
+        torque_states = {'Q': 'PENDING', 'H': 'PENDING', 'W': 'PENDING',
+                         'T': 'PENDING', 'R': 'RUNNING', 'E': 'RUNNING',
+                         'S': 'SUSPENDED', 'C': 'FINISHED'}
+        states = {}
+        for ln in out.splitlines():
+            fields = ln.split()
+            if len(fields) < 6 or not fields[0][0].isdigit():
+                continue
+            # Only the tasks of array jobs are counted, not the array itself
+            if '[]' in fields[0]:
+                continue
+            state = torque_states.get(fields[4], 'PENDING')
+            job_states = states.setdefault(job_number(fields[0]), {})
+            job_states[state] = job_states.get(state, 0) + 1
+        return states
+
+
+class StubBackend(SubmissionBackend):
+    """Backend for testing that does not run any commands.
+
+    The submitted files are recorded into the submitted attribute and the
+    jobs get consecutive IDs starting from the current time in seconds, so
+    that the IDs of separate runs do not overlap. All tasks of the jobs are
+    reported to be in the state defined in the state attribute, unless the
+    task states of a job are defined in the job_states_by_id attribute.
+    Failed tasks of each job can be defined in the failures attribute for
+    testing --retry.
+    """
+
+    name = 'stub'
+
+    def __init__(self):
+        self.submitted = []
+        self.first_job_id = int(time.time()) * 1000
+        self.state = 'PENDING'
+        self.job_states_by_id = {}
+        self.failures = {}
+        self.dependency_updates = []
+
+    def submit(self, workload_file_path, dependencies, dependency_type='afterok'):
+        self.submitted.append((workload_file_path, list(dependencies),
+                               dependency_type))
+        return str(self.first_job_id + len(self.submitted))
+
+    def job_states(self, job_ids):
+        return dict((job_number(j), dict(self.job_states_by_id.get(j, {self.state: 1})))
+                    for j in job_ids)
+
+    def failed_tasks(self, job_id):
+        return dict(self.failures.get(job_id, {}))
+
+    def retry_workload(self, lines, task_indexes, memory_factor, time_factor):
+        return lines + ['# Tasks {0}, memory x{1}, time x{2}'.format(
+            ','.join(task_indexes), memory_factor, time_factor)]
+
+    def update_dependencies(self, job_id, dependencies, dependency_type='afterok'):
+        self.dependency_updates.append((job_id, list(dependencies),
+                                        dependency_type))
+
+
+# Available backends. Additional backends can be registered here.
+BACKENDS = {'lsf': LSFBackend,
+            'sge': SGEBackend,
+            'slurm': SlurmBackend,
+            'stub': StubBackend,
+            'torque': TorqueBackend}
+
+
+def get_backend(name):
+    """Returns a backend object.
+
+    Raises:
+    STAPLERerror: Unknown backend.
+    """
+    if name not in BACKENDS:
+        raise STAPLERerror('Unknown submission backend {0}. Available '
+                           'backends are: {1}'.format(name,
+                                                      ', '.join(sorted(BACKENDS))))
+    return BACKENDS[name]()
+
+
+def workload_part(workload_file_path):
+    """Returns the workflow part index of a workload file.
+
+    The array jobs of a split workflow part (e.g. WORKLOAD_1_array_1 and
+    WORKLOAD_1_array_2) have the same index.
+    """
+    match = re.search(r'_WORKLOAD_(\d+)', os.path.basename(workload_file_path))
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def submission_file_path(output_dir):
+    return os.path.join(output_dir, SUBMISSION_FILE_NAME)
+
+
+def read_submissions(output_dir):
+    """Reads the submission file of the workflow.
+
+    Returns:
+    List of submission dicts, empty if nothing has been submitted.
+
+    Raises:
+    STAPLERerror: The submission file can not be read.
+    """
+    path = submission_file_path(output_dir)
+    if not os.path.exists(path):
+        return []
+    try:
+        handle = open(path)
+        submissions = json.load(handle)
+        handle.close()
+    except (IOError, ValueError) as emsg:
+        raise STAPLERerror('Unable to read the submission file:\n{0}\nwith '
+                           'error message:\n{1}'.format(path, str(emsg)))
+    return submissions
+
+
+def write_submissions(output_dir, submissions):
+    """Writes the submission file of the workflow.
+
+    Raises:
+    STAPLERerror: Unable to write the file.
+    """
+    path = submission_file_path(output_dir)
+    try:
+        out_fl = open(path + '.tmp', 'w')
+        json.dump(submissions, out_fl, indent=1, sort_keys=True)
+        out_fl.close()
+        os.rename(path + '.tmp', path)
+    except (IOError, OSError) as emsg:
+        raise STAPLERerror('Unable to create output file:\n{0}\n with error '
+                           'message:\n{1}'.format(path, str(emsg)))
+
+
+def read_workload_file(workload_file_path):
+    """Returns the lines of a workload file.
+
+    Raises:
+    STAPLERerror: The file can not be read.
+    """
+    try:
+        handle = open(workload_file_path)
+        lines = handle.read().splitlines()
+        handle.close()
+    except IOError as emsg:
+        raise STAPLERerror('Unable to open workload file:\n{0}\nwith '
+                           'error message:\n{1}'.format(workload_file_path,
+                                                        str(emsg)))
+    return lines
+
+
+def submit_workloads(workload_file_paths, output_dir, backend,
+                     dependency_type='afterok'):
+    """Submits the workload files in order.
+
+    The jobs of each workflow part depend on all jobs of the previous part.
+    The job IDs are recorded in the submission file even if a submission
+    fails, so that the submitted jobs can be tracked and cancelled.
+
+    Parameters:
+    workload_file_paths: Paths to the workload files in submission order.
+    output_dir: Path to the batch script directory of the workflow.
+    backend: Backend object.
+    dependency_type: Type of the dependencies, afterok or afterany (see
+    SubmissionBackend.submit).
+
+    Returns:
+    List of submitted job dicts.
+
+    Raises:
+    STAPLERerror: Submission failed.
+    """
+    submission = {'backend': backend.name,
+                  'dependency_type': dependency_type,
+                  'submitted': time.strftime('%Y-%m-%d %H:%M:%S'),
+                  'jobs': []}
+    submissions = read_submissions(output_dir)
+    submissions.append(submission)
+    previous_part_jobs = []
+    current_part_jobs = []
+    current_part = None
+    try:
+        for path in workload_file_paths:
+            part = workload_part(path)
+            if part != current_part:
+                if current_part_jobs:
+                    previous_part_jobs = current_part_jobs
+                current_part_jobs = []
+                current_part = part
+            task_count = backend.task_count(read_workload_file(path))
+            job_id = backend.submit(path, previous_part_jobs, dependency_type)
+            logging.info('Submitted {0} as job {1}.'.format(path, job_id))
+            job = {'workload_file': os.path.basename(path),
+                   'job_id': job_id,
+                   'dependencies': list(previous_part_jobs)}
+            if task_count is not None:
+                job['task_count'] = task_count
+            submission['jobs'].append(job)
+            current_part_jobs.append(job_id)
+    finally:
+        if submission['jobs']:
+            write_submissions(output_dir, submissions)
+    return submission['jobs']
+
+
+def query_states(backend, job_ids):
+    """Queries the job states, retrying with increasing delays if the query
+    fails (e.g. the resource manager is busy).
+
+    Raises:
+    STAPLERerror: All retries failed.
+    """
+    for delay in STATUS_RETRY_DELAYS + [None]:
+        try:
+            return backend.job_states(job_ids)
+        except STAPLERerror as emsg:
+            if delay is None:
+                raise
+            logging.warning('Job state query failed, retrying in {0} s:\n{1}'
+                            .format(delay, str(emsg)))
+            time.sleep(delay)
+
+
+def submission_status(output_dir, backend=None):
+    """Returns the states of the jobs of the latest submission.
+
+    The states are cached in the submission file for STATUS_CACHE_SECONDS.
+    States of jobs that have reached a final state are not queried again.
+
+    Parameters:
+    output_dir: Path to the batch script directory of the workflow.
+    backend: Backend object, by default the backend used for the submission.
+
+    Returns:
+    (submission dict, cache age in seconds or None if queried now) tuple.
+    The states of each job are in the 'states' item of the job dicts.
+
+    Raises:
+    STAPLERerror: Nothing has been submitted or the query fails.
+    """
+    submissions = read_submissions(output_dir)
+    if not submissions:
+        raise STAPLERerror('No jobs have been submitted from the output '
+                           'directory:\n{0}\nUse --submit to submit the '
+                           'workflow.'.format(output_dir))
+    submission = submissions[-1]
+    now = time.time()
+    queried = submission.get('queried')
+    if queried is not None and now - queried < STATUS_CACHE_SECONDS:
+        return submission, int(now - queried)
+
+    if backend is None:
+        backend = get_backend(submission['backend'])
+    active_jobs = [job['job_id'] for job in submission['jobs']
+                   if not job.get('states') or
+                   set(job['states']) - FINAL_STATES]
+    if active_jobs:
+        states = query_states(backend, active_jobs)
+        for job in submission['jobs']:
+            if job['job_id'] in active_jobs:
+                job_states = states.get(job_number(job['job_id']),
+                                        {'UNKNOWN': 1})
+                # Tasks no longer listed by the resource manager have
+                # finished. The job is reported as a whole if its task count
+                # is unknown.
+                unlisted = job.get('task_count', 1) - sum(job_states.values())
+                if unlisted > 0:
+                    job_states['FINISHED'] = unlisted
+                job['states'] = job_states
+    submission['queried'] = now
+    write_submissions(output_dir, submissions)
+    return submission, None
+
+
+def retry_file_path(workload_file_path, attempt):
+    """Returns the path of the workload file of a retry attempt, e.g.
+    STAPLER_SBATCH_WORKLOAD_1_RETRY_2.sh"""
+    base = re.sub(r'_RETRY_\d+$', '', os.path.splitext(workload_file_path)[0])
+    return '{0}_RETRY_{1}.sh'.format(base, attempt)
+
+
+def retry_failed_jobs(output_dir, max_retries, backend=None):
+    """Resubmits the tasks of the latest submission that failed because of
+    exceeding memory or time limits or because of a node failure.
+
+    Memory requests are scaled for out of memory failures and time requests
+    for timeouts by RETRY_SCALE_FACTOR on each attempt. The failed tasks of a
+    job are retried only after all of its tasks have finished, so that jobs
+    waiting for the failed job can be set to wait for the retry instead
+    without starting before the rest of the failed job.
+
+    Parameters:
+    output_dir: Path to the batch script directory of the workflow.
+    max_retries: Maximum number of retry attempts of each task.
+    backend: Backend object, by default the backend used for the submission.
+
+    Returns:
+    List of job dicts of the submitted retries.
+
+    Raises:
+    STAPLERerror: Nothing has been submitted, the backend does not support
+    retries or a resource manager command fails.
+    """
+    # Refresh the job states
+    submission_status(output_dir, backend)
+    submissions = read_submissions(output_dir)
+    latest = submissions[-1]
+    if backend is None:
+        backend = get_backend(latest['backend'])
+    retryable = dict(RETRYABLE_FAILURES)
+    dependency_type = latest.get('dependency_type', 'afterok')
+
+    retries = []
+    for job in list(latest['jobs']):
+        states = job.get('states', {})
+        if 'FAILED' not in states:
+            continue
+        if set(states) - FINAL_STATES:
+            logging.info('Job {0} still has unfinished tasks, its failed tasks '
+                         'are retried after all of its tasks have finished.'
+                         .format(job['job_id']))
+            continue
+        retried_tasks = set()
+        for other in latest['jobs']:
+            if other.get('retry_of') == job['job_id']:
+                retried_tasks.update(other['tasks'])
+        failures = backend.failed_tasks(job['job_id'])
+        task_indexes = sorted([t for t, f in failures.iteritems()
+                               if f in retryable and t not in retried_tasks],
+                              key=int)
+        for task_index, failure in sorted(failures.iteritems()):
+            if failure not in retryable:
+                logging.warning('Task {0} of job {1} failed for a reason that '
+                                'is not retried automatically.'
+                                .format(task_index, job['job_id']))
+        if not task_indexes:
+            continue
+        attempt = job.get('attempt', 0) + 1
+        if attempt > max_retries:
+            logging.warning('Tasks {0} of job {1} of {2} have failed {3} times, '
+                            'not retrying anymore.'.format(
+                                ','.join(task_indexes), job['job_id'],
+                                job['workload_file'], attempt))
+            continue
+
+        scale_memory = any(retryable[failures[t]][0] for t in task_indexes)
+        scale_time = any(retryable[failures[t]][1] for t in task_indexes)
+        workload_path = os.path.join(output_dir, job['workload_file'])
+        lines = read_workload_file(workload_path)
+        lines = backend.retry_workload(lines, task_indexes,
+                                       RETRY_SCALE_FACTOR if scale_memory else 1,
+                                       RETRY_SCALE_FACTOR if scale_time else 1)
+        out_fl_path = retry_file_path(workload_path, attempt)
+        try:
+            out_fl = open(out_fl_path, 'w')
+            out_fl.write('\n'.join(lines))
+            out_fl.write('\n')
+            out_fl.close()
+        except IOError as emsg:
+            raise STAPLERerror('Unable to create output file:\n{0}\n with '
+                               'error message:\n{1}'.format(out_fl_path,
+                                                            str(emsg)))
+
+        task_count = backend.task_count(lines)
+        job_id = backend.submit(out_fl_path, job['dependencies'],
+                                dependency_type)
+        logging.info('Submitted tasks {0} of job {1} as job {2}.'.format(
+            ','.join(task_indexes), job['job_id'], job_id))
+        retry = {'workload_file': os.path.basename(out_fl_path),
+                 'job_id': job_id,
+                 'dependencies': list(job['dependencies']),
+                 'retry_of': job['job_id'],
+                 'attempt': attempt,
+                 'tasks': task_indexes,
+                 'failures': dict((t, failures[t]) for t in task_indexes)}
+        if task_count is not None:
+            retry['task_count'] = task_count
+        latest['jobs'].append(retry)
+        retries.append(retry)
+
+        # Jobs waiting for the failed job (or its earlier retries) would never
+        # start (afterok) or would start without the retried tasks (afterany),
+        # so they are set to wait for the retry instead
+        waited_jobs = set([job['job_id']]) | set(
+            other['job_id'] for other in latest['jobs']
+            if other.get('retry_of') == job['job_id'] and other is not retry)
+        for other in latest['jobs']:
+            if not waited_jobs & set(other['dependencies']) or \
+                    set(other.get('states', {'PENDING': 1})) != set(['PENDING']):
+                continue
+            dependencies = [d for d in other['dependencies']
+                            if d != job['job_id']] + [job_id]
+            try:
+                backend.update_dependencies(other['job_id'], dependencies,
+                                            dependency_type)
+            except STAPLERerror as emsg:
+                logging.warning('Unable to update the dependencies of job {0}:'
+                                '\n{1}'.format(other['job_id'], str(emsg)))
+                continue
+            other['dependencies'] = dependencies
+    write_submissions(output_dir, submissions)
+    return retries
@@ -39,26 +39,51 @@ class bgzip(GenericBase):
     output_types = ['.vcf', '.gff', '.bed', '.sam', '.vcf.gz']
     hidden_mandatory_args = ['-!i', '-!o', '-!d']
     user_mandatory_args = []
-    remove_user_args = user_mandatory_args
-    user_optional_args = ['-b', '-d', '-i', '-s']
+    remove_user_args = user_mandatory_args + ['--!index']
+    user_optional_args = ['-@', '-b', '-d', '-i', '-l', '-s', '--!index']
     parallelizable = True
     help_description = '''
 Tested with bgzip version 1.2.1.
 
 When the input file has a .gz file extension (and -d parameter is not
-included) the input file is expected to be compressed with gzip. In this case
-thw file will first be decompressed with zcat and then compressed with bgzip.
-This decompression creates a temporary intermediate file into the output
-directory (with a .tmp file extension). The .tmp files will be removed after
-bgzip compression. In this case the output of this command includes three
-lines: decompression with zcat, compression with bgzip and removal of the
-decompressed file. Notice that if the run is aborted before finishing, the tmp
-files will remain the output directory.
+included) the input file is expected to be compressed with gzip or bgzip. If
+the file is compressed with bgzip already, it is copied to the output
+directory as it is. Otherwise the file is decompressed and compressed again
+with bgzip in a single pipeline, so no decompressed intermediate files are
+written to the disk.
+
+The number of compression threads can be defined with the -@ parameter. The
+-i parameter creates a .gzi index for the output file while the file is being
+compressed.
+
+The --!index parameter creates a tabix index for the output file right after
+the file has been written (i.e. while it is still in the file system cache),
+so a separate stapler_tabix step is not needed. The value defines the index
+format, either tbi or csi, e.g. --!index tbi. The file format is inferred
+from the file extension (vcf, bed, gff or sam).
 
 Notice! The parameter -f is always included in the output so that shell script
 can be rerun without interactive session (eg. sbatched to SLURM).
 '''
 
+    def _validate_user_input(self, in_cmd):
+        """Ensures the user has included all mandatory arguments.
+
+        Parameters:
+        in_cmd: String the user has input.
+
+        Raises:
+        STAPLERerror: Invalid format.
+        """
+        GenericBase._validate_user_input(self, in_cmd)
+        if '--!index' in in_cmd:
+            if in_cmd['--!index'] not in ('tbi', 'csi'):
+                raise STAPLERerror('--!index parameter of {0} requires either '
+                                   'tbi or csi as value!'.format(self.name))
+            if '-d' in in_cmd:
+                raise STAPLERerror('--!index parameter of {0} can not be used '
+                                   'when decompressing!'.format(self.name))
+
 
     def _select_IO(self, out_cmd, in_dir, out_dir):
         """Infers the input and output file paths.
@@ -100,10 +125,9 @@ can be rerun without interactive session (eg. sbatched to SLURM).
                         IO_files['-!o'] = output_path
                     else: # compress the input file
                         if os.path.splitext(fl.name)[1] == '.gz':
-                            # file is assumed to be compressed with regular gzip,
+                            # file may be compressed with regular gzip,
                             # so it must be decompressed and then compressed again with bgzip
-                            IO_files['-!d'] = os.path.join(out_dir.path,
-                                                           os.path.splitext(fl.name)[0] + '.tmp')
+                            IO_files['-!d'] = True
                             output_name = fl.name
                         else:
                             output_name = fl.name + '.gz'
@@ -132,22 +156,48 @@ can be rerun without interactive session (eg. sbatched to SLURM).
         for arg, val in self.out_cmd.iteritems():
             if arg not in self.hidden_mandatory_args:
                 user_parameters.append(arg + ' ' + val)
+        if '-i' in self.out_cmd:
+            # Index of the stdout output must be named explicitly
+            user_parameters.append('-I {0}.gzi'.format(self.out_cmd['-!o']))
 
         if self.out_cmd['-!d'] is None: # i.e. input file is not compressed
             final_cmd = ('{0} -c {1} {2} > {3}'.format(run_command,
                                                        ' '.join(user_parameters),
                                                        self.out_cmd['-!i'],
                                                        self.out_cmd['-!o']))
-            final_cmd = [final_cmd]
         else: # i.e. input file is compressed
-            final_cmd = ['zcat {0} > {1}'.format(self.out_cmd['-!i'],
-                                                 self.out_cmd['-!d'])]
-            final_cmd.append(('{0} -f -c {1} {2} > {3}'.format(run_command,
-                                                               ' '.join(user_parameters),
-                                                               self.out_cmd['-!d'],
-                                                               self.out_cmd['-!o'])))
-            final_cmd.append('rm -f {0}'.format(self.out_cmd['-!d']))
-        return final_cmd
+            # Files compressed with bgzip already contain the BC extra field
+            # (bytes 13-14 of the header) and can be copied as they are.
+            # Other files are streamed through decompression to bgzip.
+            threads = ''
+            if '-@' in self.out_cmd:
+                threads = '-@ {0} '.format(self.out_cmd['-@'])
+            copy_cmd = 'cp -f {0} {1}'.format(self.out_cmd['-!i'],
+                                              self.out_cmd['-!o'])
+            if '-i' in self.out_cmd:
+                copy_cmd += ' && {0} -r {1}'.format(run_command,
+                                                    self.out_cmd['-!o'])
+            final_cmd = ('if head -c 14 {0} | tail -c 2 | grep -q BC; '
+                         'then {1}; '
+                         'else {2} -d -c {3}{0} | {2} -f -c {4} > {5}; fi'
+                         .format(self.out_cmd['-!i'],
+                                 copy_cmd,
+                                 run_command,
+                                 threads,
+                                 ' '.join(user_parameters),
+                                 self.out_cmd['-!o']))
+
+        if '--!index' in self.parsed_in_cmd:
+            tabix_command = utils.parse_config(tabix.name, 'cmd_name', 'execute')
+            index_format = ''
+            if self.parsed_in_cmd['--!index'] == 'csi':
+                index_format = '-C '
+            final_cmd += ' && {0} -f {1}-p {2} {3}'.format(
+                tabix_command,
+                index_format,
+                utils.splitext(self.out_cmd['-!o'])[-1].split('.')[1],
+                self.out_cmd['-!o'])
+        return [final_cmd]
 
 
 class tabix(GenericBase):
@@ -40,6 +40,8 @@ class trimmomatic(GenericBase):
     name = 'stapler_trimmomatic'
     #Accept all defined types:
     input_types = {'.fastq'}
+    compressed_input_types = input_types
+    native_compressions = {'.gz', '.bz2'}
     output_types = ['.fastq']
     hidden_mandatory_args = ['--!fastq1', '--!out_1', '-threads']
     user_mandatory_args = ['-threads']
@@ -114,6 +116,17 @@ samplename_R2, the --!read_format argument should look like this:
                                'command! It is mandatory in --!PE mode!'.format(self.name))
 
 
+    def _paired_output_name(self, input_name):
+        """Returns the output file name of a paired end input file.
+
+        Trimmomatic compresses the output by its file extension, so the output
+        is compressed like the input only if the compression is supported.
+        """
+        if utils.compression_extension(input_name) in self.native_compressions:
+            return input_name
+        return utils.splitext(input_name)[0] + \
+               utils.uncompressed_extension(input_name)
+
     def _select_IO(self, out_cmd, in_dir, out_dir):
         """Infers the input and output file paths.
 
@@ -156,7 +169,7 @@ samplename_R2, the --!read_format argument should look like this:
             paired_files = in_dir.file_pairs(pattern=self.parsed_in_cmd[
                 '--!read_format'],
                                              user=self.name,
-                                             file_formats=list(self.input_types),
+                                             file_formats=list(self.accepted_input_types()),
                                              exclusion_iterable=['pairless',
                                                                  'unmatched'])
             if not paired_files:
@@ -177,17 +190,21 @@ samplename_R2, the --!read_format argument should look like this:
                     in_dir.use_file(pair2, self.name)
 
                     #Infer output
-                    IO_files['--!out_1'] = os.path.join(out_dir.path, pair1)
-                    IO_files['--!out_2'] = os.path.join(out_dir.path, pair2)
+                    IO_files['--!out_1'] = os.path.join(out_dir.path,
+                                                        self._paired_output_name(pair1))
+                    IO_files['--!out_2'] = os.path.join(out_dir.path,
+                                                        self._paired_output_name(pair2))
 
                     IO_files['--!out_unpaired_1'] = os.path.join(out_dir.path,
-                                                                 pair1+'.pairless_1.out')
+                                                                 self._paired_output_name(pair1) +
+                                                                 '.pairless_1.out')
                     IO_files['--!out_unpaired_2'] = os.path.join(out_dir.path,
-                                                                 pair2+'.pairless_2.out')
-                    file_names.add(pair1)
-                    out_dir.add_file(pair1)
-                    file_names.add(pair2)
-                    out_dir.add_file(pair2)
+                                                                 self._paired_output_name(pair2) +
+                                                                 '.pairless_2.out')
+                    file_names.add(self._paired_output_name(pair1))
+                    out_dir.add_file(self._paired_output_name(pair1))
+                    file_names.add(self._paired_output_name(pair2))
+                    out_dir.add_file(self._paired_output_name(pair2))
                     break
 
         if '--!SE' in self.parsed_in_cmd:
@@ -195,7 +212,7 @@ samplename_R2, the --!read_format argument should look like this:
             file_names = set()
             for fl in in_dir.files:
                 if self.name not in fl.users:
-                    if utils.splitext(fl.name)[-1] in self.input_types:
+                    if utils.splitext(fl.name)[-1] in self.accepted_input_types():
                         IO_files['--!fastq1'] = os.path.join(in_dir.path,
                                                              fl.name)
                         command_ids = [utils.infer_path_id(IO_files['--!fastq1'])]
@@ -10,6 +10,10 @@ import directory
 import utils
 
 
+# File extensions of files that are not compressed again
+COMPRESSED_EXTENSIONS = set(['.gz', '.bz2', '.zst', '.bam', '.cram', '.bai'])
+
+
 class gzip(GenericBase):
     """Superclass for STAPLER input classes.
 
@@ -40,6 +44,8 @@ class gzip(GenericBase):
     """
 
     name = 'stapler_gzip'
+    compressed_extension = '.gz'
+    thread_arg = None
     input_types = set(['.gz'])
     output_types = []
     require_output_dir = False
@@ -85,11 +91,11 @@ with .gz file extension are used as an input.
         for fl in in_dir.files:
             if self.name not in fl.users:
                 if '-d' in out_cmd or '--decompress' in out_cmd or '--uncompress' in out_cmd: # Decompress input file, is .gz ending
-                    if os.path.splitext(fl.name)[1] != '.gz': continue
+                    if os.path.splitext(fl.name)[1] != self.compressed_extension: continue
                     output_name = os.path.splitext(fl.name)[0]
-                else: # Compress input file, must not have .gz ending
-                    output_name = fl.name + '.gz'
-                    if os.path.splitext(fl.name)[1] == '.gz': continue
+                else: # Compress input file, must not be compressed already
+                    output_name = fl.name + self.compressed_extension
+                    if os.path.splitext(fl.name)[1] in COMPRESSED_EXTENSIONS: continue
 
                 IO_files['-!i'] = os.path.join(in_dir.path, fl.name)
                 command_ids = [utils.infer_path_id(IO_files['-!i'])]
@@ -114,9 +120,108 @@ with .gz file extension are used as an input.
         """
         run_command = utils.parse_config(self.name, 'cmd_name', 'execute')
         final_cmd = [run_command]
-        final_cmd.append(self.out_cmd['-!i'])
         for arg, val in self.out_cmd.iteritems():
-            if arg == '-!i': continue
-            print arg, val
-            final_cmd.append(arg + ' ' + val)
+            if arg in self.hidden_mandatory_args: continue
+            final_cmd.append((arg + ' ' + val).strip())
+        final_cmd.append(self.out_cmd['-!i'])
         return [' '.join(final_cmd)]
+
+
+class pigz(gzip):
+    """Parallel gzip (de)compression of the input directory contents.
+
+    The output is identical in format to gzip output, but compression uses
+    the number of threads defined with the -p parameter.
+    """
+
+    name = 'stapler_pigz'
+    thread_arg = '-p'
+    user_optional_args = gzip.user_optional_args + ['-p', '-b', '-i',
+                                                    '--processes', '--blocksize',
+                                                    '--independent']
+    help_description = '''
+STAPLER uses pigz to compresses or decompress the contents of input
+directory. (De)Compressed files replace the input files in the input
+directory (!!!), therefore output directory is not created. The number of
+compression threads can be defined with the -p parameter.
+
+When compressing files any file type is a valid input. When decompressing
+(i.e. when -d, --uncompress or --decompress parameters are present) only files
+with .gz file extension are used as an input.
+'''
+
+
+class bgzip_in_place(gzip):
+    """Blocked gzip (de)compression of the input directory contents.
+
+    Unlike stapler_bgzip, the compressed files replace the input files. BGZF
+    files are readable with gzip and can be indexed with tabix, so this is the
+    preferred compressor for FASTQ and VCF files.
+    """
+
+    name = 'stapler_bgzip_in_place'
+    thread_arg = '-@'
+    user_optional_args = ['-@', '-d', '-f', '-i', '-k', '-l', '--threads',
+                          '--decompress', '--force', '--index', '--keep',
+                          '--compress-level']
+    help_description = '''
+STAPLER uses bgzip to compresses or decompress the contents of input
+directory. (De)Compressed files replace the input files in the input
+directory (!!!), therefore output directory is not created. The number of
+compression threads can be defined with the -@ parameter. The compressed
+files can be indexed with tabix.
+
+When compressing files any file type is a valid input. When decompressing
+(i.e. when -d or --decompress parameters are present) only files with .gz
+file extension are used as an input.
+
+Notice! The parameter -f is always included in the output so that shell script
+can be rerun without interactive session (eg. sbatched to SLURM).
+'''
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        if '-f' not in self.out_cmd and '--force' not in self.out_cmd:
+            self.out_cmd['-f'] = ''
+        return gzip.get_cmd(self)
+
+
+class zstd(gzip):
+    """Zstandard (de)compression of the input directory contents."""
+
+    name = 'stapler_zstd'
+    compressed_extension = '.zst'
+    thread_arg = '-T'
+    input_types = set(['.zst'])
+    user_optional_args = ['-1', '-2', '-3', '-4', '-5', '-6', '-7', '-8', '-9',
+                          '-10', '-11', '-12', '-13', '-14', '-15', '-16', '-17',
+                          '-18', '-19', '-d', '-f', '-k', '-q', '-T', '-v',
+                          '--fast', '--long', '--decompress', '--force', '--keep',
+                          '--quiet', '--verbose']
+    help_description = '''
+STAPLER uses zstd to compresses or decompress the contents of input
+directory. (De)Compressed files replace the input files in the input
+directory (!!!), therefore output directory is not created. The number of
+compression threads can be defined with the -T parameter.
+
+When compressing files any file type is a valid input. When decompressing
+(i.e. when -d or --decompress parameters are present) only files with .zst
+file extension are used as an input.
+
+Notice! The parameters --rm and -q are always included in the output so that
+the input files are replaced similarly to gzip.
+'''
+
+    def get_cmd(self):
+        """Returns the final command line.
+
+        Returns:
+        final_cmd: List of command line produced by the object (line breaks not allowed within command lines!).
+        """
+        self.out_cmd['--rm'] = ''
+        self.out_cmd['-q'] = ''
+        return gzip.get_cmd(self)
@@ -1,7 +1,9 @@
 """Commonly used functions."""
 
+import hashlib
 import logging
 import os
+import pipes
 
 from STAPLERerror import STAPLERerror
 from STAPLERerror import NotConfiguredError
@@ -11,6 +13,29 @@ CONFIG_FILE_PATH = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__
 CONFIG_FILE_PATH = os.path.split(CONFIG_FILE_PATH)[0]
 CONFIG_FILE_PATH = os.path.join(CONFIG_FILE_PATH, 'config.txt')
 
+# Define the path of the runtime command launcher run by the subshell files
+LAUNCHER_PATH = os.path.join(os.path.dirname(CONFIG_FILE_PATH), 'modules', 'launcher.py')
+
+# Define the path of the task dispatcher run by the packed whole-node jobs
+DISPATCHER_PATH = os.path.join(os.path.dirname(CONFIG_FILE_PATH), 'modules', 'dispatcher.py')
+
+# Define the path of the FASTQ splitter run by the shard commands of aligners
+FASTQ_SPLITTER_PATH = os.path.join(os.path.dirname(CONFIG_FILE_PATH), 'modules', 'fastq_split.py')
+
+# Node-local shared memory file system used for staging reference indexes
+SHARED_MEMORY_DIR = '/dev/shm'
+
+# Extensions of compressed files and the commands decompressing them to stdout
+DECOMPRESSION_COMMANDS = {'.gz': 'gzip -dc',
+                          '.bz2': 'bzip2 -dc',
+                          '.xz': 'xz -dc',
+                          '.zst': 'zstd -dc'}
+
+# A failed decompression inside a process substitution does not affect the
+# exit status of the command, so it creates the file named by this variable
+# of the subshell instead (see decompression_stream)
+STREAM_FAILURE_VARIABLE = 'STAPLER_STREAM_FAILED'
+
 # The following commands need not to be in config.txt
 CONFIG_FILE_OMITTED_COMMANDS = set(['CUSTOM', 'bayenv2', 'vcf_sort'])
 
@@ -359,6 +384,7 @@ def splitext(absolute_path):
 
     gives .<ext>.gz extension for gzip compressed files
     gives .<ext>.bz2 extension for bz2 compressed files
+    (and similarly for the other extensions of DECOMPRESSION_COMMANDS)
 
     Parameters:
     file_name: name of the file
@@ -366,7 +392,7 @@ def splitext(absolute_path):
     Returns: a list of [basename, extension (empty string if no extension)]
     """
     splitexted_absolute_path = os.path.splitext(absolute_path)
-    if splitexted_absolute_path[1] in ('.gz', '.bz2'):
+    if splitexted_absolute_path[1] in DECOMPRESSION_COMMANDS:
         twice_splitexted_absolute_path = os.path.splitext(splitexted_absolute_path[0])
         if not twice_splitexted_absolute_path[1]: # i.e. <basename>.gz
             return splitexted_absolute_path
@@ -377,6 +403,58 @@ def splitext(absolute_path):
         return os.path.splitext(absolute_path)
 
 
+def compression_extension(path):
+    """Returns the compression extension of a file path.
+
+    Parameters:
+    path: Path to a file.
+
+    Returns:
+    Extension (e.g. .gz) or an empty string if the file is not compressed.
+    """
+    extension = os.path.splitext(path)[1]
+    if extension in DECOMPRESSION_COMMANDS:
+        return extension
+    return ''
+
+
+def uncompressed_extension(path):
+    """Returns the file extension of a file path without the compression
+    extension, e.g. .fastq for reads.fastq.gz.
+
+    Parameters:
+    path: Path to a file.
+
+    Returns:
+    Extension or an empty string if the file has no extension.
+    """
+    compression = compression_extension(path)
+    if compression:
+        path = path[:-len(compression)]
+    return os.path.splitext(path)[1]
+
+
+def decompression_stream(path):
+    """Returns a process substitution reading a compressed file decompressed.
+
+    The substitution can be used in place of the file path in bash command
+    lines for tools that can not read the compressed file themselves. If the
+    decompression fails, the file named by STREAM_FAILURE_VARIABLE is
+    created.
+
+    Parameters:
+    path: Path to a compressed file.
+
+    Returns:
+    Process substitution string, e.g.
+    <(gzip -dc file.fastq.gz || : > "${STAPLER_STREAM_FAILED:-/dev/null}")
+    """
+    return '<({0} {1} || : > "${{{2}:-/dev/null}}")'.format(
+        DECOMPRESSION_COMMANDS[compression_extension(path)],
+        pipes.quote(path),
+        STREAM_FAILURE_VARIABLE)
+
+
 def infer_path_id(path):
     """Infers the ID of a directory or a file.
 
@@ -391,3 +469,65 @@ def infer_path_id(path):
     path = os.path.basename(path)
     return path.split('.', 1)[0]
 
+
+def shared_memory_path(path):
+    """Returns a node-local shared memory path for staging a file.
+
+    The name contains a hash of the absolute path, so each staged file gets
+    the same name on every node and different files never share a name.
+
+    Parameters:
+    path: Path of the file (or file name prefix) to stage.
+
+    Returns:
+    Path in the shared memory file system.
+    """
+    digest = hashlib.md5(os.path.abspath(path)).hexdigest()[:8]
+    return os.path.join(SHARED_MEMORY_DIR, 'stapler_{0}_{1}'.format(
+        os.path.basename(path), digest))
+
+
+def locked_command(lock_path, command):
+    """Returns a shell command which runs command holding an exclusive lock.
+
+    Concurrent tasks running the command on the same node wait for the first
+    one to finish it.
+
+    Parameters:
+    lock_path: Path of the lock file.
+    command: Shell command to run.
+
+    Returns:
+    Command line string.
+    """
+    return 'flock {0} sh -c {1}'.format(pipes.quote(lock_path),
+                                        pipes.quote(command))
+
+
+def shared_resource_command(lock_path, stage_command, command,
+                            release_command):
+    """Returns a shell command line which runs command using a resource
+    staged once per node (e.g. a reference index in shared memory).
+
+    The command line holds a shared lock on lock_path from staging the
+    resource until command has finished. The resource is released afterwards
+    if no other command on the node holds the lock, so it does not stay in
+    memory after its last user. Releasing needs an exclusive lock, so a
+    resource is never released while another command is staging or using it.
+    Locks of killed commands are released by the kernel.
+
+    Parameters:
+    lock_path: Path of the lock file of the users of the resource.
+    stage_command: Shell command staging the resource, if not staged yet.
+    command: Shell command using the resource.
+    release_command: Shell command releasing the resource.
+
+    Returns:
+    Command line string, exiting with the exit code of staging or command.
+    """
+    return ('{{ stapler_shared_rc=0; flock -s 9 && {{ {0}; }} && {{ {1}; }} '
+            '|| stapler_shared_rc=$?; flock -n -x 9 && {{ {2}; }} || :; '
+            '(exit $stapler_shared_rc); }} 9>>{3}'.format(stage_command,
+                                                          command,
+                                                          release_command,
+                                                          pipes.quote(lock_path)))